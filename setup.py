@@ -21,6 +21,7 @@ setup(
     include_package_data=True,
     install_requires=[
         "boto3",
+        "numpy",
         "psycopg2-binary",
         "pyfcm",
         "pytz",
@@ -30,7 +31,10 @@ setup(
             "set-lambda-env=smbbackend.awsutils:main_set_lambda_env",
             "convert-spatialite=smbbackend.convertspatialfiles:main",
             "ingest-tracks=smbbackend.standalonehandlers:main",
-            "process-tracks-locally=smbbackend.ingestiontester:main"
+            "process-tracks-locally=smbbackend.ingestiontester:main",
+            "backfill-indexes=smbbackend.backfillindexes:main",
+            "create-backend-tables=smbbackend.dbschema:main",
+            "prepare-regions=smbbackend.regions:main",
         ]
     }
 )
\ No newline at end of file
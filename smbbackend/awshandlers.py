@@ -14,12 +14,14 @@ import json
 import logging
 import os
 import re
+import time
 import typing
 
 from pyfcm import FCMNotification
 
 from . import calculateindexes
 from . import calculateprizes
+from .exceptions import DuplicateTrackError
 from .exceptions import NonRecoverableError
 from . import processor
 from . import notifications
@@ -36,15 +38,34 @@ DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 SNS_TOPIC = os.getenv("SNS_TOPIC")
 USE_SYNCHRONOUS_EXECUTION = os.getenv("SYNCHRONOUS_EXECUTION", "").lower()
+# either `python` (the default) or `database`
+INDEXES_CALCULATION_MODE = os.getenv(
+    "INDEXES_CALCULATION_MODE", "python").lower()
+# number of competitions that are closed concurrently, each one with its own
+# DB connection. With `1` (the default) they are closed one after the other
+COMPETITIONS_WORKERS = int(os.getenv("COMPETITIONS_WORKERS", "1"))
+# minimum remaining execution time, in milliseconds, for running the next
+# track processing stage in the same lambda invocation. With less time left
+# the next stage is handed off through SNS
+HANDOFF_THRESHOLD_MS = int(os.getenv("HANDOFF_THRESHOLD_MS", "60000"))
+# number of processes used for parsing the members of uploaded archives.
+# Members are parsed serially if processes cannot be started
+PARSING_WORKERS = int(os.getenv("PARSING_WORKERS", "2"))
+# key of the SNS payloads whose next stage has already been run in-process
+HANDLED_IN_PROCESS_KEY = "handled_in_process"
 FCM_PUSH_SERVICE = FCMNotification(api_key=os.getenv("FCM_SERVER_KEY"))
 
 
 def update_competitions(notify_completion=True):
     """Handler for periodically updating competitions"""
     _setup_logging()
-    with _get_db_connection() as connection:
-        with connection.cursor() as cursor:
-            competition_results = calculateprizes.calculate_prizes(cursor)
+    if COMPETITIONS_WORKERS > 1:
+        competition_results = calculateprizes.calculate_prizes_concurrently(
+            _get_db_connection, max_workers=COMPETITIONS_WORKERS)
+    else:
+        with _get_db_connection() as connection:
+            with connection.cursor() as cursor:
+                competition_results = calculateprizes.calculate_prizes(cursor)
     if notify_completion:
         with _get_db_connection() as connection:
             with connection.cursor() as cursor:
@@ -73,6 +94,9 @@ def aws_track_handler(event: dict, context):
     logger.info("handler: {}".format(handler))
     with _get_db_connection() as connection:
         with connection.cursor() as cursor:
+            if handler == modular_track_handler:
+                return handler(
+                    message_type, message_arguments, cursor, context=context)
             return handler(message_type, message_arguments, cursor)
 
 
@@ -85,6 +109,7 @@ def compact_track_handler(message_type:MessageType, message_arguments: dict,
             db_cursor, notify_completion=notify, **message_arguments)
         track_id, is_valid = ingest_track(
             db_cursor, bucket_name, object_key, owner_uuid,
+            etag=message_arguments.get("etag"),
             notify_completion=notify
         )
         logger.debug(f"track_id: {track_id} - is_valid: {is_valid}")
@@ -98,33 +123,80 @@ def compact_track_handler(message_type:MessageType, message_arguments: dict,
 
 
 def modular_track_handler(message_type:MessageType, message_arguments: dict,
-                          db_cursor):
-    """Handler for track-related stuff that does a single task
+                          db_cursor, context=None):
+    """Handler for track-related stuff that does one task at a time
 
-    When the execution of each task is completed, a new SNS message is
-    published. This message is asynchronously pcked up by the lambda again
-    in order to execute the next task.
+    The DB transaction is committed after each task. Each task publishes its
+    SNS message, which is asynchronously picked up by the lambda again in
+    order to execute the next task. If the lambda ``context`` reports that
+    there is enough time left, the next task is instead run in the same
+    invocation. In this case the SNS message is still published, but it is
+    marked as handled in-process, so that the lambda ignores it.
+
+    Whether the next task is run in-process is decided before running the
+    current one, using the slowest task so far as an estimate of its
+    duration.
+
+    If an in-process task fails, or the lambda times out, the tasks that
+    were already committed are kept. The lambda then retries the original
+    message. Its tasks are resumed from the first one that has not been
+    completed, since completed tasks are skipped.
 
     """
 
-    notify = True
-    handler = {
-        MessageType.s3_received_track: get_new_track_info,
-        MessageType.track_uploaded: ingest_track,
-        MessageType.track_validated: calculate_indexes,
-        MessageType.indexes_have_been_calculated: update_badges,
-        MessageType.badges_have_been_updated: None  # a handler to notify the app
-    }.get(message_type)
-    logger.info("message_type: {}".format(message_type))
-    logger.info("handler: {}".format(handler))
-    if handler is not None:
-        handler(db_cursor, notify_completion=notify, **message_arguments)
-    else:
+    if message_arguments.pop(HANDLED_IN_PROCESS_KEY, False):
         logger.info(
-            "Could not handle message of type {!r}".format(message_type.name))
+            "Ignoring message {!r}, which has already been handled "
+            "in-process".format(message_type.name)
+        )
+        return
+    longest_stage_ms = 0
+    while True:
+        handler = _TRACK_STAGES.get(message_type)
+        logger.info("message_type: {}".format(message_type))
+        logger.info("handler: {}".format(handler))
+        if handler is None:
+            logger.info(
+                "Could not handle message of type {!r}".format(
+                    message_type.name)
+            )
+            break
+        next_message = _get_next_track_message(message_type)
+        remaining_ms = (
+            context.get_remaining_time_in_millis() if context is not None
+            else 0
+        )
+        handoff = (
+            _TRACK_STAGES.get(next_message) is None or
+            remaining_ms - longest_stage_ms < max(
+                HANDOFF_THRESHOLD_MS, longest_stage_ms * 2)
+        )
+        started = time.monotonic()
+        result = handler(
+            db_cursor,
+            notify_completion=True,
+            handoff=handoff,
+            **message_arguments
+        )
+        db_cursor.connection.commit()
+        longest_stage_ms = max(
+            longest_stage_ms, (time.monotonic() - started) * 1000)
+        next_arguments = _get_next_track_arguments(
+            message_type, message_arguments, result)
+        if next_arguments is None:
+            break
+        if handoff:
+            logger.info(
+                "Handed off {!r} with {} ms left".format(
+                    next_message.name, remaining_ms)
+            )
+            break
+        message_type = next_message
+        message_arguments = next_arguments
 
 
-def get_new_track_info(db_cursor, bucket_name, object_key, **kwargs):
+def get_new_track_info(db_cursor, bucket_name, object_key, etag=None,
+                       handoff=True, **kwargs):
     """Forward S3 message to both SNS and mobile apps.
 
     This function grabs the notification sent by S3 and passes it through our
@@ -140,25 +212,53 @@ def get_new_track_info(db_cursor, bucket_name, object_key, **kwargs):
             "Could not determine track owner for object {}".format(object_key))
     _send_notification(
         MessageType.track_uploaded,
-        message_payload={
+        message_payload=_get_stage_payload({
             "bucket_name": bucket_name,
             "object_key": object_key,
+            "etag": etag,
             "owner_uuid": owner_uuid,
-        }
+        }, handoff)
     )
     return bucket_name, object_key, owner_uuid
 
 
-def ingest_track(db_cursor, bucket_name, object_key, owner_uuid,
-                 notify_completion=True, **kwargs) -> typing.Tuple[int, bool]:
-    try:
+def ingest_track(db_cursor, bucket_name, object_key, owner_uuid, etag=None,
+                 notify_completion=True, handoff=True,
+                 **kwargs) -> typing.Tuple[int, bool]:
+    """Ingest an uploaded track and return its id and validity
+
+    Duplicate uploads are acknowledged without any processing. In this case
+    the id and validity of the existing track are returned, so that any of
+    its later stages that have not been completed, for example because a
+    previous invocation failed midway, are resumed. Stages that have been
+    completed are skipped by their handlers.
 
-        raw_data = processor.get_data_from_s3(bucket_name, object_key)
-        segments_data, track_id, session_id = processor.ingest_data(
-            raw_data, owner_uuid, db_cursor)
+    """
+
+    try:
+        if etag is not None:
+            processor.claim_track_upload(object_key, etag, db_cursor)
+        points = processor.parse_points_from_s3(
+            bucket_name, object_key, max_workers=PARSING_WORKERS)
+        segments_data, track_id, session_id = processor.ingest_points(
+            points, owner_uuid, db_cursor, object_key=object_key, etag=etag)
         is_valid = processor.is_track_valid(segments_data)
         validation_errors = [s[2] for s in segments_data]
         flattened_errors = _flatten_validation_errors(validation_errors)
+    except DuplicateTrackError as exc:
+        logger.info("Skipping duplicate upload: {}".format(exc.args[0]))
+        if exc.track_id is None:
+            return None, False
+        is_valid = utils.get_track_info(exc.track_id, db_cursor).is_valid
+        if is_valid and handoff:
+            _send_notification(
+                MessageType.track_validated,
+                message_payload={
+                    "track_id": exc.track_id,
+                    "owner_uuid": owner_uuid,
+                }
+            )
+        return exc.track_id, is_valid
     except NonRecoverableError as exc:
         logger.exception("Could not perform track ingestion")
         track_id = None
@@ -169,13 +269,14 @@ def ingest_track(db_cursor, bucket_name, object_key, owner_uuid,
     if notify_completion:
         _send_notification(
             MessageType.track_validated,
-            message_payload={
+            message_payload=_get_stage_payload({
                 "user_uuid": owner_uuid,
+                "owner_uuid": owner_uuid,
                 "track_id": track_id,
                 "session_id": session_id,
                 "is_valid": is_valid,
                 "validation_errors": flattened_errors
-            },
+            }, handoff),
             use_fcm=True,
             fcm_devices={
                 owner_uuid: get_user_active_devices(db_cursor, owner_uuid)
@@ -185,40 +286,66 @@ def ingest_track(db_cursor, bucket_name, object_key, owner_uuid,
 
 
 def calculate_indexes(db_cursor, track_id, owner_uuid,
-                      notify_completion=True, **kwargs):
+                      notify_completion=True, handoff=True,
+                      **kwargs) -> bool:
+    """Calculate the track's indexes and return whether the track is valid"""
     track_info = utils.get_track_info(track_id, db_cursor)
     if not track_info.is_valid:
         logger.debug(
             "Track {} is not valid, aborting...".format(track_id))
+    elif not processor.claim_track_stage(track_id, "indexes", db_cursor):
+        logger.info(
+            "Indexes of track {} have already been calculated".format(
+                track_id)
+        )
+        if handoff:
+            _send_notification(
+                MessageType.indexes_have_been_calculated,
+                message_payload={
+                    "track_id": track_id,
+                    "owner_uuid": owner_uuid,
+                }
+            )
     else:
-        calculateindexes.calculate_indexes(track_id, db_cursor)
+        if INDEXES_CALCULATION_MODE == "database":
+            calculateindexes.calculate_indexes_in_db([track_id], db_cursor)
+        else:
+            calculateindexes.calculate_indexes(track_id, db_cursor)
+        calculateprizes.update_track_roi_overlaps(track_id, db_cursor)
+        calculateprizes.update_track_standings(track_id, db_cursor)
         if notify_completion:
             _send_notification(
                 MessageType.indexes_have_been_calculated,
-                message_payload={
-                    "track_id": track_id
-                },
+                message_payload=_get_stage_payload({
+                    "track_id": track_id,
+                    "owner_uuid": owner_uuid,
+                }, handoff),
                 use_fcm=True,
                 fcm_devices={
                     owner_uuid: get_user_active_devices(db_cursor, owner_uuid)
                 }
             )
+    return track_info.is_valid
 
 
 def update_badges(db_cursor, track_id, owner_uuid,
-                  notify_completion=True, **kwargs):
+                  notify_completion=True, handoff=True, **kwargs):
     track_info = utils.get_track_info(track_id, db_cursor)
     if not track_info.is_valid:
         logger.debug(
             "Track {} is not valid, aborting...".format(track_id))
+    elif not processor.claim_track_stage(track_id, "badges", db_cursor):
+        logger.info(
+            "Badges of track {} have already been updated".format(track_id))
     else:
         awarded_badges = updatebadges.update_badges(track_id, db_cursor)
         if notify_completion:
             _send_notification(
                 MessageType.badges_have_been_updated,
-                message_payload={
-                    "track_id": track_id
-                }
+                message_payload=_get_stage_payload({
+                    "track_id": track_id,
+                    "owner_uuid": owner_uuid,
+                }, handoff)
             )
             for badge in awarded_badges:
                 _send_notification(
@@ -232,6 +359,63 @@ def update_badges(db_cursor, track_id, owner_uuid,
                 )
 
 
+_TRACK_STAGES = {
+    MessageType.s3_received_track: get_new_track_info,
+    MessageType.track_uploaded: ingest_track,
+    MessageType.track_validated: calculate_indexes,
+    MessageType.indexes_have_been_calculated: update_badges,
+    MessageType.badges_have_been_updated: None  # a handler to notify the app
+}
+
+
+def _get_next_track_message(message_type: MessageType):
+    return {
+        MessageType.s3_received_track: MessageType.track_uploaded,
+        MessageType.track_uploaded: MessageType.track_validated,
+        MessageType.track_validated: MessageType.indexes_have_been_calculated,
+        MessageType.indexes_have_been_calculated: (
+            MessageType.badges_have_been_updated),
+    }.get(message_type)
+
+
+def _get_stage_payload(message_payload: dict, handoff: bool) -> dict:
+    """Mark the payload if the next stage is run in the same invocation"""
+    if handoff:
+        result = message_payload
+    else:
+        result = dict(message_payload)
+        result[HANDLED_IN_PROCESS_KEY] = True
+    return result
+
+
+def _get_next_track_arguments(message_type: MessageType,
+                              message_arguments: dict,
+                              result) -> typing.Optional[dict]:
+    """Return the arguments of the next stage, or None if there is none"""
+    if message_type == MessageType.s3_received_track:
+        bucket_name, object_key, owner_uuid = result
+        next_arguments = {
+            "bucket_name": bucket_name,
+            "object_key": object_key,
+            "etag": message_arguments.get("etag"),
+            "owner_uuid": owner_uuid,
+        }
+    elif message_type == MessageType.track_uploaded:
+        track_id, is_valid = result
+        next_arguments = {
+            "track_id": track_id,
+            "owner_uuid": message_arguments["owner_uuid"],
+        } if is_valid else None
+    elif message_type == MessageType.track_validated and result:
+        next_arguments = {
+            "track_id": message_arguments["track_id"],
+            "owner_uuid": message_arguments["owner_uuid"],
+        }
+    else:
+        next_arguments = None
+    return next_arguments
+
+
 def _extract_sns_message(event: dict) -> dict:
     try:
         raw_sns_message = event["Records"][0]["Sns"]["Message"]
@@ -258,7 +442,8 @@ def _parse_message(message: dict):
         try:
             message_arguments = {
                 "bucket_name": s3_info["bucket"]["name"],
-                "object_key": s3_info["object"]["key"]
+                "object_key": s3_info["object"]["key"],
+                "etag": s3_info["object"].get("eTag"),
             }
         except KeyError:
             raise RuntimeError("Invalid S3 message")
@@ -295,6 +480,22 @@ def get_user_active_devices(db_cursor, user_uuid):
     return [row[0] for row in db_cursor.fetchall()]
 
 
+def get_users_active_devices(
+        db_cursor,
+        user_uuids: typing.List[str]
+) -> typing.Dict[str, typing.List[str]]:
+    """Return the active devices of several users with a single query"""
+    result = {}
+    if len(user_uuids) > 0:
+        db_cursor.execute(
+            utils.get_query("select-users-active-devices.sql"),
+            {"owner_uuids": list(set(user_uuids))}
+        )
+        for user_uuid, registration_id in db_cursor.fetchall():
+            result.setdefault(user_uuid, []).append(registration_id)
+    return result
+
+
 def _flatten_validation_errors(errors: typing.List[typing.List[typing.Dict]]):
     flattened_errors = ""
     for segment_errors in errors:
@@ -326,23 +527,23 @@ def _notify_competition_winners(
         ],
         db_cursor
 ):
+    prizes_won = []
     for competition_info, winners in competition_results:
-        for index, winner in enumerate(winners):
-            competition_rank = index + 1
-            user_id = winner["user"]
-            user_uuid = utils.get_user_uuid(user_id, db_cursor)
-            prize_names = calculateprizes.get_prize_names(
-                competition_info.id, competition_rank, db_cursor)
-            devices = get_user_active_devices(db_cursor, user_uuid)
-            for prize_name in prize_names:
-                _send_notification(
-                    MessageType.prize_won,
-                    message_payload={
-                        "prize_name": prize_name
-                    },
-                    use_fcm=True,
-                    fcm_devices={
-                        user_uuid: get_user_active_devices(
-                            db_cursor, user_uuid)
-                    }
-                )
+        prizes_won.extend(
+            calculateprizes.get_winners_prizes(
+                competition_info.id, winners, db_cursor)
+        )
+    devices = get_users_active_devices(
+        db_cursor, [uuid for uuid, _ in prizes_won if uuid is not None])
+    for user_uuid, prize_names in prizes_won:
+        for prize_name in prize_names:
+            _send_notification(
+                MessageType.prize_won,
+                message_payload={
+                    "prize_name": prize_name
+                },
+                use_fcm=True,
+                fcm_devices={
+                    user_uuid: devices.get(user_uuid, [])
+                }
+            )
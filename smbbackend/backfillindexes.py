@@ -0,0 +1,353 @@
+#########################################################################
+#
+# Copyright 2018, GeoSolutions Sas.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+#
+#########################################################################
+
+"""Recompute the indexes of all valid tracks
+
+This is meant to be run whenever the coefficients in ``_constants`` change.
+Segments are streamed from the DB in batches with a server-side cursor and
+their indexes are calculated with the vectorized index engine. Results are
+written back with COPY into staging tables, which are then merged into the
+index tables.
+
+Alternatively, with ``--in-database``, indexes are calculated by the DB
+itself, using the coefficients tables, so segments never leave the DB.
+
+Progress is saved to a checkpoint file after each batch, so an interrupted
+run can be resumed. Once all tracks have been processed, per-user
+statistics and competition standings are rebuilt.
+
+"""
+
+import argparse
+from functools import partial
+import io
+import json
+import logging
+import os
+import pathlib
+import typing
+
+import numpy as np
+
+from . import calculateindexes
+from . import calculateprizes
+from . import indexengine
+from . import userstats
+from ._constants import VehicleType
+from . import utils
+from .utils import get_query
+
+logger = logging.getLogger(__name__)
+
+_VEHICLE_TYPE_VALUES = {vt.name: vt.value for vt in VehicleType}
+
+_STAGING_TABLES = (
+    ("staging_emission", indexengine.EMISSION_INDEXES),
+    ("staging_cost", indexengine.COST_INDEXES),
+    ("staging_health", indexengine.HEALTH_INDEXES),
+)
+
+
+def main():
+    parser = _get_parser()
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    db_parameters = {
+        "host": args.db_host,
+        "port": args.db_port,
+        "dbname": args.db_name,
+        "user": args.db_user,
+        "password": args.db_password,
+    }
+    checkpoint_path = pathlib.Path(args.checkpoint_file).expanduser()
+    if args.restart:
+        last_track_id = 0
+    else:
+        last_track_id = read_checkpoint(checkpoint_path)
+    save_checkpoint = partial(write_checkpoint, checkpoint_path)
+    if args.in_database:
+        connection = utils.get_db_connection(**db_parameters)
+        try:
+            num_tracks = backfill_indexes_in_db(
+                connection,
+                last_track_id=last_track_id,
+                batch_size=args.tracks_batch_size,
+                on_batch_committed=save_checkpoint
+            )
+        finally:
+            connection.close()
+        logger.info(f"Recomputed indexes for {num_tracks} tracks")
+    else:
+        read_connection = utils.get_db_connection(**db_parameters)
+        write_connection = utils.get_db_connection(**db_parameters)
+        try:
+            num_tracks, num_segments = backfill_indexes(
+                read_connection,
+                write_connection,
+                last_track_id=last_track_id,
+                batch_size=args.batch_size,
+                on_batch_committed=save_checkpoint
+            )
+        finally:
+            read_connection.close()
+            write_connection.close()
+        logger.info(
+            f"Recomputed indexes for {num_tracks} tracks ({num_segments} "
+            f"segments)"
+        )
+    connection = utils.get_db_connection(**db_parameters)
+    with connection:
+        with connection.cursor() as cursor:
+            logger.info("Rebuilding user statistics...")
+            userstats.rebuild_user_stats(cursor)
+            logger.info("Rebuilding competition standings...")
+            calculateprizes.rebuild_competition_standings(cursor)
+    connection.close()
+    logger.info("Done!")
+
+
+def backfill_indexes(read_connection, write_connection, last_track_id=0,
+                     batch_size=50000,
+                     on_batch_committed: typing.Callable = None):
+    """Recompute indexes for all valid tracks after ``last_track_id``
+
+    Segments are read through ``read_connection``, using a named cursor in
+    a single transaction. Results are written and committed batch by batch
+    through ``write_connection``. Batches always contain all of the segments
+    of their tracks, so that track aggregates can be calculated in memory.
+
+    ``on_batch_committed`` is called with the id of the last processed
+    track after each batch has been committed.
+
+    """
+
+    with write_connection.cursor() as write_cursor:
+        write_cursor.execute(get_query("create-index-staging-tables.sql"))
+    write_connection.commit()
+    num_tracks = 0
+    num_segments = 0
+    read_cursor = read_connection.cursor(name="backfill_indexes")
+    read_cursor.execute(
+        get_query("select-segments-for-backfill.sql"),
+        {"last_track_id": last_track_id}
+    )
+    pending = []
+    while True:
+        rows = read_cursor.fetchmany(batch_size)
+        pending.extend(rows)
+        if len(rows) == 0:
+            complete, pending = pending, []
+        else:
+            complete, pending = _split_incomplete_track(pending)
+        if len(complete) > 0:
+            batch_track_id = _process_batch(complete, write_connection)
+            num_tracks += len(set(row[0] for row in complete))
+            num_segments += len(complete)
+            logger.info(
+                f"Processed tracks up to {batch_track_id} - total tracks: "
+                f"{num_tracks} - total segments: {num_segments}"
+            )
+            if on_batch_committed is not None:
+                on_batch_committed(batch_track_id)
+        if len(rows) == 0:
+            break
+    read_cursor.close()
+    read_connection.rollback()
+    return num_tracks, num_segments
+
+
+def backfill_indexes_in_db(connection, last_track_id=0, batch_size=1000,
+                           on_batch_committed: typing.Callable = None):
+    """Recompute indexes for all valid tracks after ``last_track_id``
+
+    Indexes are calculated with ``calculateindexes.calculate_indexes_in_db()``
+    for batches of ``batch_size`` tracks, committing after each batch.
+
+    """
+
+    num_tracks = 0
+    with connection.cursor() as cursor:
+        version = calculateindexes.load_coefficients(cursor)
+        connection.commit()
+        while True:
+            cursor.execute(
+                get_query("select-valid-track-ids.sql"),
+                {
+                    "last_track_id": last_track_id,
+                    "limit": batch_size,
+                }
+            )
+            track_ids = [row[0] for row in cursor.fetchall()]
+            if len(track_ids) == 0:
+                break
+            calculateindexes.calculate_indexes_in_db(
+                track_ids, cursor, coefficients_version=version)
+            connection.commit()
+            last_track_id = track_ids[-1]
+            num_tracks += len(track_ids)
+            logger.info(
+                f"Processed tracks up to {last_track_id} - total tracks: "
+                f"{num_tracks}"
+            )
+            if on_batch_committed is not None:
+                on_batch_committed(last_track_id)
+    return num_tracks
+
+
+def read_checkpoint(path: pathlib.Path) -> int:
+    try:
+        with path.open() as fh:
+            last_track_id = json.load(fh)["last_track_id"]
+    except FileNotFoundError:
+        last_track_id = 0
+    else:
+        logger.info(f"Resuming after track {last_track_id}...")
+    return last_track_id
+
+
+def write_checkpoint(path: pathlib.Path, last_track_id: int):
+    temporary_path = path.with_name(path.name + ".tmp")
+    with temporary_path.open("w") as fh:
+        json.dump({"last_track_id": last_track_id}, fh)
+    temporary_path.replace(path)
+
+
+def _split_incomplete_track(rows: typing.List[typing.Tuple]):
+    """Separate the rows of the last track, which may not be complete yet
+
+    Rows are expected to be sorted by track id
+
+    """
+
+    last_track_id = rows[-1][0]
+    split_index = len(rows)
+    while split_index > 0 and rows[split_index - 1][0] == last_track_id:
+        split_index -= 1
+    return rows[:split_index], rows[split_index:]
+
+
+def _process_batch(rows: typing.List[typing.Tuple], write_connection) -> int:
+    track_ids, segment_ids, vehicle_types, lengths, durations = zip(*rows)
+    track_ids = np.array(track_ids)
+    indexes = indexengine.calculate_segments_indexes(
+        np.fromiter(
+            (_VEHICLE_TYPE_VALUES[vt] for vt in vehicle_types), dtype=int),
+        np.array(lengths, dtype=float) / 1000,
+        np.array(durations, dtype=float) / (60 * 60)
+    )
+    with write_connection.cursor() as write_cursor:
+        for table_name, names in _STAGING_TABLES:
+            columns = [indexes[name].tolist() for name in names]
+            _copy_rows(
+                write_cursor,
+                table_name,
+                list(names) + ["segment_id"],
+                zip(*columns, segment_ids)
+            )
+        _copy_rows(
+            write_cursor,
+            "staging_track_aggregates",
+            [
+                "track_id",
+                "aggregated_emissions",
+                "aggregated_costs",
+                "aggregated_health"
+            ],
+            _get_track_aggregates(track_ids, indexes)
+        )
+        write_cursor.execute(get_query("merge-staged-indexes.sql"))
+    write_connection.commit()
+    return int(track_ids.max())
+
+
+def _get_track_aggregates(track_ids: np.ndarray,
+                          indexes: typing.Dict[str, np.ndarray]):
+    unique_track_ids, inverse = np.unique(track_ids, return_inverse=True)
+    totals = {
+        name: np.bincount(inverse, weights=values).tolist()
+        for name, values in indexes.items()
+    }
+    for position, track_id in enumerate(unique_track_ids.tolist()):
+        yield [track_id] + [
+            json.dumps({name: totals[name][position] for name in names})
+            for _, names in _STAGING_TABLES
+        ]
+
+
+def _copy_rows(db_cursor, table_name: str, columns: typing.List[str],
+               rows: typing.Iterable[typing.Sequence]):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(str(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    db_cursor.copy_from(buffer, table_name, columns=columns)
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-c",
+        "--checkpoint-file",
+        default="~/.smbbackend-backfill-indexes.json",
+        help="Path to the file where progress is saved. Default: "
+             "%(default)s"
+    )
+    parser.add_argument(
+        "-r",
+        "--restart",
+        action="store_true",
+        help="Ignore any existing checkpoint and process all tracks"
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        default=50000,
+        type=int,
+        help="Number of segments to fetch from the DB in each batch. "
+             "Default: %(default)s"
+    )
+    parser.add_argument(
+        "-d",
+        "--in-database",
+        action="store_true",
+        help="Calculate indexes inside the DB, using the coefficients tables. "
+             "These must have been created beforehand with the "
+             "`create-backend-tables` command"
+    )
+    parser.add_argument(
+        "-t",
+        "--tracks-batch-size",
+        default=1000,
+        type=int,
+        help="Number of tracks to process in each batch when using "
+             "`--in-database`. Default: %(default)s"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true"
+    )
+    parser.add_argument("--db-host")
+    parser.add_argument("--db-port", type=int)
+    parser.add_argument("--db-name")
+    parser.add_argument("--db-user")
+    parser.add_argument("--db-password")
+    parser.set_defaults(
+        db_host=os.getenv("DB_HOST", "localhost"),
+        db_port=int(os.getenv("DB_PORT", "5432")),
+        db_name=os.getenv("DB_NAME"),
+        db_user=os.getenv("DB_USER"),
+        db_password=os.getenv("DB_PASSWORD"),
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    main()
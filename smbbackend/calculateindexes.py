@@ -11,14 +11,22 @@
 """Calculation of smb indexes"""
 
 from collections import namedtuple
+import hashlib
+import json
 import logging
+import typing
 
-from . import _constants
+import numpy as np
+from psycopg2.extras import execute_values
+
+from . import indexengine
 from ._constants import VehicleType
 from .utils import get_query
 
 logger = logging.getLogger(__name__)
 
+_COEFFICIENTS_VERSION_CACHE = {}
+
 _DATA_FIELDS = [
     "accelerationX",
     "accelerationY",
@@ -54,6 +62,13 @@ SegmentInfo = namedtuple("SegmentInfo", [
     "speed_km_h"
 ])
 
+# the order of the indexes matches the columns of the `insert-*.sql` queries
+_INDEX_GROUPS = (
+    indexengine.EMISSION_INDEXES,
+    indexengine.COST_INDEXES,
+    indexengine.HEALTH_INDEXES,
+)
+
 
 def calculate_indexes(track_id: str, db_cursor):
     """Calculate indexes for the input track
@@ -64,36 +79,186 @@ def calculate_indexes(track_id: str, db_cursor):
     """
 
     segments_info = get_segments_info(track_id, db_cursor)
-    for index, info in enumerate(segments_info):
-        emissions = calculate_emissions(
-            info.vehicle_type, info.length_km)
-        costs = calculate_costs(
-            info.vehicle_type, info.length_km, info.duration_hours)
-        duration_minutes = info.duration_hours * 60
-        health = calculate_health(
-            info.vehicle_type, duration_minutes, info.speed_km_h)
-        insert_segment_data(info.id, emissions, costs, health, db_cursor)
-    update_track_aggregated_data(track_id, db_cursor)
-
-
-def update_track_aggregated_data(track_id, db_cursor):
-    query_kwargs = {"track_id": track_id}
-    queries = [
-        "update-track-aggregated-emissions.sql",
-        "update-track-aggregated-costs.sql",
-        "update-track-aggregated-health.sql",
-    ]
-    for query_file in queries:
-        db_cursor.execute(get_query(query_file), query_kwargs)
-
-
-def insert_segment_data(segment_id, emissions, costs, health, db_cursor):
-    _perform_segment_insert(
-        "insert-emission.sql", segment_id, emissions, db_cursor)
-    _perform_segment_insert(
-        "insert-cost.sql", segment_id, costs, db_cursor)
-    _perform_segment_insert(
-        "insert-health.sql", segment_id, health, db_cursor)
+    indexes = indexengine.calculate_segments_indexes(
+        indexengine.get_vehicle_type_values(
+            info.vehicle_type for info in segments_info),
+        [info.length_km for info in segments_info],
+        [info.duration_hours for info in segments_info],
+    )
+    segment_ids = [info.id for info in segments_info]
+    insert_segments_data(segment_ids, indexes, db_cursor)
+    update_track_aggregated_data(track_id, indexes, db_cursor)
+
+
+def update_track_aggregated_data(track_id,
+                                 indexes: typing.Dict[str, np.ndarray],
+                                 db_cursor):
+    """Set the track's aggregated indexes using the in-memory segment data"""
+    emissions, costs, health = aggregate_indexes(indexes)
+    db_cursor.execute(
+        get_query("update-track-aggregated-data.sql"),
+        {
+            "track_id": track_id,
+            "emissions": json.dumps(emissions) if emissions else None,
+            "costs": json.dumps(costs) if costs else None,
+            "health": json.dumps(health) if health else None,
+        }
+    )
+
+
+def aggregate_indexes(
+        indexes: typing.Dict[str, np.ndarray]
+) -> typing.Tuple[dict, dict, dict]:
+    """Sum each index over all segments
+
+    Returns a tuple with the aggregated emissions, costs and health. Each of
+    them is an empty dict if there are no segments
+
+    """
+
+    result = []
+    for names in _INDEX_GROUPS:
+        totals = {}
+        for name in names:
+            values = indexes[name]
+            if len(values) > 0:
+                totals[name] = float(values.sum())
+        result.append(totals)
+    return tuple(result)
+
+
+def insert_segments_data(segment_ids: typing.List[int],
+                         indexes: typing.Dict[str, np.ndarray], db_cursor):
+    """Insert all segments' indexes using one statement per table"""
+    queries = (
+        "insert-emission.sql",
+        "insert-cost.sql",
+        "insert-health.sql",
+    )
+    for query_filename, names in zip(queries, _INDEX_GROUPS):
+        _perform_segments_insert(
+            query_filename, segment_ids, indexes, names, db_cursor)
+
+
+def calculate_indexes_in_db(track_ids: typing.List[int], db_cursor,
+                            coefficients_version: str = None):
+    """Calculate indexes for the input tracks without leaving the DB
+
+    This is an alternative to ``calculate_indexes()`` that computes indexes
+    with ``INSERT ... SELECT`` statements, reading coefficients from the
+    coefficients tables. If ``coefficients_version`` is not provided, the
+    current contents of ``_constants`` are used, see
+    ``get_stored_coefficients_version()``.
+
+    Existing indexes of the tracks' segments are replaced. As with
+    ``calculate_indexes()``, track validity is not checked.
+
+    """
+
+    version = (
+        coefficients_version or get_stored_coefficients_version(db_cursor))
+    db_cursor.execute(
+        get_query("insert-indexes-from-coefficients.sql"),
+        {
+            "track_ids": list(track_ids),
+            "version": version,
+        }
+    )
+
+
+def get_stored_coefficients_version(db_cursor) -> str:
+    """Return the version of the current coefficients, storing them if needed
+
+    The version is only computed once per process. Coefficients are loaded
+    when they cannot be found in the DB, which is checked on every call
+    with a primary key lookup, rather than remembered, so that a rolled
+    back transaction does not leave them missing.
+
+    """
+
+    version = _COEFFICIENTS_VERSION_CACHE.get("version")
+    if version is None:
+        version = get_coefficients_version(indexengine.COEFFICIENTS)
+        _COEFFICIENTS_VERSION_CACHE["version"] = version
+    db_cursor.execute(
+        get_query("select-index-coefficients-version.sql"),
+        {"version": version}
+    )
+    if db_cursor.fetchone() is None:
+        load_coefficients(db_cursor)
+    return version
+
+
+def load_coefficients(
+        db_cursor,
+        coefficients: indexengine.IndexCoefficients = indexengine.COEFFICIENTS
+) -> str:
+    """Store the input coefficients in the DB and return their version
+
+    The version is derived from the coefficients' values, so loading the
+    same coefficients more than once is harmless.
+
+    """
+
+    version = get_coefficients_version(coefficients)
+    coefficient_rows = []
+    calorie_step_rows = []
+    for vehicle_type in VehicleType:
+        index = vehicle_type.value
+        # emissions follow the order of `Pollutant`, which is also the order
+        # of the columns in `insert-index-coefficients.sql`
+        coefficient_rows.append((
+            version,
+            vehicle_type.name,
+            *coefficients.emissions[:, index].tolist(),
+            float(coefficients.passenger_count[index]),
+            float(coefficients.fuel_cost_per_km[index]),
+            float(coefficients.depreciation_cost_per_km[index]),
+            float(coefficients.operation_cost_per_km[index]),
+            float(coefficients.total_cost_overhead[index]),
+            float(coefficients.time_cost_per_hour),
+        ))
+        speeds, calories = coefficients.calorie_steps.get(index, ([], []))
+        for order, (speed, calory) in enumerate(zip(speeds, calories)):
+            calorie_step_rows.append(
+                (version, vehicle_type.name, order, float(speed),
+                 float(calory))
+            )
+    execute_values(
+        db_cursor,
+        get_query("insert-index-coefficients.sql"),
+        coefficient_rows
+    )
+    execute_values(
+        db_cursor,
+        get_query("insert-calorie-steps.sql"),
+        calorie_step_rows
+    )
+    return version
+
+
+def get_coefficients_version(
+        coefficients: indexengine.IndexCoefficients) -> str:
+    contents = json.dumps(
+        {
+            "emissions": coefficients.emissions.tolist(),
+            "passenger_count": coefficients.passenger_count.tolist(),
+            "fuel_cost_per_km": coefficients.fuel_cost_per_km.tolist(),
+            "depreciation_cost_per_km": (
+                coefficients.depreciation_cost_per_km.tolist()),
+            "operation_cost_per_km": (
+                coefficients.operation_cost_per_km.tolist()),
+            "total_cost_overhead": coefficients.total_cost_overhead.tolist(),
+            "time_cost_per_hour": coefficients.time_cost_per_hour,
+            "calorie_steps": {
+                str(vehicle_type): [speeds.tolist(), calories.tolist()]
+                for vehicle_type, (speeds, calories) in sorted(
+                    coefficients.calorie_steps.items())
+            },
+        },
+        sort_keys=True
+    )
+    return hashlib.sha1(contents.encode("utf-8")).hexdigest()
 
 
 def get_segments_info(track_id, db_cursor):
@@ -125,130 +290,17 @@ def get_segments_info(track_id, db_cursor):
     return result
 
 
-def _perform_segment_insert(query_filename, segment_id, query_params: dict,
-                            db_cursor):
-    all_query_params = query_params.copy()
-    all_query_params["segment_id"] = segment_id
-    db_cursor.execute(
+def _perform_segments_insert(query_filename, segment_ids: typing.List[int],
+                             indexes: typing.Dict[str, np.ndarray],
+                             names: typing.Sequence[str], db_cursor):
+    if len(segment_ids) == 0:
+        return
+    columns = [indexes[name].tolist() for name in names]
+    rows = list(zip(*columns, segment_ids))
+    execute_values(
+        db_cursor,
         get_query(query_filename),
-        all_query_params
+        rows,
+        page_size=len(rows)
     )
 
-
-def calculate_emissions(vehicle_type: VehicleType,
-                        segment_length:float) -> dict:
-    result = {}
-    for pollutant, coeffs in _constants.EMISSIONS.items():
-        emitted = (
-                (coeffs.get(vehicle_type, 0) * segment_length) /
-                _constants.AVERAGE_PASSENGER_COUNT.get(vehicle_type, 1)
-        )
-        reference = (
-                (coeffs[VehicleType.car] * segment_length) /
-                _constants.AVERAGE_PASSENGER_COUNT[VehicleType.car]
-        )
-        saved = reference - emitted if vehicle_type != VehicleType.car else 0
-        # We take car as a reference, but it is not always the most pollutant
-        # vehicle type. E.g. riding a motorcycle emmits more CO and PM10 than
-        # a car. For those cases, we set `saved` to zero in order to prevent
-        # showing negative savings.
-        saved = max(saved, 0)
-        result.update({
-            pollutant.name: emitted,
-            "{}_saved".format(pollutant.name): saved
-        })
-    return result
-
-
-def calculate_costs(vehicle_type: VehicleType, length_km: float,
-                    duration_hours: float):
-    public_transports = [
-        vehicle_type.bus,
-        vehicle_type.train,
-    ]
-    if vehicle_type in public_transports:
-        costs = _calculate_costs_public_transportation(
-            vehicle_type, length_km, duration_hours)
-    else:
-        costs = _calculate_costs_private_vehicle(
-            vehicle_type, length_km, duration_hours)
-    result = {
-        "fuel_cost": costs[0],
-        "time_cost": costs[1],
-        "depreciation_cost": costs[2],
-        "operation_cost": costs[3],
-        "total_cost": costs[4],
-    }
-    return result
-
-
-def _calculate_costs_private_vehicle(vehicle_type: VehicleType,
-                                     length_km: float, duration_hours: float):
-    """Calculate monetary costs associated with using a private vehicle
-
-    - Fuel, depreciation and operation costs do not take into account the
-      passenger count as these costs are usually supported solely by the
-      vehicle's owner, even if there are other passengers aboard
-    - The total cost may be enlarged according to the vehicle type, in order
-      to provide an account of other costs
-
-    """
-
-    fuel_cost = _get_fuel_cost(length_km, vehicle_type)
-    time_cost = duration_hours * _constants.TIME_COST_PER_HOUR_EURO
-    depreciation_cost = (
-            length_km * _constants.DEPRECIATION_COST.get(vehicle_type, 0))
-    operation_cost = length_km * _constants.OPERATION_COST.get(vehicle_type, 0)
-    total_cost = (
-            sum((fuel_cost, time_cost, depreciation_cost, operation_cost)) *
-            (1 + _constants.TOTAL_COST_OVERHEAD.get(vehicle_type, 0))
-    )
-
-    return fuel_cost, time_cost, depreciation_cost, operation_cost, total_cost
-
-
-def _calculate_costs_public_transportation(vehicle_type: VehicleType,
-                                           length_km:float,
-                                           duration_hours: float):
-    fuel_cost = 0
-    time_cost = duration_hours * _constants.TIME_COST_PER_HOUR_EURO
-    depreciation_cost = 0
-    operation_cost = 0
-    total_cost = (
-            sum((fuel_cost, time_cost, depreciation_cost, operation_cost)) *
-            (1 + _constants.TOTAL_COST_OVERHEAD.get(vehicle_type, 0))
-    )
-    return fuel_cost, time_cost, depreciation_cost, operation_cost, total_cost
-
-
-def _get_fuel_cost(length, vehicle_type):
-    try:
-        volume_spent = length * (1 / _constants.FUEL_CONSUMPTION[vehicle_type])
-        monetary_cost = volume_spent * _constants.FUEL_PRICE[vehicle_type]
-    except (KeyError, ZeroDivisionError):
-        monetary_cost = 0
-    return monetary_cost
-
-
-def calculate_health(vehicle_type, duration_minutes, speed_km_h):
-    return {
-        "calories_consumed": _get_consumed_calories(
-            speed_km_h, duration_minutes, vehicle_type),
-        # "benefit_index": None  # TODO
-    }
-
-
-def _get_consumed_calories(speed_km_h, duration_minutes, vehicle_type):
-    try:
-        steps = _constants.CALORY_CONSUMPTION[vehicle_type]["steps"]
-    except KeyError:
-        result = 0
-    else:
-        for step in steps:
-            if speed_km_h < step["speed"]:
-                consumption_per_minute = step["calories"]
-                break
-        else:
-            consumption_per_minute = steps[-1]["calories"]
-        result = consumption_per_minute * duration_minutes
-    return result
@@ -15,16 +15,22 @@ This module should be called periodically
 """
 
 from collections import namedtuple
-from functools import partial
+import concurrent.futures
 import datetime as dt
 import json
 import logging
 import typing
 
+import numpy as np
+from psycopg2 import sql
 import pytz
 
+from . import utils
 from .utils import get_query
 from ._constants import PrizeCriterium
+from ._constants import PUBLIC_TRANSPORTS
+from ._constants import SUSTAINABLE_TRANSPORTS
+from ._constants import VehicleType
 
 logger = logging.getLogger(__name__)
 
@@ -48,11 +54,77 @@ CompetitorInfo = namedtuple("CompetitorInfo", [
 
 LeaderBoardInfo = typing.Tuple[PrizeCriterium, typing.List[CompetitorInfo]]
 
+CompetitionScores = namedtuple("CompetitionScores", [
+    "criteria",  # tuple of PrizeCriterium, the columns of `scores`
+    "user_ids",  # shape: (num_participants,)
+    "scores",  # shape: (num_participants, num_criteria)
+])
+
+# criteria that count tracks, whose scores are not weighted by the overlap
+# with the regions of interest
+COUNT_CRITERIA = (
+    PrizeCriterium.bike_usage_frequency,
+    PrizeCriterium.public_transport_usage_frequency,
+)
+
 
 def calculate_prizes(
         db_cursor
 ) -> typing.List[typing.Tuple[CompetitionInfo, typing.List[dict]]]:
     """Calculate results for currently open competitions"""
+    expired = get_expired_competitions(db_cursor)
+    result = []
+    for competition in expired:
+        winners = close_expired_competition(competition, db_cursor)
+        result.append((competition, winners))
+    return result
+
+
+def calculate_prizes_concurrently(
+        connection_factory: typing.Callable,
+        max_workers: int = 4
+) -> typing.List[typing.Tuple[CompetitionInfo, typing.List[dict]]]:
+    """Calculate results for currently open competitions concurrently
+
+    Each expired competition is closed in a worker thread, with its own DB
+    connection, which is committed as soon as the competition is closed.
+    Closed competitions are recorded, so that an interrupted run can be
+    resumed by calling this function again. A competition that fails does
+    not prevent the others from being closed.
+
+    ``connection_factory`` must return a new DB connection on each call.
+
+    """
+
+    connection = connection_factory()
+    try:
+        with connection:
+            with connection.cursor() as cursor:
+                expired = get_expired_competitions(cursor)
+    finally:
+        connection.close()
+    result = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = {
+            executor.submit(
+                _close_competition_in_transaction,
+                competition,
+                connection_factory
+            ): competition for competition in expired
+        }
+        for future in concurrent.futures.as_completed(futures):
+            competition = futures[future]
+            try:
+                winners = future.result()
+            except Exception:
+                logger.exception(
+                    "Could not close competition {}".format(competition.id))
+            else:
+                result.append((competition, winners))
+    return result
+
+
+def get_expired_competitions(db_cursor) -> typing.List[CompetitionInfo]:
     now = dt.datetime.now(pytz.utc)
     open_competitions = get_open_competitions(db_cursor)
     expired = [c for c in open_competitions if c.end_date < now]
@@ -60,16 +132,40 @@ def calculate_prizes(
         len(open_competitions)))
     logger.debug("number of expired competitions: {}".format(
         len(expired)))
-    result = []
-    for competition in expired:
-        logger.info(
-            "Handling competition {}...".format(competition.id))
-        leaderboard = get_leaderboard(competition, db_cursor)
-        winners = select_competition_winners(competition, leaderboard)
-        assign_competition_winners(winners, competition.id, db_cursor)
-        close_competition(competition, leaderboard, db_cursor)
-        result.append((competition, winners))
-    return result
+    return expired
+
+
+def close_expired_competition(competition: CompetitionInfo,
+                              db_cursor) -> typing.List[dict]:
+    """Assign winners and save the leaderboard of an expired competition"""
+    logger.info(
+        "Handling competition {}...".format(competition.id))
+    leaderboard = get_leaderboard(competition, db_cursor)
+    winners = select_competition_winners(competition, leaderboard)
+    assign_competition_winners(winners, competition.id, db_cursor)
+    close_competition(competition, leaderboard, db_cursor)
+    db_cursor.execute(
+        get_query("insert-competition-run.sql"),
+        {
+            "competition_id": competition.id,
+            "num_winners": len(winners),
+        }
+    )
+    return winners
+
+
+def _close_competition_in_transaction(
+        competition: CompetitionInfo,
+        connection_factory: typing.Callable
+) -> typing.List[dict]:
+    connection = connection_factory()
+    try:
+        with connection:
+            with connection.cursor() as cursor:
+                winners = close_expired_competition(competition, cursor)
+    finally:
+        connection.close()
+    return winners
 
 
 def close_competition(competition, leaderboard, db_cursor):
@@ -103,24 +199,14 @@ def get_leaderboard(
         competition: CompetitionInfo,
         db_cursor
 ) -> typing.List[dict]:
-    criteria_handlers = {
-        PrizeCriterium.saved_so2: partial(get_emissions_ranking, "so2_saved"),
-        PrizeCriterium.saved_co2: partial(get_emissions_ranking, "co2_saved"),
-        PrizeCriterium.saved_co: partial(get_emissions_ranking, "co_saved"),
-        PrizeCriterium.saved_nox: partial(get_emissions_ranking, "nox_saved"),
-        PrizeCriterium.saved_pm10: partial(
-            get_emissions_ranking, "pm10_saved"),
-    }
+    update_competition_standings(competition, db_cursor)
+    rankings = get_rankings(competition, db_cursor)
     criteria_leaderboards = {}
     threshold = len(competition.criteria) * competition.winner_threshold
     for criterium in competition.criteria:
         criterium_enumeration = PrizeCriterium(criterium)
-        handler = criteria_handlers[criterium_enumeration]
-        criteria_leaderboards[criterium_enumeration.value] = handler(
-            competition,
-            threshold,
-            db_cursor
-        )
+        criteria_leaderboards[criterium_enumeration.value] = rankings.get(
+            criterium_enumeration, [])[:threshold]
     logger.debug("criteria_leaderboards: {}".format(criteria_leaderboards))
     return consolidate_leaderboards(criteria_leaderboards)
 
@@ -185,26 +271,68 @@ def sum_participant_scores(
 
 
 def get_user_score(competition: CompetitionInfo, user_id, db_cursor) -> dict:
-    criteria_handlers = {
-        PrizeCriterium.saved_so2: partial(get_emissions_score, "so2_saved"),
-        PrizeCriterium.saved_co2: partial(get_emissions_score, "co2_saved"),
-        PrizeCriterium.saved_co: partial(get_emissions_score, "co_saved"),
-        PrizeCriterium.saved_nox: partial(get_emissions_score, "nox_saved"),
-        PrizeCriterium.saved_pm10: partial(get_emissions_score, "pm10_saved"),
+    """Return the user's current score for each of the competition's criteria
+
+    The competition's standings are brought up to date first, so that
+    tracks that could not be accounted for when they were validated are
+    included as well.
+
+    """
+
+    update_competition_standings(competition, db_cursor)
+    db_cursor.execute(
+        get_query("select-competition-standings.sql"),
+        {
+            "competition_id": competition.id,
+            "user_id": user_id,
+            "count_criteria": [c.name for c in COUNT_CRITERIA],
+        }
+    )
+    standings = {
+        PrizeCriterium[criterium]: score or 0
+        for criterium, _, score, _ in db_cursor.fetchall()
     }
     scores = {}
     for criterium in competition.criteria:
         criterium_enumeration = PrizeCriterium(criterium)
-        handler = criteria_handlers[criterium_enumeration]
-        score = handler(
-            competition,
-            user_id,
-            db_cursor
-        )
-        scores[criterium_enumeration] = score
+        scores[criterium_enumeration] = standings.get(criterium_enumeration, 0)
     return scores
 
 
+def get_competition_scores(competition: CompetitionInfo,
+                           db_cursor) -> CompetitionScores:
+    """Return the current scores of all participants with a single query
+
+    Scores are read from the live standings, like in ``get_user_score()``.
+    Participants without any valid track have a score of zero.
+
+    """
+
+    criteria = tuple(PrizeCriterium(c) for c in competition.criteria)
+    db_cursor.execute(
+        get_query("select-competition-participants-scores.sql"),
+        {
+            "competition_id": competition.id,
+            "count_criteria": [c.name for c in COUNT_CRITERIA],
+        }
+    )
+    rows = db_cursor.fetchall()
+    user_ids = np.array(sorted(set(row[0] for row in rows)), dtype=int)
+    scores = np.zeros((len(user_ids), len(criteria)))
+    columns = {criterium.name: index for index, criterium in enumerate(
+        criteria)}
+    for user_id, criterium, score in rows:
+        column = columns.get(criterium)
+        if column is not None and score is not None:
+            row_index = np.searchsorted(user_ids, user_id)
+            scores[row_index, column] = score
+    return CompetitionScores(
+        criteria=criteria,
+        user_ids=user_ids,
+        scores=scores
+    )
+
+
 def select_competition_winners(
         competition: CompetitionInfo,
         leaderboard: typing.List[dict]
@@ -218,84 +346,250 @@ def assign_competition_winners(
         competition_id: int,
         db_cursor
 ):
+    """Insert all winners of a competition with a single query"""
     for index, winner in enumerate(winners):
-        rank = index + 1
         logger.info("Assigning user {} as a winner (rank: {}) of competition "
-                    "{}...".format(winner["user"], rank, competition_id))
-        db_cursor.execute(
-            get_query("select-competitionparticipant.sql"),
-            {
-                "competition_id": competition_id,
-                "user_id": winner["user"]
-            }
+                    "{}...".format(winner["user"], index + 1, competition_id))
+    if len(winners) > 0:
+        inserted = _execute_values_and_fetch(
+            db_cursor,
+            get_query("insert-competition-winners.sql"),
+            [
+                (competition_id, winner["user"], index + 1)
+                for index, winner in enumerate(winners)
+            ]
+        )
+        if len(inserted) < len(winners):
+            logger.warning(
+                "Could not find the participant records of {} winners of "
+                "competition {}".format(
+                    len(winners) - len(inserted), competition_id)
+            )
+
+
+def get_winners_prizes(
+        competition_id: int,
+        winners: typing.List[dict],
+        db_cursor
+) -> typing.List[typing.Tuple[str, typing.List[str]]]:
+    """Return the keycloak UUID and the prize names of each winner
+
+    Results are sorted in the same order as ``winners``, which is also their
+    rank.
+
+    """
+
+    if len(winners) == 0:
+        return []
+    rows = _execute_values_and_fetch(
+        db_cursor,
+        get_query("select-winners-prizes.sql"),
+        [
+            (competition_id, winner["user"], index + 1)
+            for index, winner in enumerate(winners)
+        ]
+    )
+    prizes = {user_id: (uuid, names) for user_id, uuid, names in rows}
+    return [prizes.get(winner["user"], (None, [])) for winner in winners]
+
+
+def _execute_values_and_fetch(
+        db_cursor,
+        query: str,
+        argslist: typing.List[tuple]
+) -> typing.List[tuple]:
+    """Expand the query's `VALUES {values}` placeholder and return all rows
+
+    This does the same as `psycopg2.extras.execute_values(..., fetch=True)`,
+    which is not available in the psycopg2 version used in production. All
+    rows are sent in a single statement.
+
+    """
+
+    if query.count("{values}") != 1:
+        raise ValueError(
+            "Query must contain exactly one {values} placeholder")
+    values = sql.SQL(",").join(sql.Literal(tuple(args)) for args in argslist)
+    db_cursor.execute(sql.SQL(query).format(values=values))
+    return db_cursor.fetchall()
+
+
+def update_prize_region_pieces(db_cursor) -> typing.List[int]:
+    """Subdivide the competitions' regions of interest that have been modified
+
+    Cached overlaps and standings of the competitions that use any of the
+    modified regions are removed, so that they are computed again. Returns
+    the ids of the regions whose pieces changed.
+
+    """
+
+    region_ids = utils.update_region_pieces(
+        db_cursor, "prizes_regionofinterest", "smbbackend_prizeregionpiece")
+    if len(region_ids) > 0:
+        logger.info(
+            "Regions of interest {} have been modified, clearing the cached "
+            "data of their competitions...".format(region_ids)
         )
-        participant_record = db_cursor.fetchone()
-        participant_id = participant_record[0]
         db_cursor.execute(
-            get_query("insert-competition-winner.sql"),
-            {
-                "participant_id": participant_id,
-                "rank": rank,
-            }
+            get_query("delete-region-competitions-cache.sql"),
+            {"region_ids": region_ids}
         )
+    return region_ids
+
+
+def update_competition_roi_overlaps(competition_id: int, db_cursor):
+    """Cache the overlap of the competition's regions with participants' tracks
 
+    Only tracks that have not been cached yet are processed, so this is
+    cheap to call before each query that needs the overlaps.
 
-def get_prize_names(competition_id: int, user_rank: int, db_cursor):
+    """
+
+    update_prize_region_pieces(db_cursor)
     db_cursor.execute(
-        get_query("select-prize-name.sql"),
-        {
-            "competition_id": competition_id,
-            "user_rank": user_rank
-        }
+        get_query("insert-competition-roi-overlaps.sql"),
+        {"competition_id": competition_id}
+    )
+    logger.debug(
+        "Cached region of interest overlaps for {} new tracks of competition "
+        "{}".format(db_cursor.rowcount, competition_id)
     )
-    return [record[0] for record in db_cursor.fetchall()]
 
 
-def get_emissions_ranking(
-        pollutant: str,
-        competition: CompetitionInfo,
-        winner_threshold: int,
-        db_cursor
-) -> typing.List[CompetitorInfo]:
+def update_track_roi_overlaps(track_id: int, db_cursor):
+    """Cache the overlap of the track with its competitions' regions
+
+    This should be called whenever a track is validated, so that region
+    restricted competitions do not need to calculate it later.
+
+    """
+
+    update_prize_region_pieces(db_cursor)
+    db_cursor.execute(
+        get_query("insert-track-roi-overlaps.sql"),
+        {"track_id": track_id}
+    )
+
+
+def update_competition_standings(competition: CompetitionInfo, db_cursor):
+    """Add any tracks that are still missing from the competition's standings
+
+    Standings are normally updated as each track is validated. This catches
+    up with tracks that could not be accounted for at that time, for example
+    because their owner's participation had not been approved yet.
+
+    Standings only ever grow as tracks are accounted for, so if any of the
+    accounted tracks has since been invalidated or deleted, the standings of
+    the competition are recomputed from scratch.
+
+    """
+
     if competition.region_of_interest is not None:
-        query_path = "select-pollutant-savings-leaderboard-with-roi.sql"
-    else:
-        query_path = "select-pollutant-savings-leaderboard.sql"
-    query_text = get_query(query_path)
-    formatted_query = query_text.format(pollutant_name=pollutant)
+        update_competition_roi_overlaps(competition.id, db_cursor)
     db_cursor.execute(
-        formatted_query,
-        {
-            "competition_id": competition.id,
-            "threshold": winner_threshold,
-        }
+        get_query("select-stale-competition-standings.sql"),
+        {"competition_id": competition.id}
     )
-    leaderboard = []
-    for row in db_cursor.fetchall():
-        leaderboard.append(CompetitorInfo(*row))
-    else:
-        if len(leaderboard) == 0:
-            logger.debug("Leaderboard is empty")
-    return leaderboard
+    num_stale_tracks = db_cursor.fetchone()[0]
+    if num_stale_tracks > 0:
+        logger.info(
+            "Rebuilding the standings of competition {}, as {} of its tracks "
+            "are no longer valid...".format(competition.id, num_stale_tracks)
+        )
+        db_cursor.execute(
+            get_query("delete-competition-standings.sql"),
+            {"competition_id": competition.id}
+        )
+    db_cursor.execute(
+        get_query("update-competition-standings.sql").format(
+            eligibility_filter="c.id = %(competition_id)s"),
+        get_standings_parameters(competition_id=competition.id)
+    )
+    logger.debug(
+        "Added {} standings entries to competition {}".format(
+            db_cursor.rowcount, competition.id)
+    )
+
+
+def update_track_standings(track_id: int, db_cursor):
+    """Add the track to the standings of the competitions it takes part in
+
+    The track's overlaps with competition regions must already have been
+    cached with ``update_track_roi_overlaps()``.
+
+    """
+
+    db_cursor.execute(
+        get_query("update-competition-standings.sql").format(
+            eligibility_filter="t.id = %(track_id)s"),
+        get_standings_parameters(track_id=track_id)
+    )
+
+
+def rebuild_competition_standings(db_cursor):
+    """Recompute the standings of all competitions from scratch
+
+    This should be done after the indexes of existing tracks have been
+    recomputed, or when the standings tables are first created.
+
+    """
+
+    db_cursor.execute(get_query("select-competitions-with-regions.sql"))
+    for competition_id, in db_cursor.fetchall():
+        update_competition_roi_overlaps(competition_id, db_cursor)
+    db_cursor.execute(
+        "TRUNCATE smbbackend_competitionstanding, "
+        "smbbackend_competitionstandingtrack"
+    )
+    db_cursor.execute(
+        get_query("update-competition-standings.sql").format(
+            eligibility_filter="TRUE"),
+        get_standings_parameters()
+    )
+
+
+def get_standings_parameters(**extra) -> typing.Dict[str, typing.Any]:
+    """Return the parameters used for aggregating all prize criteria"""
+    result = {
+        "bike_vehicle_types": [VehicleType.bike.name],
+        "sustainable_vehicle_types": [
+            vt.name for vt in SUSTAINABLE_TRANSPORTS],
+        "public_vehicle_types": [vt.name for vt in PUBLIC_TRANSPORTS],
+    }
+    result.update(extra)
+    return result
 
 
-def get_emissions_score(
-        pollutant: str,
+def get_rankings(
         competition: CompetitionInfo,
-        user_id: int,
         db_cursor
-):
-    if competition.region_of_interest is not None:
-        query_path = "select-user-score-pollutant-savings-with-roi.sql"
-    else:
-        query_path = "select-user-score-pollutant-savings.sql"
-    query_text = get_query(query_path)
-    formatted_query = query_text.format(pollutant_name=pollutant)
+) -> typing.Dict[PrizeCriterium, typing.List[CompetitorInfo]]:
+    """Get the competition's rankings for all criteria from its standings
+
+    Rankings are returned sorted by descending points, so the best
+    competitors come first.
+
+    """
+
     db_cursor.execute(
-        formatted_query,
+        get_query("select-competition-standings.sql"),
         {
             "competition_id": competition.id,
-            "user_id": user_id,
+            "user_id": None,
+            "count_criteria": [c.name for c in COUNT_CRITERIA],
         }
     )
-    return db_cursor.fetchone()[0] or 0
+    rankings = {}
+    for criterium, user_id, score, points in db_cursor.fetchall():
+        rankings.setdefault(PrizeCriterium[criterium], []).append(
+            CompetitorInfo(
+                points=points,
+                user_id=user_id,
+                absolute_score=score
+            )
+        )
+    if len(rankings) == 0:
+        logger.debug("Leaderboard is empty")
+    for ranking in rankings.values():
+        ranking.sort(key=lambda competitor: competitor.points, reverse=True)
+    return rankings
@@ -0,0 +1,112 @@
+#########################################################################
+#
+# Copyright 2018, GeoSolutions Sas.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+#
+#########################################################################
+
+"""Creation of the DB tables that are owned by smbbackend
+
+Most of the DB schema is managed by the smb portal. The tables created here
+hold data that is only used by the backend calculations. All of them are
+prefixed with ``smbbackend_`` and are created only if they do not exist yet,
+so it is safe to run this module more than once.
+
+"""
+
+import argparse
+import logging
+import os
+
+from . import calculateprizes
+from . import processor
+from . import regions
+from . import userstats
+from . import utils
+from .utils import get_query
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_QUERIES = [
+    "create-index-coefficients-tables.sql",
+    "create-user-stats-tables.sql",
+    "create-roi-overlap-tables.sql",
+    "create-region-pieces-tables.sql",
+    "create-competition-run-tables.sql",
+    "create-competition-standings-tables.sql",
+    "create-track-claims-tables.sql",
+    "create-segment-length-tables.sql",
+]
+
+
+def main():
+    parser = _get_parser()
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    connection = utils.get_db_connection(
+        host=args.db_host,
+        port=args.db_port,
+        dbname=args.db_name,
+        user=args.db_user,
+        password=args.db_password,
+    )
+    with connection:
+        with connection.cursor() as cursor:
+            create_tables(cursor)
+            if args.populate:
+                populate_tables(cursor)
+    connection.close()
+    logger.info("Done!")
+
+
+def create_tables(db_cursor):
+    for query_file in SCHEMA_QUERIES:
+        logger.info("Running {}...".format(query_file))
+        db_cursor.execute(get_query(query_file))
+
+
+def populate_tables(db_cursor):
+    """Fill the tables that are derived from existing data"""
+    logger.info("Rebuilding user statistics...")
+    userstats.rebuild_user_stats(db_cursor)
+    logger.info("Subdividing regions of interest...")
+    regions.prepare_regions(db_cursor)
+    logger.info("Rebuilding competition standings...")
+    calculateprizes.rebuild_competition_standings(db_cursor)
+    logger.info("Claiming the sessions of existing tracks...")
+    processor.rebuild_track_session_claims(db_cursor)
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-p",
+        "--populate",
+        action="store_true",
+        help="Fill tables that are derived from existing data, replacing "
+             "their current contents"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true"
+    )
+    parser.add_argument("--db-host")
+    parser.add_argument("--db-port", type=int)
+    parser.add_argument("--db-name")
+    parser.add_argument("--db-user")
+    parser.add_argument("--db-password")
+    parser.set_defaults(
+        db_host=os.getenv("DB_HOST", "localhost"),
+        db_port=int(os.getenv("DB_PORT", "5432")),
+        db_name=os.getenv("DB_NAME"),
+        db_user=os.getenv("DB_USER"),
+        db_password=os.getenv("DB_PASSWORD"),
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    main()
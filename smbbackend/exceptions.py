@@ -43,3 +43,17 @@ class RecoverableError(Exception):
         self.variable_name = variable_name
         self.value = value
         self.vechile_type = vehicle_type
+
+
+class DuplicateTrackError(Exception):
+    """Raise whenever a track has already been ingested
+
+    This happens when the same upload is delivered more than once, or when
+    the app uploads the same session again. The id of the track that was
+    already ingested, if it is known, is available as ``track_id``.
+
+    """
+
+    def __init__(self, message, track_id=None, *args, **kwargs):
+        super().__init__(message, track_id, *args, **kwargs)
+        self.track_id = track_id
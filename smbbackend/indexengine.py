@@ -0,0 +1,225 @@
+#########################################################################
+#
+# Copyright 2018, GeoSolutions Sas.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+#
+#########################################################################
+
+"""Vectorized calculation of smb indexes
+
+The coefficients defined in ``_constants`` are compiled into numpy arrays
+that are indexed by ``VehicleType.value``. This allows calculating the
+emissions, costs and consumed calories of any number of segments with a
+handful of array operations, instead of looking up dictionaries segment by
+segment.
+
+"""
+
+from collections import namedtuple
+import logging
+import typing
+
+import numpy as np
+
+from . import _constants
+from ._constants import Pollutant
+from ._constants import VehicleType
+
+logger = logging.getLogger(__name__)
+
+EMISSION_INDEXES = tuple(
+    name for pollutant in Pollutant
+    for name in (pollutant.name, "{}_saved".format(pollutant.name))
+)
+
+COST_INDEXES = (
+    "fuel_cost",
+    "time_cost",
+    "depreciation_cost",
+    "operation_cost",
+    "total_cost",
+)
+
+HEALTH_INDEXES = (
+    "calories_consumed",
+)
+
+IndexCoefficients = namedtuple("IndexCoefficients", [
+    "pollutants",  # row order of the `emissions` matrix
+    "emissions",  # shape: (num_pollutants, num_vehicle_types)
+    "passenger_count",
+    "fuel_cost_per_km",
+    "depreciation_cost_per_km",
+    "operation_cost_per_km",
+    "total_cost_overhead",
+    "time_cost_per_hour",
+    "calorie_steps",  # dict of VehicleType.value: (speeds, calories)
+])
+
+_NUM_VEHICLE_TYPES = max(vt.value for vt in VehicleType) + 1
+
+
+def compile_coefficients() -> IndexCoefficients:
+    """Compile the coefficients in ``_constants`` into numpy arrays"""
+    pollutants = tuple(Pollutant)
+    emissions = np.zeros((len(pollutants), _NUM_VEHICLE_TYPES))
+    passenger_count = np.ones(_NUM_VEHICLE_TYPES)
+    fuel_cost = np.zeros(_NUM_VEHICLE_TYPES)
+    depreciation_cost = np.zeros(_NUM_VEHICLE_TYPES)
+    operation_cost = np.zeros(_NUM_VEHICLE_TYPES)
+    overhead = np.zeros(_NUM_VEHICLE_TYPES)
+    calorie_steps = {}
+    for vehicle_type in VehicleType:
+        index = vehicle_type.value
+        for row, pollutant in enumerate(pollutants):
+            emissions[row, index] = _constants.EMISSIONS[pollutant].get(
+                vehicle_type, 0)
+        passenger_count[index] = _constants.AVERAGE_PASSENGER_COUNT.get(
+            vehicle_type, 1)
+        overhead[index] = _constants.TOTAL_COST_OVERHEAD.get(vehicle_type, 0)
+        if vehicle_type not in _constants.PUBLIC_TRANSPORTS:
+            consumption = _constants.FUEL_CONSUMPTION.get(vehicle_type, 0)
+            price = _constants.FUEL_PRICE.get(vehicle_type, 0)
+            fuel_cost[index] = price / consumption if consumption else 0
+            depreciation_cost[index] = _constants.DEPRECIATION_COST.get(
+                vehicle_type, 0)
+            operation_cost[index] = _constants.OPERATION_COST.get(
+                vehicle_type, 0)
+        steps = _constants.CALORY_CONSUMPTION.get(
+            vehicle_type, {}).get("steps")
+        if steps:
+            calorie_steps[index] = (
+                np.array([step["speed"] for step in steps], dtype=float),
+                np.array([step["calories"] for step in steps], dtype=float),
+            )
+    return IndexCoefficients(
+        pollutants=pollutants,
+        emissions=emissions,
+        passenger_count=passenger_count,
+        fuel_cost_per_km=fuel_cost,
+        depreciation_cost_per_km=depreciation_cost,
+        operation_cost_per_km=operation_cost,
+        total_cost_overhead=overhead,
+        time_cost_per_hour=_constants.TIME_COST_PER_HOUR_EURO,
+        calorie_steps=calorie_steps,
+    )
+
+
+COEFFICIENTS = compile_coefficients()
+
+
+def get_vehicle_type_values(
+        vehicle_types: typing.Iterable[VehicleType]) -> np.ndarray:
+    return np.fromiter((vt.value for vt in vehicle_types), dtype=int)
+
+
+def calculate_segments_indexes(
+        vehicle_types: np.ndarray,
+        lengths_km: np.ndarray,
+        durations_hours: np.ndarray,
+        coefficients: IndexCoefficients = COEFFICIENTS
+) -> typing.Dict[str, np.ndarray]:
+    """Calculate all indexes for N segments in one go
+
+    ``vehicle_types`` holds the ``VehicleType.value`` of each segment. Use
+    ``get_vehicle_type_values()`` in order to convert ``VehicleType``
+    instances.
+
+    Returns a dict with one array of N elements for each of the names in
+    ``EMISSION_INDEXES``, ``COST_INDEXES`` and ``HEALTH_INDEXES``.
+
+    """
+
+    vehicle_types = np.asarray(vehicle_types, dtype=int)
+    lengths_km = np.asarray(lengths_km, dtype=float)
+    durations_hours = np.asarray(durations_hours, dtype=float)
+    result = {}
+    result.update(
+        calculate_emissions(vehicle_types, lengths_km, coefficients))
+    result.update(
+        calculate_costs(
+            vehicle_types, lengths_km, durations_hours, coefficients)
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speeds_km_h = lengths_km / durations_hours
+    result["calories_consumed"] = calculate_consumed_calories(
+        vehicle_types, speeds_km_h, durations_hours * 60, coefficients)
+    return result
+
+
+def calculate_emissions(
+        vehicle_types: np.ndarray,
+        lengths_km: np.ndarray,
+        coefficients: IndexCoefficients = COEFFICIENTS
+) -> typing.Dict[str, np.ndarray]:
+    car = VehicleType.car.value
+    emitted = (
+        coefficients.emissions[:, vehicle_types] * lengths_km /
+        coefficients.passenger_count[vehicle_types]
+    )
+    reference = (
+        coefficients.emissions[:, car, np.newaxis] * lengths_km /
+        coefficients.passenger_count[car]
+    )
+    # car is the reference, but it is not always the most pollutant vehicle
+    # type, so negative savings are clipped to zero
+    saved = np.where(
+        vehicle_types == car, 0, np.maximum(reference - emitted, 0))
+    result = {}
+    for row, pollutant in enumerate(coefficients.pollutants):
+        result[pollutant.name] = emitted[row]
+        result["{}_saved".format(pollutant.name)] = saved[row]
+    return result
+
+
+def calculate_costs(
+        vehicle_types: np.ndarray,
+        lengths_km: np.ndarray,
+        durations_hours: np.ndarray,
+        coefficients: IndexCoefficients = COEFFICIENTS
+) -> typing.Dict[str, np.ndarray]:
+    fuel_cost = lengths_km * coefficients.fuel_cost_per_km[vehicle_types]
+    time_cost = durations_hours * coefficients.time_cost_per_hour
+    depreciation_cost = (
+        lengths_km * coefficients.depreciation_cost_per_km[vehicle_types])
+    operation_cost = (
+        lengths_km * coefficients.operation_cost_per_km[vehicle_types])
+    total_cost = (
+        (fuel_cost + time_cost + depreciation_cost + operation_cost) *
+        (1 + coefficients.total_cost_overhead[vehicle_types])
+    )
+    return {
+        "fuel_cost": fuel_cost,
+        "time_cost": time_cost,
+        "depreciation_cost": depreciation_cost,
+        "operation_cost": operation_cost,
+        "total_cost": total_cost,
+    }
+
+
+def calculate_consumed_calories(
+        vehicle_types: np.ndarray,
+        speeds_km_h: np.ndarray,
+        durations_minutes: np.ndarray,
+        coefficients: IndexCoefficients = COEFFICIENTS
+) -> np.ndarray:
+    """Calculate consumed calories
+
+    Each vehicle type's consumption per minute is given by the first step
+    whose speed is greater than the segment's speed, or by the last step if
+    there is no such step
+
+    """
+
+    consumption_per_minute = np.zeros(len(vehicle_types))
+    for vehicle_type, (speeds, calories) in coefficients.calorie_steps.items():
+        selection = vehicle_types == vehicle_type
+        step_indexes = np.minimum(
+            np.searchsorted(speeds, speeds_km_h[selection], side="right"),
+            len(speeds) - 1
+        )
+        consumption_per_minute[selection] = calories[step_indexes]
+    return consumption_per_minute * durations_minutes
@@ -8,11 +8,19 @@
 #
 #########################################################################
 
+from collections import deque
 from collections import namedtuple
+import concurrent.futures
 import datetime as dt
 from functools import partial
+import heapq
 import io
+import itertools
 import logging
+import shutil
+import tempfile
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Callable
 from typing import Tuple
@@ -27,6 +35,7 @@ import pytz
 
 from ._constants import VehicleType
 from . import exceptions
+from . import regions
 from . import utils
 from .utils import get_query
 
@@ -50,8 +59,21 @@ DATA_PROCESSING_PARAMETERS = {
     "segments_temporal_upper_bound": (
         dt.datetime.now(pytz.utc) + dt.timedelta(days=1)),
     "segments_small_threshold": 1,
+    # Douglas-Peucker tolerance used for simplifying the stored geometry of
+    # segments, in m. Segments of vehicle types not listed here are stored
+    # with all of their points
+    "segments_simplification_tolerances": {},
+    "region_filter_max_age": 300,  # in seconds
+    # lists with at least this many points, as well as any other iterable of
+    # points, are processed and saved one segment at a time, see
+    # `iter_processed_segments()`
+    "streaming_points_threshold": 20000,
     "points_position_threshold": 0.1,
     "points_accuracy_threshold": 100,
+    # downsampling keeps at most one point every `min_interval` seconds and
+    # every `min_distance` m. It is disabled when both are None
+    "points_downsampling_min_interval": None,
+    "points_downsampling_min_distance": None,
     "segments_speed_thresholds": {  # (average_speed, max_speed), in m/s
         VehicleType.foot: (5.6, 5.6),  # 20km/h , 20 km/h
         VehicleType.bike: (30, 30),  # 108 km/h, 108 km/h
@@ -247,41 +269,219 @@ class PointData(object):
         return self.projected_geometry.Distance(other_point.projected_geometry)
 
 
-def ingest_data(
-        raw_data: str,
+def ingest_points(
+        points: Iterable[PointData],
         owner_uuid: str,
-        db_cursor
-):
-    """Ingest track data into smb database"""
-    points = parse_point_raw_data(raw_data)
-    session_id = get_session_id(points)
-    segments_data = process_data(
-        points,
         db_cursor,
-        **DATA_PROCESSING_PARAMETERS
-    )
-    track_id = save_track(session_id, segments_data, owner_uuid, db_cursor)
+        object_key: str = None,
+        etag: str = None
+):
+    """Ingest already parsed points into smb database
+
+    Points must be sorted by timestamp. The track's session is claimed
+    before processing its points, using the session id of the first point.
+    If the same owner already uploaded this session, ``DuplicateTrackError``
+    is raised. The claim is released if the points cannot be ingested, so
+    that a fixed upload of the same session is accepted. When
+    ``object_key`` and ``etag`` are given, the uploaded object is expected
+    to have been claimed with ``claim_track_upload()``.
+
+    Lists with fewer points than the ``streaming_points_threshold`` setting
+    are processed as a whole. Any other iterable, like the iterator returned
+    by ``parse_points_from_s3()``, is consumed in streaming mode, so that
+    only the points of the segment being built are kept in memory.
+
+    """
+
+    points_iterator = iter(points)
+    first_point = next(points_iterator, None)
+    if first_point is None:
+        raise exceptions.NonRecoverableError(
+            "There are no valid points in input data")
+    session_id = first_point.session_id
+    owner_internal_id = get_track_owner_internal_id(owner_uuid, db_cursor)
+    streaming_threshold = DATA_PROCESSING_PARAMETERS[
+        "streaming_points_threshold"]
+    claim_track_session(owner_internal_id, session_id, db_cursor)
+    try:
+        if not isinstance(points, list) or len(points) >= streaming_threshold:
+            logger.debug("Processing track in streaming mode")
+            track_id, segments_data = save_streamed_track(
+                session_id,
+                iter_processed_segments(
+                    itertools.chain([first_point], points_iterator),
+                    db_cursor,
+                    **DATA_PROCESSING_PARAMETERS
+                ),
+                owner_uuid,
+                db_cursor
+            )
+        else:
+            segments_data = process_data(
+                points,
+                db_cursor,
+                **DATA_PROCESSING_PARAMETERS
+            )
+            track_id = save_track(
+                session_id, segments_data, owner_uuid, db_cursor)
+    except exceptions.NonRecoverableError:
+        release_track_session(owner_internal_id, session_id, db_cursor)
+        raise
     utils.update_track_info(track_id, db_cursor)
+    db_cursor.execute(
+        get_query("update-track-claims.sql"),
+        {
+            "track_id": track_id,
+            "object_key": object_key,
+            "etag": etag,
+            "owner_id": owner_internal_id,
+            "session_id": session_id,
+        }
+    )
     return segments_data, track_id, session_id
 
 
+def claim_track_upload(object_key: str, etag: str, db_cursor):
+    """Claim an uploaded object, so that it is only ingested once
+
+    Raises ``DuplicateTrackError`` if the object has already been claimed.
+    The claim is kept if ingestion fails, as the same object would fail
+    again, in which case the error's ``track_id`` is None.
+
+    """
+
+    _claim_track(
+        "claim-track-upload.sql",
+        "select-track-upload-claim.sql",
+        {"object_key": object_key, "etag": etag},
+        "Object {} ({}) has already been ingested".format(object_key, etag),
+        db_cursor
+    )
+
+
+def claim_track_session(owner_id: int, session_id: int, db_cursor):
+    """Claim a track session, so that it is only ingested once
+
+    Raises ``DuplicateTrackError`` if the session has already been claimed.
+
+    """
+
+    _claim_track(
+        "claim-track-session.sql",
+        "select-track-session-claim.sql",
+        {"owner_id": owner_id, "session_id": session_id},
+        "Session {} of user {} has already been ingested".format(
+            session_id, owner_id),
+        db_cursor
+    )
+
+
+def release_track_session(owner_id: int, session_id: int, db_cursor):
+    """Release the claim on a track session whose ingestion failed"""
+    db_cursor.execute(
+        get_query("delete-track-session-claim.sql"),
+        {"owner_id": owner_id, "session_id": session_id}
+    )
+
+
+def _claim_track(claim_query: str, select_query: str, query_params: dict,
+                 duplicate_message: str, db_cursor):
+    db_cursor.execute(get_query(claim_query), query_params)
+    if db_cursor.fetchone() is None:
+        # the existing claim is only visible to a new statement if it was
+        # committed while the claim was waiting for it
+        db_cursor.execute(get_query(select_query), query_params)
+        existing = db_cursor.fetchone()
+        raise exceptions.DuplicateTrackError(
+            duplicate_message,
+            track_id=existing[0] if existing is not None else None
+        )
+
+
+def claim_track_stage(track_id: int, stage: str, db_cursor) -> bool:
+    """Claim a processing stage of a track and return whether it succeeded
+
+    A stage that has already been completed cannot be claimed again. The
+    claim is rolled back together with the stage's work if the stage fails.
+
+    """
+
+    db_cursor.execute(
+        get_query("claim-track-stage.sql"),
+        {"track_id": track_id, "stage": stage}
+    )
+    return db_cursor.fetchone() is not None
+
+
+def rebuild_track_session_claims(db_cursor):
+    """Claim the sessions and completed stages of all existing tracks"""
+    db_cursor.execute(get_query("rebuild-track-session-claims.sql"))
+
+
 def save_track(session_id, segments_data: FullSegmentData, owner_uuid: str,
                db_cursor):
     owner_internal_id = get_track_owner_internal_id(owner_uuid, db_cursor)
     track_id = insert_track(session_id, owner_internal_id, segments_data,
                             db_cursor)
     insert_points(track_id, segments_data, db_cursor)
-    insert_segments(track_id, segments_data, owner_uuid, db_cursor)
+    insert_segments(
+        track_id, segments_data, owner_uuid, db_cursor,
+        tolerances=DATA_PROCESSING_PARAMETERS[
+            "segments_simplification_tolerances"]
+    )
     return track_id
 
 
+def save_streamed_track(session_id, segments_data: Iterable[Tuple],
+                        owner_uuid: str,
+                        db_cursor) -> Tuple[int, FullSegmentData]:
+    """Save a track while its segments are still being processed
+
+    Each segment is written as soon as ``segments_data`` yields it, and its
+    points are released afterwards. The returned segment data therefore has
+    empty point lists, but the same segment info and validation errors as
+    ``process_data()`` would produce.
+
+    The track is first saved as valid and its validation is updated after
+    the last segment. If processing fails midway, everything that was
+    written for the track is rolled back to a savepoint.
+
+    """
+
+    owner_internal_id = get_track_owner_internal_id(owner_uuid, db_cursor)
+    db_cursor.execute("SAVEPOINT save_streamed_track")
+    try:
+        track_id = insert_track(session_id, owner_internal_id, [], db_cursor)
+        result = []
+        for segment_data in segments_data:
+            insert_points(track_id, [segment_data], db_cursor)
+            insert_segments(
+                track_id, [segment_data], owner_uuid, db_cursor,
+                tolerances=DATA_PROCESSING_PARAMETERS[
+                    "segments_simplification_tolerances"]
+            )
+            segment, info, errors = segment_data
+            result.append(([], info, errors))
+        is_valid, validation_error = get_track_validation(result)
+        db_cursor.execute(
+            get_query("update-track-validation.sql"),
+            {
+                "track_id": track_id,
+                "is_valid": is_valid,
+                "validation_error": validation_error,
+            }
+        )
+    except Exception:
+        db_cursor.execute("ROLLBACK TO SAVEPOINT save_streamed_track")
+        raise
+    db_cursor.execute("RELEASE SAVEPOINT save_streamed_track")
+    return track_id, result
+
+
 def insert_track(session_id: int, owner: int,
                  segments_data: FullSegmentData, db_cursor) -> int:
     """Insert track data into the main database"""
-    track_errors = []
-    for segment_data in segments_data:
-        for error in segment_data[2]:
-            track_errors.append(f'{error["vehicle_type"]}: {error["msg"]}')
+    is_valid, validation_error = get_track_validation(segments_data)
     query = get_query("insert-track.sql")
     db_cursor.execute(
         query,
@@ -289,14 +489,24 @@ def insert_track(session_id: int, owner: int,
             "owner_id": owner,
             "session_id": session_id,
             "created_at": dt.datetime.now(pytz.utc),
-            "is_valid": is_track_valid(segments_data),
-            "validation_error": ", ".join(track_errors)
+            "is_valid": is_valid,
+            "validation_error": validation_error
         }
     )
     track_id = db_cursor.fetchone()[0]
     return track_id
 
 
+def get_track_validation(
+        segments_data: FullSegmentData) -> Tuple[bool, str]:
+    """Return whether a track is valid, along with its validation errors"""
+    track_errors = []
+    for segment_data in segments_data:
+        for error in segment_data[2]:
+            track_errors.append(f'{error["vehicle_type"]}: {error["msg"]}')
+    return is_track_valid(segments_data), ", ".join(track_errors)
+
+
 def insert_points(track_id: int, segments: FullSegmentData, db_cursor):
     query = get_query("insert-point.sql")
     for segment, info, errors in segments:
@@ -332,16 +542,37 @@ def insert_points(track_id: int, segments: FullSegmentData, db_cursor):
 
 
 def insert_segments(track_id: int, segments: FullSegmentData, owner: str,
-                    db_cursor):
+                    db_cursor, tolerances: dict=None):
+    """Insert segments, simplifying their geometry if needed
+
+    Geometries of segments whose vehicle type has a tolerance in
+    ``tolerances`` are simplified before being stored. Their exact length is
+    then recorded in the ``smbbackend_segmentlength`` table.
+
+    """
+
+    tolerances = dict(tolerances or {})
     segment_ids = []
     for segment, info, errors in segments:
+        tolerance = tolerances.get(info.vehicle_type)
+        simplified = (
+            simplify_segment_geometry(info, tolerance)
+            if tolerance is not None else None
+        )
+        if simplified is None:
+            geometry = info.geometry.ExportToWkb()
+            original_geometry = None
+        else:
+            geometry = simplified.ExportToWkb()
+            original_geometry = info.geometry.ExportToWkb()
         db_cursor.execute(
             get_query("insert-segment.sql"),
             {
                 "track_id": track_id,
                 "user_uuid": owner,
                 "vehicle_type": info.vehicle_type.name,
-                "geometry": info.geometry.ExportToWkb(),
+                "geometry": geometry,
+                "original_geometry": original_geometry,
                 "start_date": info.start_date,
                 "end_date": info.end_date,
             }
@@ -350,6 +581,65 @@ def insert_segments(track_id: int, segments: FullSegmentData, owner: str,
     return segment_ids
 
 
+def simplify_segment_geometry(info: SegmentInfo,
+                              tolerance: float) -> ogr.Geometry:
+    """Return the simplified geographic geometry of a segment
+
+    Vertices are selected with ``get_simplification_mask()`` on the
+    projected geometry, so ``tolerance`` is expressed in m. Returns None if
+    no vertex could be removed.
+
+    """
+
+    coordinates = np.array(info.projected_geometry.GetPoints(), dtype=float)
+    keep = get_simplification_mask(coordinates[:, :2], tolerance)
+    if keep.all():
+        return None
+    result = ogr.Geometry(ogr.wkbLineString)
+    for index, point in enumerate(info.geometry.GetPoints()):
+        if keep[index]:
+            result.AddPoint(point[0], point[1])
+    return result
+
+
+def get_simplification_mask(coordinates: np.ndarray,
+                            tolerance: float) -> np.ndarray:
+    """Select the vertices to keep with the Douglas-Peucker algorithm
+
+    ``coordinates`` is an (N, 2) array. The distances of all vertices of a
+    stretch to the line between its ends are calculated at once. Stretches
+    are processed with an explicit stack, rather than by recursion, so that
+    long segments cannot exceed the recursion limit.
+
+    """
+
+    num_vertices = len(coordinates)
+    keep = np.zeros(num_vertices, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, num_vertices - 1)]
+    while len(stack) > 0:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        origin = coordinates[start]
+        direction = coordinates[end] - origin
+        offsets = coordinates[start + 1:end] - origin
+        line_length = np.hypot(direction[0], direction[1])
+        if line_length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(
+                direction[0] * offsets[:, 1] - direction[1] * offsets[:, 0]
+            ) / line_length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+
 def get_session_id(parsed_points: List[PointData]):
     return parsed_points[0].session_id
 
@@ -361,7 +651,26 @@ def process_points(points: List[PointData], **settings):
         accuracy_threshold=settings["points_accuracy_threshold"],
         position_threshold=settings["points_position_threshold"]
     )
-    return filtered_points
+    return list(_iter_downsampled_points(filtered_points, **settings))
+
+
+def _iter_downsampled_points(points: Iterable[PointData],
+                             **settings) -> Iterator[PointData]:
+    stats = {}
+    yield from iter_downsampled_points(
+        points,
+        min_interval=settings.get("points_downsampling_min_interval"),
+        min_distance=settings.get("points_downsampling_min_distance"),
+        minute_threshold=settings["segments_minute_threshold"],
+        distance_thresholds=settings["segments_distance_thresholds"],
+        stats=stats
+    )
+    if stats.get("points"):
+        logger.info(
+            "Downsampled {} points to {} ({:.1%} of the original)".format(
+                stats["points"], stats["kept"],
+                stats["kept"] / stats["points"])
+        )
 
 
 def process_segments(points: List[PointData], db_cursor, **settings):
@@ -389,25 +698,30 @@ def process_segments(points: List[PointData], db_cursor, **settings):
         temporal_lower_bound=settings["segments_temporal_lower_bound"],
         temporal_upper_bound=settings["segments_temporal_upper_bound"],
         db_cursor=db_cursor,
-        small_segments_threshold=settings["segments_small_threshold"]
+        small_segments_threshold=settings["segments_small_threshold"],
+        region_filter_max_age=settings.get("region_filter_max_age", 300)
     )
     result = []
     for segment in filtered_segments:
-        info = get_segment_info(segment)
-
-        type_ = info.vehicle_type
-        avg, max_ = settings["segments_speed_thresholds"].get(type_, (0, 0))
-        validation_errors = validate_segment_info(
-            info,
-            average_speed=avg,
-            max_speed=max_,
-            length=settings["segments_length_thresholds"].get(type_, 0),
-            duration=settings["segments_duration_thresholds"].get(type_, 0),
-        )
-        result.append((segment, info, validation_errors))
+        result.append(get_full_segment_data(segment, **settings))
     return result
 
 
+def get_full_segment_data(segment: List[PointData], **settings):
+    """Return the segment along with its info and validation errors"""
+    info = get_segment_info(segment)
+    type_ = info.vehicle_type
+    avg, max_ = settings["segments_speed_thresholds"].get(type_, (0, 0))
+    validation_errors = validate_segment_info(
+        info,
+        average_speed=avg,
+        max_speed=max_,
+        length=settings["segments_length_thresholds"].get(type_, 0),
+        duration=settings["segments_duration_thresholds"].get(type_, 0),
+    )
+    return segment, info, validation_errors
+
+
 def process_data(points: List[PointData], cursor,
                  **settings) -> FullSegmentData:
     """Process the raw collected points into segments"""
@@ -422,24 +736,189 @@ def process_data(points: List[PointData], cursor,
         return segments_data
 
 
-def get_data_from_s3(bucket_name: str, object_key: str,
-                     encoding: str="utf-8") -> str:
-    """Download track data file from S3 and return the data
+def iter_processed_segments(points: Iterable[PointData], db_cursor,
+                            **settings) -> Iterator[Tuple]:
+    """Process points into segments, yielding each one as soon as it is final
+
+    This is the streaming counterpart of ``process_data()``. Points must be
+    sorted by timestamp. Every step only needs the points of the segment
+    that is currently being built, so segments are yielded in the same
+    order, and with the same info and validation errors, as the ones
+    returned by ``process_data()``.
 
-    Track data is uploaded to S3 as a zip file. This function will download
-    and unzip the data
+    Errors that ``process_data()`` raises upfront are raised when they are
+    detected. This may happen after some segments have been yielded.
+
+    """
+
+    counts = {"filtered": 0, "final": 0}
+
+    def count(name, iterable):
+        for item in iterable:
+            counts[name] += 1
+            yield item
+
+    filtered_points = count("filtered", _iter_downsampled_points(
+        iter_filtered_points(
+            points,
+            accuracy_threshold=settings["points_accuracy_threshold"],
+            position_threshold=settings["points_position_threshold"]
+        ),
+        **settings
+    ))
+    generate = partial(
+        iter_generated_segments,
+        minute_threshold=settings["segments_minute_threshold"],
+        distance_thresholds=settings["segments_distance_thresholds"]
+    )
+    final_points = count("final", (
+        point
+        for segment in generate(filtered_points)
+        for point in filter_pairwise_segment_points(
+            segment, settings["segments_pairwise_stddev_coeff"])
+    ))
+    num_segments = 0
+    for segment in generate(final_points):
+        filtered_segments = apply_segment_filters(
+            [segment],
+            temporal_lower_bound=settings["segments_temporal_lower_bound"],
+            temporal_upper_bound=settings["segments_temporal_upper_bound"],
+            db_cursor=db_cursor,
+            small_segments_threshold=settings["segments_small_threshold"],
+            region_filter_max_age=settings.get("region_filter_max_age", 300)
+        )
+        for filtered_segment in filtered_segments:
+            num_segments += 1
+            yield get_full_segment_data(filtered_segment, **settings)
+    if counts["filtered"] < 2:
+        raise exceptions.NonRecoverableError(
+            "cannot generate segments, not enough points left")
+    elif counts["final"] < 2:
+        raise exceptions.NonRecoverableError(
+            "cannot generate final segments, not enough points left")
+    elif num_segments == 0:
+        raise exceptions.NonRecoverableError("no segments could be generated")
+
+
+def parse_points_from_s3(bucket_name: str, object_key: str,
+                         encoding: str="utf-8",
+                         max_workers: int=None) -> Iterator[PointData]:
+    """Download a zipped track data file from S3 and yield its points
+
+    The object is saved to a temporary file, so that its members can be
+    parsed separately with ``parse_point_archive()``. The object is only
+    downloaded when the first point is requested, and the temporary file is
+    removed once all points have been consumed.
 
     """
 
     s3 = boto3.resource("s3")
-    obj = s3.Object(bucket_name, object_key)
-    response = obj.get()
-    input_buffer = io.BytesIO(response["Body"].read())
-    result = ""
-    with zipfile.ZipFile(input_buffer) as zip_handler:
-        for member_name in zip_handler.namelist():
-            result += zip_handler.read(member_name).decode(encoding)
-    return result
+    response = s3.Object(bucket_name, object_key).get()
+    with tempfile.NamedTemporaryFile(suffix=".zip") as archive:
+        shutil.copyfileobj(response["Body"], archive)
+        archive.flush()
+        yield from parse_point_archive(
+            archive.name, encoding=encoding, max_workers=max_workers)
+
+
+def parse_point_archive(path: str, encoding: str="utf-8",
+                        max_workers: int=None) -> Iterator[PointData]:
+    """Parse the points of all members of a zip archive
+
+    Each member has its own header and is parsed separately, in a pool of
+    ``max_workers`` processes. The points of all members are then lazily
+    merged by timestamp. Members are parsed one after the other when the
+    archive has a single member, when ``max_workers`` is 1, or when
+    processes cannot be started, like in AWS lambda, which lacks
+    ``/dev/shm``.
+
+    Members that are parsed one after the other are decompressed and parsed
+    as their points are consumed, so that only a few points of each member
+    are in memory at any time. This does not hold for members whose points
+    are not sorted by timestamp, which are sorted in memory, nor for members
+    that are parsed in parallel, which are returned as whole lists by the
+    worker processes.
+
+    """
+
+    with zipfile.ZipFile(path) as zip_handler:
+        member_names = zip_handler.namelist()
+    parse_member = partial(_parse_archive_member, path, encoding=encoding)
+    chunks = None
+    if len(member_names) > 1 and max_workers != 1:
+        try:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=max_workers) as executor:
+                chunks = list(executor.map(parse_member, member_names))
+        except (OSError, NotImplementedError) as exc:
+            logger.warning(
+                "Could not parse archive members in parallel, parsing them "
+                "serially: {}".format(exc)
+            )
+    if chunks is None:
+        chunks = [
+            _iter_archive_member_points(path, name, encoding=encoding)
+            for name in member_names
+        ]
+    return heapq.merge(*chunks, key=lambda pt: pt.timestamp)
+
+
+def _parse_archive_member(path: str, member_name: str,
+                          encoding: str="utf-8") -> List[PointData]:
+    with zipfile.ZipFile(path) as zip_handler:
+        with zip_handler.open(member_name) as member:
+            lines = io.TextIOWrapper(member, encoding=encoding)
+            next(lines, None)  # ignoring first line, it is file header
+            return parse_point_lines(lines, first_line_number=1)
+
+
+def _iter_archive_member_points(path: str, member_name: str,
+                                encoding: str="utf-8") -> Iterator[PointData]:
+    """Yield the points of an archive member by timestamp
+
+    The member is first scanned for its timestamps only. If they are already
+    ascending, which is the norm, the member is then parsed lazily.
+
+    """
+
+    with zipfile.ZipFile(path) as zip_handler:
+        with zip_handler.open(member_name) as member:
+            lines = io.TextIOWrapper(member, encoding=encoding)
+            next(lines, None)  # ignoring first line, it is file header
+            is_sorted = _are_raw_points_sorted(lines)
+    if not is_sorted:
+        logger.debug(
+            "Points of member {!r} are not sorted, sorting them...".format(
+                member_name)
+        )
+        yield from _parse_archive_member(path, member_name, encoding=encoding)
+    else:
+        with zipfile.ZipFile(path) as zip_handler:
+            with zip_handler.open(member_name) as member:
+                lines = io.TextIOWrapper(member, encoding=encoding)
+                next(lines, None)  # ignoring first line, it is file header
+                yield from iter_parsed_points(lines, first_line_number=1)
+
+
+def _are_raw_points_sorted(lines: Iterable[str]) -> bool:
+    """Check whether the timestamps of raw points are ascending
+
+    Lines whose timestamp cannot be read are ignored, since they are not
+    going to be parsed into points either.
+
+    """
+
+    previous = None
+    for line in lines:
+        try:
+            # the same field as the one used by `PointData.from_raw_point()`
+            timestamp = int(line.split(",")[20].strip())
+        except (IndexError, ValueError):
+            continue
+        if previous is not None and timestamp < previous:
+            return False
+        previous = timestamp
+    return True
 
 
 def get_track_owner_internal_id(keycloak_uuid: str, db_cursor):
@@ -496,32 +975,228 @@ def remove_spatially_similar_points(points: List[PointData],
     The input ``points`` are assumed to be ordered by their timestamp
     """
 
-    result = []
+    return list(_iter_spatially_distinct_points(points, threshold))
+
+
+def _iter_spatially_distinct_points(points: Iterable[PointData],
+                                    threshold: float) -> Iterator[PointData]:
+    recent = deque(maxlen=10)
     for point in points:
         # iterate backwards through last 10 items - these are the ones
         # temporally closer to current point
-        for other_point in result[-1:-11:-1]:
+        for other_point in reversed(recent):
             position_delta = point.get_distance(other_point)
             if position_delta < threshold:
                 break
         else:
-            result.append(point)
-    return result
+            recent.append(point)
+            yield point
+
+
+def iter_downsampled_points(points: Iterable[PointData],
+                            min_interval: float=None,
+                            min_distance: float=None,
+                            minute_threshold: int=5,
+                            distance_thresholds: dict=None,
+                            stats: dict=None) -> Iterator[PointData]:
+    """Thin out points that are too close to each other in time and space
+
+    A point is kept once at least ``min_interval`` seconds have passed and
+    ``min_distance`` m have been travelled since the last kept point.
+    Either may be None, in order to ignore it. When both are None, points
+    are passed through untouched.
+
+    Points are always kept on both sides of what ``generate_segments()``
+    would consider a segment boundary, using the same ``minute_threshold``
+    and ``distance_thresholds``. A point is also kept whenever dropping it
+    would make the gap between two kept points look like a boundary. The
+    slowest and fastest points between two kept points are kept too, if
+    their speed is beyond that of both kept points, so that speed extrema
+    are preserved. Segments keep at least three points, if they had that
+    many to begin with.
+
+    When ``stats`` is given, the number of input and kept points are stored
+    in its ``points`` and ``kept`` keys once all points have been consumed.
+
+    """
+
+    if min_interval is None and min_distance is None:
+        yield from points
+        return
+    distance_thresholds = dict(distance_thresholds or {})
+
+    def is_gap(start: PointData, end: PointData, travelled: float):
+        minutes_passed = (end.timestamp - start.timestamp).seconds / 60
+        max_distance = distance_thresholds.get(end.vehicle_type, float("inf"))
+        return (
+            end.vehicle_type != start.vehicle_type or
+            minutes_passed > minute_threshold or
+            travelled > max_distance
+        )
+
+    extrema = {}
+
+    def flush(start: PointData, point: PointData):
+        dropped = {}
+        slowest = extrema.get("slowest")
+        if slowest is not None and slowest.speed < min(
+                start.speed, point.speed):
+            dropped[id(slowest)] = slowest
+        fastest = extrema.get("fastest")
+        if fastest is not None and fastest.speed > max(
+                start.speed, point.speed):
+            dropped[id(fastest)] = fastest
+        dropped.pop(id(point), None)
+        extrema.clear()
+        yield from sorted(dropped.values(), key=lambda pt: pt.timestamp)
+        yield point
+
+    def update_extrema(point: PointData):
+        if "slowest" not in extrema or point.speed < extrema["slowest"].speed:
+            extrema["slowest"] = point
+        if "fastest" not in extrema or point.speed > extrema["fastest"].speed:
+            extrema["fastest"] = point
+
+    def close(segment: List[PointData], last: List[PointData],
+              interior: PointData):
+        if len(segment) >= 3:
+            return last
+        closed = segment + last
+        if len(closed) == 2 and interior not in (None, closed[-1]):
+            closed.insert(1, interior)
+        return closed
+
+    num_points = 0
+    num_kept = 0
+    anchor = None  # the last kept point
+    previous = None
+    travelled = 0
+    # the first kept points of the current segment are held back until there
+    # are three of them. If the segment ends before that, one of its dropped
+    # points is kept too, so that it is not discarded as too short
+    segment = []
+    interior = None
+    for point in points:
+        num_points += 1
+        kept = []
+        if anchor is None:
+            kept.append(point)
+            anchor = point
+        else:
+            distance = point.get_distance(previous)
+            if (previous is not anchor and
+                    is_gap(anchor, point, travelled + distance)):
+                kept.extend(flush(anchor, previous))
+                anchor = previous
+                travelled = 0
+            if is_gap(previous, point, distance):
+                closed = close(segment, kept, interior)
+                num_kept += len(closed)
+                yield from closed
+                kept = []
+                segment = []
+                interior = None
+            travelled += distance
+            elapsed = (point.timestamp - anchor.timestamp).total_seconds()
+            is_due = (
+                (min_interval is None or elapsed >= min_interval) and
+                (min_distance is None or travelled >= min_distance)
+            )
+            if is_due or is_gap(anchor, point, travelled):
+                kept.extend(flush(anchor, point))
+                anchor = point
+                travelled = 0
+            else:
+                update_extrema(point)
+                interior = point if interior is None else interior
+        previous = point
+        for kept_point in kept:
+            if len(segment) < 3:
+                segment.append(kept_point)
+                if len(segment) == 3:
+                    num_kept += 3
+                    yield from segment
+            else:
+                num_kept += 1
+                yield kept_point
+    last = []
+    if previous is not None and previous is not anchor:
+        last = list(flush(anchor, previous))
+    closed = close(segment, last, interior)
+    num_kept += len(closed)
+    yield from closed
+    if stats is not None:
+        stats["points"] = num_points
+        stats["kept"] = num_kept
+
+
+def iter_filtered_points(points: Iterable[PointData],
+                         accuracy_threshold: float,
+                         position_threshold: float) -> Iterator[PointData]:
+    """Validate and filter points one at a time
+
+    This is the streaming counterpart of ``validate_points()`` followed by
+    ``filter_point_data()``.
+
+    """
+
+    session_ids = set()
+
+    def validate(iterable):
+        for point in iterable:
+            session_ids.add(point.session_id)
+            if len(session_ids) > 1:
+                raise exceptions.NonRecoverableError(
+                    "Multiple session identifiers present in input data")
+            yield point
+
+    accurate = (
+        pt for pt in validate(points) if pt.accuracy <= accuracy_threshold)
+    yield from _iter_spatially_distinct_points(accurate, position_threshold)
+    if len(session_ids) == 0:
+        raise exceptions.NonRecoverableError(
+            "There are no valid points in input data")
 
 
 def parse_point_raw_data(data: str) -> List[PointData]:
     """Parse input data into a list of ``PointData`` instances"""
-    points = []
-    for index, line in enumerate(data.splitlines()):
-        if index > 0 and line != "":  # ignoring first line, it is file header
+    # ignoring first line, it is file header
+    return parse_point_lines(
+        itertools.islice(data.splitlines(), 1, None), first_line_number=1)
+
+
+def parse_point_lines(lines: Iterable[str],
+                      first_line_number: int=0) -> List[PointData]:
+    """Parse lines without headers into a list of ``PointData`` instances
+
+    ``lines`` may be any iterable, like the lines of an open file, so that
+    points are parsed as the data is read. Points are sorted by timestamp.
+
+    """
+
+    points = list(
+        iter_parsed_points(lines, first_line_number=first_line_number))
+    points.sort(key=lambda pt: pt.timestamp)  # timestamps must be ascending
+    return points
+
+
+def iter_parsed_points(lines: Iterable[str],
+                       first_line_number: int=0) -> Iterator[PointData]:
+    """Parse lines without headers, yielding a ``PointData`` for each one
+
+    This is the lazy counterpart of ``parse_point_lines()``. Points are
+    yielded in the same order as their lines, without sorting them.
+
+    """
+
+    for index, line in enumerate(lines, start=first_line_number):
+        if line != "":
             try:
                 point = PointData.from_raw_point(line)
             except (IndexError, ValueError):
                 logger.exception("Could not parse line {}".format(index))
             else:
-                points.append(point)
-    points.sort(key=lambda pt: pt.timestamp)  # timestamps must be ascending
-    return points
+                yield point
 
 
 def validate_points(points: List[PointData]):
@@ -553,9 +1228,26 @@ def generate_segments(points: List[PointData], minute_threshold: int,
 
     """
 
-    segments = [[points[0]]]
-    for pt in points[1:]:
-        last_point = segments[-1][-1]
+    return list(iter_generated_segments(
+        points, minute_threshold, distance_thresholds))
+
+
+def iter_generated_segments(points: Iterable[PointData],
+                            minute_threshold: int,
+                            distance_thresholds: dict) -> Iterator[List]:
+    """Split the input points into segments, yielding each one when complete
+
+    This is the streaming counterpart of ``generate_segments()``. Segments
+    with two points or less are discarded.
+
+    """
+
+    segment = []
+    for pt in points:
+        if len(segment) == 0:
+            segment.append(pt)
+            continue
+        last_point = segment[-1]
         vehicle_changed = pt.vehicle_type != last_point.vehicle_type
         minutes_passed = (pt.timestamp - last_point.timestamp).seconds / 60
         too_much_time_passed = minutes_passed > minute_threshold
@@ -584,11 +1276,13 @@ def generate_segments(points: List[PointData], minute_threshold: int,
         else:
             start_new_segment = False
         if start_new_segment:
-            segments.append([pt])  # start new segment
+            if len(segment) > 2:
+                yield segment
+            segment = [pt]  # start new segment
         else:
-            segments[-1].append(pt)
-    long_enough_segments = [seg for seg in segments if len(seg) > 2]
-    return long_enough_segments
+            segment.append(pt)
+    if len(segment) > 2:
+        yield segment
 
 
 def filter_invalid_temporal_points(segments: SegmentData,
@@ -608,6 +1302,33 @@ def filter_invalid_temporal_points(segments: SegmentData,
     return _reconcile_segments(segments, test_func=_check_temporal_bounds)
 
 
+def filter_points_outside_region(
+        segments: SegmentData,
+        region_filter: regions.RegionFilter
+) -> SegmentData:
+    """Discard points that are outside the region of interest
+
+    All points are checked in a single vectorized call. Segments are split
+    where points have been discarded, as with the other point filters.
+
+    """
+
+    all_points = [point for segment in segments for point in segment]
+    inside = region_filter.contains(
+        np.fromiter((pt.longitude for pt in all_points), dtype=float,
+                    count=len(all_points)),
+        np.fromiter((pt.latitude for pt in all_points), dtype=float,
+                    count=len(all_points))
+    )
+    logger.debug(
+        f"Removed {len(inside) - inside.sum()} points outside the region of "
+        f"interest"
+    )
+    # `_reconcile_segments` tests points in the same order as `all_points`
+    results = iter(inside.tolist())
+    return _reconcile_segments(segments, test_func=lambda pt: next(results))
+
+
 def _segment_point_valid(new_segment: List, original_segment: List[PointData],
                          point: PointData, point_index: int, result: List):
     new_segment.append(point)
@@ -765,9 +1486,18 @@ def apply_segment_filters(segments: SegmentData,
                           temporal_lower_bound: dt.datetime,
                           temporal_upper_bound: dt.datetime,
                           db_cursor,
-                          small_segments_threshold: int=1) -> SegmentData:
+                          small_segments_threshold: int=1,
+                          region_filter_max_age: float=300) -> SegmentData:
     """Filter out invalid segments and points according to various criteria"""
     filters = [
+        (
+            filter_points_outside_region,
+            None,
+            {
+                "region_filter": regions.get_region_filter(
+                    db_cursor, max_age=region_filter_max_age)
+            }
+        ),
         (
             filter_invalid_temporal_points,
             None,
@@ -0,0 +1,320 @@
+#########################################################################
+#
+# Copyright 2018, GeoSolutions Sas.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+#
+#########################################################################
+
+"""Preparation of regions of interest for spatial queries
+
+Regions of interest are subdivided into small pieces, which are stored in
+GiST-indexed tables. Spatial queries then only need to look at the few
+pieces that are near each geometry, instead of the whole region.
+
+Regions that are created or modified afterwards are subdivided lazily, the
+next time that their pieces are needed.
+
+Pieces are also used in-process by ``RegionFilter``, in order to discard
+collected points that lie outside the region of interest before they are
+written to the DB.
+
+"""
+
+import argparse
+import logging
+import os
+import time
+import typing
+
+import numpy as np
+from osgeo import ogr
+
+from . import calculateprizes
+from . import utils
+from .utils import get_query
+
+logger = logging.getLogger(__name__)
+
+_REGION_FILTER_CACHE = {}
+
+
+def main():
+    parser = _get_parser()
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    connection = utils.get_db_connection(
+        host=args.db_host,
+        port=args.db_port,
+        dbname=args.db_name,
+        user=args.db_user,
+        password=args.db_password,
+    )
+    with connection:
+        with connection.cursor() as cursor:
+            logger.info("Subdividing regions of interest...")
+            num_track_pieces, num_prize_pieces = prepare_regions(
+                cursor, max_vertices=args.max_vertices)
+            logger.info(
+                f"Created {num_track_pieces} track region pieces and "
+                f"{num_prize_pieces} competition region pieces"
+            )
+            logger.info("Rebuilding competition standings...")
+            calculateprizes.rebuild_competition_standings(cursor)
+            if args.benchmark is not None:
+                timings = benchmark_external_points(
+                    args.benchmark, cursor, repetitions=args.repetitions)
+                for name, seconds in timings.items():
+                    logger.info(
+                        f"{name}: {seconds * 1000:.1f} ms per query")
+    connection.close()
+    logger.info("Done!")
+
+
+def prepare_regions(db_cursor,
+                    max_vertices: int = 256) -> typing.Tuple[int, int]:
+    """Replace the pieces of all regions of interest with fresh ones
+
+    Cached overlaps between tracks and competition regions are cleared too,
+    since they may no longer be accurate. Returns the number of pieces of
+    track regions and of competition regions.
+
+    """
+
+    db_cursor.execute(get_query("create-region-pieces-tables.sql"))
+    db_cursor.execute(get_query("create-roi-overlap-tables.sql"))
+    db_cursor.execute(
+        get_query("refresh-region-pieces.sql"),
+        {"max_vertices": max_vertices}
+    )
+    db_cursor.execute(
+        "SELECT "
+        "(SELECT COUNT(1) FROM smbbackend_trackregionpiece), "
+        "(SELECT COUNT(1) FROM smbbackend_prizeregionpiece)"
+    )
+    return db_cursor.fetchone()
+
+
+def benchmark_external_points(track_id: int, db_cursor,
+                              repetitions: int = 5) -> typing.Dict[str, float]:
+    """Time the search for a track's points outside the region of interest
+
+    The search is done both on the whole regions, combined on the fly, and on
+    their subdivided pieces. Returns the mean duration of each, in seconds.
+
+    """
+
+    result = {}
+    counts = {}
+    for name, query_path in [
+        ("whole regions", "select-count-external-points-collected.sql"),
+        ("subdivided regions", "select-count-external-points.sql"),
+    ]:
+        query = get_query(query_path)
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            db_cursor.execute(query, {"track_id": track_id})
+            counts[name] = db_cursor.fetchone()[0]
+        result[name] = (time.perf_counter() - start) / repetitions
+    if len(set(counts.values())) > 1:
+        logger.warning(
+            f"Number of external points does not match: {counts}")
+    return result
+
+
+class RegionFilter:
+    """Check whether points lie inside the region of interest
+
+    The region is made of subdivided pieces, each with its bounding box and
+    its rings, as (N, 2) arrays of coordinates. Points are first checked
+    against the bounding boxes, all at once. Only points inside the box of a
+    piece that is not itself a box go through the point-in-polygon test.
+
+    A filter without pieces accepts every point, since it means that no
+    region of interest has been defined.
+
+    """
+
+    def __init__(self, bounds: np.ndarray,
+                 rings: typing.List[typing.List[np.ndarray]],
+                 is_box: np.ndarray):
+        self.bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+        self.rings = rings
+        self.is_box = np.asarray(is_box, dtype=bool)
+        if len(self.bounds) > 0:
+            self.extent = np.concatenate((
+                self.bounds[:, :2].min(axis=0),
+                self.bounds[:, 2:].max(axis=0)
+            ))
+        else:
+            self.extent = None
+
+    @classmethod
+    def from_db(cls, db_cursor) -> "RegionFilter":
+        db_cursor.execute(get_query("select-region-pieces.sql"))
+        bounds = []
+        rings = []
+        is_box = []
+        for wkb, *piece_bounds, piece_is_box in db_cursor.fetchall():
+            geometry = ogr.CreateGeometryFromWkb(bytes(wkb))
+            bounds.append(piece_bounds)
+            rings.append(_get_rings(geometry))
+            is_box.append(piece_is_box)
+        return cls(np.array(bounds), rings, np.array(is_box))
+
+    def contains(self, longitudes: np.ndarray,
+                 latitudes: np.ndarray) -> np.ndarray:
+        """Return a boolean array telling which points are inside the region"""
+        x = np.asarray(longitudes, dtype=float)
+        y = np.asarray(latitudes, dtype=float)
+        if self.extent is None:
+            return np.ones(len(x), dtype=bool)
+        result = np.zeros(len(x), dtype=bool)
+        extent_min_x, extent_min_y, extent_max_x, extent_max_y = self.extent
+        pending = np.flatnonzero(
+            (x >= extent_min_x) & (x <= extent_max_x) &
+            (y >= extent_min_y) & (y <= extent_max_y)
+        )
+        for index, (min_x, min_y, max_x, max_y) in enumerate(self.bounds):
+            if len(pending) == 0:
+                break
+            px = x[pending]
+            py = y[pending]
+            in_box = (
+                (px >= min_x) & (px <= max_x) & (py >= min_y) & (py <= max_y))
+            if not in_box.any():
+                continue
+            if not self.is_box[index]:
+                in_box[in_box] = _points_in_rings(
+                    px[in_box], py[in_box], self.rings[index])
+            result[pending[in_box]] = True
+            pending = pending[~in_box]
+        return result
+
+
+def get_region_filter(db_cursor, max_age: float = 300) -> RegionFilter:
+    """Return the region filter, reloading it if it is older than max_age
+
+    The filter is cached at module level, so warm processes (like a reused
+    lambda container) only load it from the DB once every ``max_age``
+    seconds. It is also reloaded as soon as any region of interest is
+    modified, after bringing the pieces of the regions up to date.
+
+    """
+
+    now = time.monotonic()
+    version = utils.get_regions_version(db_cursor, "tracks_regionofinterest")
+    cached = _REGION_FILTER_CACHE.get("filter")
+    if (cached is None or
+            version != _REGION_FILTER_CACHE["version"] or
+            now - _REGION_FILTER_CACHE["loaded_at"] > max_age):
+        update_track_region_pieces(db_cursor)
+        logger.debug("Loading region of interest pieces...")
+        cached = RegionFilter.from_db(db_cursor)
+        _REGION_FILTER_CACHE.update(
+            filter=cached, loaded_at=now, version=version)
+    return cached
+
+
+def update_track_region_pieces(db_cursor) -> typing.List[int]:
+    """Subdivide the tracks' regions of interest that have been modified
+
+    Returns the ids of the regions whose pieces changed.
+
+    """
+
+    return utils.update_region_pieces(
+        db_cursor, "tracks_regionofinterest", "smbbackend_trackregionpiece")
+
+
+def _get_rings(geometry: ogr.Geometry) -> typing.List[np.ndarray]:
+    """Return all rings of a polygon or multipolygon as coordinate arrays"""
+    if geometry.GetGeometryType() in (ogr.wkbMultiPolygon,
+                                      ogr.wkbGeometryCollection):
+        polygons = [
+            geometry.GetGeometryRef(index)
+            for index in range(geometry.GetGeometryCount())
+        ]
+    else:
+        polygons = [geometry]
+    rings = []
+    for polygon in polygons:
+        for index in range(polygon.GetGeometryCount()):
+            points = polygon.GetGeometryRef(index).GetPoints()
+            rings.append(np.array(points, dtype=float)[:, :2])
+    return rings
+
+
+def _points_in_rings(x: np.ndarray, y: np.ndarray,
+                     rings: typing.List[np.ndarray]) -> np.ndarray:
+    """Even-odd ray casting test, vectorized over points
+
+    Holes are handled by the even-odd rule, since a point inside a hole
+    crosses both the exterior and the hole's ring.
+
+    """
+
+    inside = np.zeros(len(x), dtype=bool)
+    for ring in rings:
+        x1, y1 = ring[:-1, 0], ring[:-1, 1]
+        x2, y2 = ring[1:, 0], ring[1:, 1]
+        for edge in range(len(x1)):
+            crosses = (y1[edge] > y) != (y2[edge] > y)
+            if not crosses.any():
+                continue
+            intersection_x = x1[edge] + (y[crosses] - y1[edge]) * (
+                x2[edge] - x1[edge]) / (y2[edge] - y1[edge])
+            inside[crosses] ^= x[crosses] < intersection_x
+    return inside
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-m",
+        "--max-vertices",
+        default=256,
+        type=int,
+        help="Maximum number of vertices of each region piece. Default: "
+             "%(default)s"
+    )
+    parser.add_argument(
+        "-b",
+        "--benchmark",
+        type=int,
+        metavar="TRACK_ID",
+        help="After preparing regions, compare the time needed to find the "
+             "points of this track that are outside the region of interest, "
+             "with and without subdivided regions"
+    )
+    parser.add_argument(
+        "-r",
+        "--repetitions",
+        default=5,
+        type=int,
+        help="Number of times that each benchmark query is run. Default: "
+             "%(default)s"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true"
+    )
+    parser.add_argument("--db-host")
+    parser.add_argument("--db-port", type=int)
+    parser.add_argument("--db-name")
+    parser.add_argument("--db-user")
+    parser.add_argument("--db-password")
+    parser.set_defaults(
+        db_host=os.getenv("DB_HOST", "localhost"),
+        db_port=int(os.getenv("DB_PORT", "5432")),
+        db_name=os.getenv("DB_NAME"),
+        db_user=os.getenv("DB_USER"),
+        db_password=os.getenv("DB_PASSWORD"),
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+-- claim a track session for ingestion
+--
+-- returns a row only if the claim was successful. Concurrent claims on the
+-- same session wait for the first one to be committed or rolled back
+--
+INSERT INTO smbbackend_tracksessionclaim (owner_id, session_id)
+VALUES (%(owner_id)s, %(session_id)s)
+ON CONFLICT DO NOTHING
+RETURNING owner_id
@@ -0,0 +1,11 @@
+-- claim a processing stage of a track
+--
+-- returns a row if the claim was successful. The claim is made in the same
+-- transaction as the stage's work, so a stage that failed is claimed again
+-- when it is retried. Concurrent claims on the same stage wait for the first
+-- one to be committed or rolled back
+--
+INSERT INTO smbbackend_trackstage (track_id, stage)
+VALUES (%(track_id)s, %(stage)s)
+ON CONFLICT DO NOTHING
+RETURNING track_id
@@ -0,0 +1,9 @@
+-- claim an uploaded object for ingestion
+--
+-- returns a row only if the claim was successful. Concurrent claims on the
+-- same object wait for the first one to be committed or rolled back
+--
+INSERT INTO smbbackend_trackuploadclaim (object_key, etag)
+VALUES (%(object_key)s, %(etag)s)
+ON CONFLICT DO NOTHING
+RETURNING object_key
@@ -0,0 +1,11 @@
+-- record of the competitions that have already been closed
+--
+-- competitions are recorded in the same transaction that closes them, so
+-- that a run that is interrupted can be resumed without processing them
+-- again. This also covers competitions that ended without any winners
+--
+CREATE TABLE IF NOT EXISTS smbbackend_competitionrun (
+  competition_id INTEGER PRIMARY KEY,
+  closed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  num_winners INTEGER NOT NULL
+);
@@ -0,0 +1,28 @@
+-- incrementally maintained standings of competitions
+--
+-- - `smbbackend_competitionstandingtrack` records which tracks have already
+--   been accounted for in each competition;
+-- - `smbbackend_competitionstanding` has, for each competition, participant
+--   and criterium, the sum of the criterium's values over the participant's
+--   tracks. For competitions with regions of interest, it also has the sums
+--   of the tracks' lengths and of their overlaps with the regions, which are
+--   used for weighting the value.
+--
+-- Criteria are identified by the name of the respective `PrizeCriterium`.
+-- Lengths are expressed in m
+--
+CREATE TABLE IF NOT EXISTS smbbackend_competitionstandingtrack (
+  competition_id INTEGER NOT NULL,
+  track_id INTEGER NOT NULL,
+  PRIMARY KEY (competition_id, track_id)
+);
+
+CREATE TABLE IF NOT EXISTS smbbackend_competitionstanding (
+  competition_id INTEGER NOT NULL,
+  user_id INTEGER NOT NULL,
+  criterium VARCHAR(50) NOT NULL,
+  value_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+  track_length_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+  overlap_length_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+  PRIMARY KEY (competition_id, criterium, user_id)
+);
@@ -0,0 +1,31 @@
+-- tables with versioned coefficients for calculating indexes in the DB
+--
+-- contents are loaded from `_constants` by
+-- `calculateindexes.load_coefficients()`
+--
+CREATE TABLE IF NOT EXISTS smbbackend_indexcoefficients (
+  version VARCHAR(40) NOT NULL,
+  vehicle_type VARCHAR(20) NOT NULL,
+  so2 DOUBLE PRECISION NOT NULL,
+  nox DOUBLE PRECISION NOT NULL,
+  co DOUBLE PRECISION NOT NULL,
+  co2 DOUBLE PRECISION NOT NULL,
+  pm10 DOUBLE PRECISION NOT NULL,
+  passenger_count DOUBLE PRECISION NOT NULL,
+  fuel_cost_per_km DOUBLE PRECISION NOT NULL,
+  depreciation_cost_per_km DOUBLE PRECISION NOT NULL,
+  operation_cost_per_km DOUBLE PRECISION NOT NULL,
+  total_cost_overhead DOUBLE PRECISION NOT NULL,
+  time_cost_per_hour DOUBLE PRECISION NOT NULL,
+  created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  PRIMARY KEY (version, vehicle_type)
+);
+
+CREATE TABLE IF NOT EXISTS smbbackend_caloriestep (
+  version VARCHAR(40) NOT NULL,
+  vehicle_type VARCHAR(20) NOT NULL,
+  step_order INTEGER NOT NULL,
+  speed DOUBLE PRECISION NOT NULL,
+  calories DOUBLE PRECISION NOT NULL,
+  PRIMARY KEY (version, vehicle_type, step_order)
+);
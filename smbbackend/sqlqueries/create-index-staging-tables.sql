@@ -0,0 +1,38 @@
+-- create session-scoped staging tables for bulk loading indexes with COPY
+--
+-- rows are discarded at the end of each transaction
+--
+CREATE TEMPORARY TABLE IF NOT EXISTS staging_emission (
+  so2 DOUBLE PRECISION,
+  so2_saved DOUBLE PRECISION,
+  nox DOUBLE PRECISION,
+  nox_saved DOUBLE PRECISION,
+  co DOUBLE PRECISION,
+  co_saved DOUBLE PRECISION,
+  co2 DOUBLE PRECISION,
+  co2_saved DOUBLE PRECISION,
+  pm10 DOUBLE PRECISION,
+  pm10_saved DOUBLE PRECISION,
+  segment_id INTEGER
+) ON COMMIT DELETE ROWS;
+
+CREATE TEMPORARY TABLE IF NOT EXISTS staging_cost (
+  fuel_cost DOUBLE PRECISION,
+  time_cost DOUBLE PRECISION,
+  depreciation_cost DOUBLE PRECISION,
+  operation_cost DOUBLE PRECISION,
+  total_cost DOUBLE PRECISION,
+  segment_id INTEGER
+) ON COMMIT DELETE ROWS;
+
+CREATE TEMPORARY TABLE IF NOT EXISTS staging_health (
+  calories_consumed DOUBLE PRECISION,
+  segment_id INTEGER
+) ON COMMIT DELETE ROWS;
+
+CREATE TEMPORARY TABLE IF NOT EXISTS staging_track_aggregates (
+  track_id INTEGER,
+  aggregated_emissions TEXT,
+  aggregated_costs TEXT,
+  aggregated_health TEXT
+) ON COMMIT DELETE ROWS;
@@ -0,0 +1,46 @@
+-- tables with subdivided regions of interest
+--
+-- region multipolygons may have a huge number of vertices, and their
+-- bounding boxes cover much more area than the regions themselves. This
+-- makes spatial indexes of little use. The pieces stored here are the
+-- result of `ST_Subdivide` on each region, so each one has a small number
+-- of vertices and a tight bounding box.
+--
+-- - `smbbackend_trackregionpiece` has the pieces of
+--   `tracks_regionofinterest`, which is used for filtering collected points;
+-- - `smbbackend_prizeregionpiece` has the pieces of
+--   `prizes_regionofinterest`, which is used by competitions.
+--
+-- Pieces of a single region do not overlap. `region_version` is the `xmin`
+-- of the region's row when it was subdivided, which changes whenever the
+-- region is modified. Pieces whose version no longer matches their region
+-- are replaced by `sync-region-pieces.sql`
+--
+CREATE TABLE IF NOT EXISTS smbbackend_trackregionpiece (
+  id SERIAL PRIMARY KEY,
+  region_id INTEGER NOT NULL,
+  region_version TEXT,
+  geom geometry NOT NULL
+);
+
+ALTER TABLE smbbackend_trackregionpiece
+  ADD COLUMN IF NOT EXISTS region_version TEXT;
+
+CREATE INDEX IF NOT EXISTS smbbackend_trackregionpiece_geom_idx
+  ON smbbackend_trackregionpiece USING GIST (geom);
+
+CREATE TABLE IF NOT EXISTS smbbackend_prizeregionpiece (
+  id SERIAL PRIMARY KEY,
+  region_id INTEGER NOT NULL,
+  region_version TEXT,
+  geom geometry NOT NULL
+);
+
+ALTER TABLE smbbackend_prizeregionpiece
+  ADD COLUMN IF NOT EXISTS region_version TEXT;
+
+CREATE INDEX IF NOT EXISTS smbbackend_prizeregionpiece_geom_idx
+  ON smbbackend_prizeregionpiece USING GIST (geom);
+
+CREATE INDEX IF NOT EXISTS smbbackend_prizeregionpiece_region_id_idx
+  ON smbbackend_prizeregionpiece (region_id);
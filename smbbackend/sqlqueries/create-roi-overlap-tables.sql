@@ -0,0 +1,20 @@
+-- cache of the overlap between tracks and the regions of interest of the
+-- competitions that they take part in
+--
+-- tracks that do not intersect a competition's regions are stored with an
+-- `overlap_length` of zero, so that they are not checked again. Rows for a
+-- competition are deleted whenever its regions are modified, see
+-- `delete-region-competitions-cache.sql`
+--
+-- lengths are expressed in m
+--
+CREATE TABLE IF NOT EXISTS smbbackend_trackroioverlap (
+  competition_id INTEGER NOT NULL,
+  track_id INTEGER NOT NULL,
+  track_length DOUBLE PRECISION NOT NULL,
+  overlap_length DOUBLE PRECISION NOT NULL,
+  PRIMARY KEY (competition_id, track_id)
+);
+
+CREATE INDEX IF NOT EXISTS smbbackend_trackroioverlap_track_id_idx
+  ON smbbackend_trackroioverlap (track_id);
@@ -0,0 +1,11 @@
+-- exact lengths of segments whose stored geometry has been simplified
+--
+-- queries should use `COALESCE(sl.length, ST_Length(s.geom::geography))`,
+-- so that segments without an entry fall back to their geometry's length.
+-- Lengths are expressed in m
+--
+CREATE TABLE IF NOT EXISTS smbbackend_segmentlength (
+  segment_id INTEGER PRIMARY KEY
+    REFERENCES tracks_segment (id) ON DELETE CASCADE,
+  length DOUBLE PRECISION NOT NULL
+);
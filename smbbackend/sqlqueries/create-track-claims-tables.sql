@@ -0,0 +1,35 @@
+-- claims on uploaded tracks, used for detecting duplicate ingestions
+--
+-- an uploaded object is identified by its key and its ETag, so that a new
+-- version of the same object is still ingested. A track session is
+-- identified by its owner and the session id reported by the app.
+-- `track_id` is NULL until the claimed track has been saved. It stays NULL
+-- for objects that could not be ingested, whereas the claims on their
+-- sessions are released, so that a fixed upload is accepted.
+--
+-- `smbbackend_trackstage` records the processing stages that have been
+-- completed for each ingested track, so that a stage is never run twice
+-- when processing is resumed
+--
+CREATE TABLE IF NOT EXISTS smbbackend_trackuploadclaim (
+  object_key TEXT NOT NULL,
+  etag TEXT NOT NULL,
+  track_id INTEGER,
+  claimed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  PRIMARY KEY (object_key, etag)
+);
+
+CREATE TABLE IF NOT EXISTS smbbackend_tracksessionclaim (
+  owner_id INTEGER NOT NULL,
+  session_id BIGINT NOT NULL,
+  track_id INTEGER,
+  claimed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  PRIMARY KEY (owner_id, session_id)
+);
+
+CREATE TABLE IF NOT EXISTS smbbackend_trackstage (
+  track_id INTEGER NOT NULL,
+  stage VARCHAR(20) NOT NULL,
+  completed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  PRIMARY KEY (track_id, stage)
+);
@@ -0,0 +1,71 @@
+-- tables with incrementally maintained per-user statistics
+--
+-- - `smbbackend_userstatstrack` records which tracks have already been
+--   accounted for, so that a track is never counted twice. It is also used
+--   for finding users whose statistics include tracks that have since been
+--   invalidated or deleted;
+-- - `smbbackend_usertotals` has the totals per user and vehicle type;
+-- - `smbbackend_userdailytotals` has the same totals, split by the day when
+--   each segment started;
+-- - `smbbackend_userstats` has per-user values that are not related to any
+--   vehicle type, like the current streak of consecutive days in which the
+--   user collected some data or the money saved by not using a car.
+--
+-- distances are expressed in m
+--
+CREATE TABLE IF NOT EXISTS smbbackend_userstatstrack (
+  track_id INTEGER PRIMARY KEY,
+  user_id INTEGER,
+  processed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+ALTER TABLE smbbackend_userstatstrack
+  ADD COLUMN IF NOT EXISTS user_id INTEGER;
+
+UPDATE smbbackend_userstatstrack AS ust
+SET user_id = t.owner_id
+FROM tracks_track AS t
+WHERE ust.user_id IS NULL
+  AND t.id = ust.track_id;
+
+CREATE INDEX IF NOT EXISTS smbbackend_userstatstrack_user_id_idx
+  ON smbbackend_userstatstrack (user_id);
+
+CREATE TABLE IF NOT EXISTS smbbackend_usertotals (
+  user_id INTEGER NOT NULL,
+  vehicle_type VARCHAR(20) NOT NULL,
+  distance DOUBLE PRECISION NOT NULL DEFAULT 0,
+  rides INTEGER NOT NULL DEFAULT 0,
+  calories_consumed DOUBLE PRECISION NOT NULL DEFAULT 0,
+  so2_saved DOUBLE PRECISION NOT NULL DEFAULT 0,
+  nox_saved DOUBLE PRECISION NOT NULL DEFAULT 0,
+  co_saved DOUBLE PRECISION NOT NULL DEFAULT 0,
+  co2_saved DOUBLE PRECISION NOT NULL DEFAULT 0,
+  pm10_saved DOUBLE PRECISION NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, vehicle_type)
+);
+
+CREATE TABLE IF NOT EXISTS smbbackend_userdailytotals (
+  user_id INTEGER NOT NULL,
+  day DATE NOT NULL,
+  vehicle_type VARCHAR(20) NOT NULL,
+  distance DOUBLE PRECISION NOT NULL DEFAULT 0,
+  rides INTEGER NOT NULL DEFAULT 0,
+  calories_consumed DOUBLE PRECISION NOT NULL DEFAULT 0,
+  so2_saved DOUBLE PRECISION NOT NULL DEFAULT 0,
+  nox_saved DOUBLE PRECISION NOT NULL DEFAULT 0,
+  co_saved DOUBLE PRECISION NOT NULL DEFAULT 0,
+  co2_saved DOUBLE PRECISION NOT NULL DEFAULT 0,
+  pm10_saved DOUBLE PRECISION NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, day, vehicle_type)
+);
+
+CREATE TABLE IF NOT EXISTS smbbackend_userstats (
+  user_id INTEGER PRIMARY KEY,
+  last_collection_day DATE NOT NULL,
+  collection_streak INTEGER NOT NULL DEFAULT 1,
+  money_saved DOUBLE PRECISION NOT NULL DEFAULT 0
+);
+
+ALTER TABLE smbbackend_userstats
+  ADD COLUMN IF NOT EXISTS money_saved DOUBLE PRECISION NOT NULL DEFAULT 0;
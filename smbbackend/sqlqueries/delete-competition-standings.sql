@@ -0,0 +1,6 @@
+-- remove the standings of a competition, together with its accounted tracks
+DELETE FROM smbbackend_competitionstanding
+WHERE competition_id = %(competition_id)s;
+
+DELETE FROM smbbackend_competitionstandingtrack
+WHERE competition_id = %(competition_id)s;
@@ -0,0 +1,21 @@
+-- remove cached data of the competitions that use any of the input regions
+--
+-- cached track overlaps and standings of these competitions are based on
+-- outdated regions, so they are removed in order to be computed again
+--
+WITH competitions AS (
+  SELECT DISTINCT competition_id
+  FROM prizes_competition_regions
+  WHERE regionofinterest_id = ANY(%(region_ids)s)
+), overlaps AS (
+  DELETE FROM smbbackend_trackroioverlap AS o
+  USING competitions AS c
+  WHERE o.competition_id = c.competition_id
+), standings AS (
+  DELETE FROM smbbackend_competitionstanding AS s
+  USING competitions AS c
+  WHERE s.competition_id = c.competition_id
+)
+DELETE FROM smbbackend_competitionstandingtrack AS st
+USING competitions AS c
+WHERE st.competition_id = c.competition_id
@@ -0,0 +1,8 @@
+-- release the claim on a track session whose ingestion failed
+--
+-- this lets the owner upload a fixed version of the same session
+--
+DELETE FROM smbbackend_tracksessionclaim
+WHERE owner_id = %(owner_id)s
+  AND session_id = %(session_id)s
+  AND track_id IS NULL
@@ -1,7 +1,8 @@
 SELECT
-  id,
-  vehicle_type,
-  ST_Length(geom::geography) AS length,
-  end_date - start_date AS duration
-FROM tracks_segment
-WHERE track_id = %(track_id)s
\ No newline at end of file
+  s.id,
+  s.vehicle_type,
+  COALESCE(sl.length, ST_Length(s.geom::geography)) AS length,
+  s.end_date - s.start_date AS duration
+FROM tracks_segment AS s
+  LEFT JOIN smbbackend_segmentlength AS sl ON (sl.segment_id = s.id)
+WHERE s.track_id = %(track_id)s
\ No newline at end of file
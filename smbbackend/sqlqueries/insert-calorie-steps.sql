@@ -0,0 +1,11 @@
+-- the `VALUES %s` placeholder is to be expanded with
+-- `psycopg2.extras.execute_values()`
+--
+INSERT INTO smbbackend_caloriestep (
+  version,
+  vehicle_type,
+  step_order,
+  speed,
+  calories
+) VALUES %s
+ON CONFLICT DO NOTHING
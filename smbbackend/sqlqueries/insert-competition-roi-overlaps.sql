@@ -0,0 +1,46 @@
+-- cache the overlap of the competition's regions of interest with the
+-- tracks of its participants that have not been cached yet
+--
+-- the overlap is calculated against the subdivided pieces of the regions,
+-- found through their spatial index. Pieces must be up to date, see
+-- `sync-region-pieces.sql`. The competition's regions are assumed
+-- not to overlap each other
+--
+INSERT INTO smbbackend_trackroioverlap (
+  competition_id,
+  track_id,
+  track_length,
+  overlap_length
+)
+SELECT
+    c.id,
+    t.id,
+    ST_Length(t.geom::GEOGRAPHY),
+    COALESCE(
+        (
+            SELECT SUM(ST_Length(ST_Intersection(t.geom, p.geom)::GEOGRAPHY))
+            FROM prizes_competition_regions AS cr
+                JOIN smbbackend_prizeregionpiece AS p ON (
+                    p.region_id = cr.regionofinterest_id)
+            WHERE cr.competition_id = c.id
+              AND ST_Intersects(p.geom, t.geom)
+        ),
+        0
+    )
+FROM tracks_track AS t
+    JOIN prizes_competitionparticipant AS cp ON t.owner_id = cp.user_id
+    JOIN prizes_competition AS c ON cp.competition_id = c.id
+    LEFT JOIN smbbackend_trackroioverlap AS o ON (
+        o.competition_id = c.id AND o.track_id = t.id)
+WHERE c.id = %(competition_id)s
+  AND o.track_id IS NULL
+  AND t.start_date >= c.start_date
+  AND t.end_date <= c.end_date
+  AND t.is_valid = true
+  AND cp.registration_status = 'approved'
+  AND EXISTS (
+    SELECT 1
+    FROM prizes_competition_regions AS cr
+    WHERE cr.competition_id = c.id
+  )
+ON CONFLICT DO NOTHING
@@ -0,0 +1,7 @@
+INSERT INTO smbbackend_competitionrun (
+  competition_id,
+  num_winners
+) VALUES (
+  %(competition_id)s,
+  %(num_winners)s
+)
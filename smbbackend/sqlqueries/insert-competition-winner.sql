@@ -1,8 +0,0 @@
--- insert a new winner for the specified competition
-INSERT INTO prizes_winner (
-  participant_id,
-  rank
-) VALUES (
-  %(participant_id)s,
-  %(rank)s
-)
\ No newline at end of file
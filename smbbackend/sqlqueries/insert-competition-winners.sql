@@ -0,0 +1,16 @@
+-- insert all winners of a competition
+--
+-- the input values are (competition_id, user_id, rank) tuples. Users that
+-- are not participants of the competition are ignored
+--
+INSERT INTO prizes_winner (
+  participant_id,
+  rank
+)
+SELECT
+  cp.id,
+  v.rank
+FROM (VALUES {values}) AS v (competition_id, user_id, rank)
+  JOIN prizes_competitionparticipant AS cp ON (
+    cp.competition_id = v.competition_id AND cp.user_id = v.user_id)
+RETURNING participant_id
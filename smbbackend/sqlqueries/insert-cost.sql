@@ -1,3 +1,8 @@
+-- insert costs for multiple segments at once
+--
+-- the `VALUES %s` placeholder is to be expanded with
+-- `psycopg2.extras.execute_values()`
+--
 INSERT INTO tracks_cost (
   fuel_cost,
   time_cost,
@@ -5,11 +10,4 @@ INSERT INTO tracks_cost (
   operation_cost,
   total_cost,
   segment_id
-) VALUES (
-  %(fuel_cost)s,
-  %(time_cost)s,
-  %(depreciation_cost)s,
-  %(operation_cost)s,
-  %(total_cost)s,
-  %(segment_id)s
-)
+) VALUES %s
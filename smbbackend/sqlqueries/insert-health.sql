@@ -1,7 +1,9 @@
+-- insert health indexes for multiple segments at once
+--
+-- the `VALUES %s` placeholder is to be expanded with
+-- `psycopg2.extras.execute_values()`
+--
 INSERT INTO tracks_health (
   calories_consumed,
   segment_id
-) VALUES (
-  %(calories_consumed)s,
-  %(segment_id)s
-)
+) VALUES %s
@@ -0,0 +1,19 @@
+-- the `VALUES %s` placeholder is to be expanded with
+-- `psycopg2.extras.execute_values()`
+--
+INSERT INTO smbbackend_indexcoefficients (
+  version,
+  vehicle_type,
+  so2,
+  nox,
+  co,
+  co2,
+  pm10,
+  passenger_count,
+  fuel_cost_per_km,
+  depreciation_cost_per_km,
+  operation_cost_per_km,
+  total_cost_overhead,
+  time_cost_per_hour
+) VALUES %s
+ON CONFLICT DO NOTHING
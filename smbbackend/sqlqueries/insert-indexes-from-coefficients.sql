@@ -0,0 +1,187 @@
+-- calculate indexes for the segments of the input tracks inside the DB
+--
+-- Coefficients are read from the `smbbackend_indexcoefficients` and
+-- `smbbackend_caloriestep` tables, using the input version. Existing
+-- indexes for the relevant segments are replaced and track aggregates are
+-- updated
+--
+-- the staging table is only dropped at commit, so it may be left over from
+-- an earlier call in the same transaction. The `pg_temp` schema ensures that
+-- no regular table is ever dropped instead
+DROP TABLE IF EXISTS pg_temp.coefficients_segment;
+
+CREATE TEMPORARY TABLE coefficients_segment ON COMMIT DROP AS
+SELECT
+  sq.id,
+  sq.track_id,
+  sq.vehicle_type,
+  sq.length_km,
+  sq.duration_hours,
+  sq.length_km / NULLIF(sq.duration_hours, 0) AS speed_km_h
+FROM (
+  SELECT
+    s.id,
+    s.track_id,
+    s.vehicle_type,
+    COALESCE(sl.length, ST_Length(s.geom::geography)) / 1000 AS length_km,
+    EXTRACT(EPOCH FROM s.end_date - s.start_date) / (60 * 60) AS duration_hours
+  FROM tracks_segment AS s
+    LEFT JOIN smbbackend_segmentlength AS sl ON (sl.segment_id = s.id)
+  WHERE s.track_id = ANY(%(track_ids)s)
+) AS sq;
+
+DELETE FROM tracks_emission AS e
+USING coefficients_segment AS cs
+WHERE e.segment_id = cs.id;
+
+DELETE FROM tracks_cost AS c
+USING coefficients_segment AS cs
+WHERE c.segment_id = cs.id;
+
+DELETE FROM tracks_health AS h
+USING coefficients_segment AS cs
+WHERE h.segment_id = cs.id;
+
+-- car is taken as the reference for saved emissions. Negative savings are
+-- clipped to zero
+INSERT INTO tracks_emission (
+  so2,
+  so2_saved,
+  nox,
+  nox_saved,
+  co,
+  co_saved,
+  co2,
+  co2_saved,
+  pm10,
+  pm10_saved,
+  segment_id
+)
+SELECT
+  em.so2,
+  CASE WHEN em.vehicle_type = 'car' THEN 0 ELSE GREATEST(em.car_so2 - em.so2, 0) END,
+  em.nox,
+  CASE WHEN em.vehicle_type = 'car' THEN 0 ELSE GREATEST(em.car_nox - em.nox, 0) END,
+  em.co,
+  CASE WHEN em.vehicle_type = 'car' THEN 0 ELSE GREATEST(em.car_co - em.co, 0) END,
+  em.co2,
+  CASE WHEN em.vehicle_type = 'car' THEN 0 ELSE GREATEST(em.car_co2 - em.co2, 0) END,
+  em.pm10,
+  CASE WHEN em.vehicle_type = 'car' THEN 0 ELSE GREATEST(em.car_pm10 - em.pm10, 0) END,
+  em.id
+FROM (
+  SELECT
+    cs.id,
+    cs.vehicle_type,
+    cf.so2 * cs.length_km / cf.passenger_count AS so2,
+    cf.nox * cs.length_km / cf.passenger_count AS nox,
+    cf.co * cs.length_km / cf.passenger_count AS co,
+    cf.co2 * cs.length_km / cf.passenger_count AS co2,
+    cf.pm10 * cs.length_km / cf.passenger_count AS pm10,
+    car.so2 * cs.length_km / car.passenger_count AS car_so2,
+    car.nox * cs.length_km / car.passenger_count AS car_nox,
+    car.co * cs.length_km / car.passenger_count AS car_co,
+    car.co2 * cs.length_km / car.passenger_count AS car_co2,
+    car.pm10 * cs.length_km / car.passenger_count AS car_pm10
+  FROM coefficients_segment AS cs
+    JOIN smbbackend_indexcoefficients AS cf ON (
+      cf.version = %(version)s AND cf.vehicle_type = cs.vehicle_type)
+    JOIN smbbackend_indexcoefficients AS car ON (
+      car.version = %(version)s AND car.vehicle_type = 'car')
+) AS em;
+
+INSERT INTO tracks_cost (
+  fuel_cost,
+  time_cost,
+  depreciation_cost,
+  operation_cost,
+  total_cost,
+  segment_id
+)
+SELECT
+  co.fuel_cost,
+  co.time_cost,
+  co.depreciation_cost,
+  co.operation_cost,
+  (co.fuel_cost + co.time_cost + co.depreciation_cost + co.operation_cost) *
+    (1 + co.total_cost_overhead),
+  co.id
+FROM (
+  SELECT
+    cs.id,
+    cs.length_km * cf.fuel_cost_per_km AS fuel_cost,
+    cs.duration_hours * cf.time_cost_per_hour AS time_cost,
+    cs.length_km * cf.depreciation_cost_per_km AS depreciation_cost,
+    cs.length_km * cf.operation_cost_per_km AS operation_cost,
+    cf.total_cost_overhead
+  FROM coefficients_segment AS cs
+    JOIN smbbackend_indexcoefficients AS cf ON (
+      cf.version = %(version)s AND cf.vehicle_type = cs.vehicle_type)
+) AS co;
+
+-- calorie consumption is given by the first step whose speed is greater
+-- than the segment's speed, or by the last step if there is no such step
+INSERT INTO tracks_health (
+  calories_consumed,
+  segment_id
+)
+SELECT
+  COALESCE(
+    (
+      SELECT st.calories
+      FROM smbbackend_caloriestep AS st
+      WHERE st.version = %(version)s
+        AND st.vehicle_type = cs.vehicle_type
+        AND cs.speed_km_h < st.speed
+      ORDER BY st.step_order
+      LIMIT 1
+    ),
+    (
+      SELECT st.calories
+      FROM smbbackend_caloriestep AS st
+      WHERE st.version = %(version)s
+        AND st.vehicle_type = cs.vehicle_type
+      ORDER BY st.step_order DESC
+      LIMIT 1
+    ),
+    0
+  ) * cs.duration_hours * 60,
+  cs.id
+FROM coefficients_segment AS cs;
+
+UPDATE tracks_track AS t SET
+  aggregated_emissions = agg.emissions,
+  aggregated_costs = agg.costs,
+  aggregated_health = agg.health
+FROM (
+  SELECT
+    cs.track_id,
+    json_build_object(
+      'so2', SUM(e.so2),
+      'so2_saved', SUM(e.so2_saved),
+      'nox', SUM(e.nox),
+      'nox_saved', SUM(e.nox_saved),
+      'co', SUM(e.co),
+      'co_saved', SUM(e.co_saved),
+      'co2', SUM(e.co2),
+      'co2_saved', SUM(e.co2_saved),
+      'pm10', SUM(e.pm10),
+      'pm10_saved', SUM(e.pm10_saved)
+    ) AS emissions,
+    json_build_object(
+      'fuel_cost', SUM(c.fuel_cost),
+      'time_cost', SUM(c.time_cost),
+      'depreciation_cost', SUM(c.depreciation_cost),
+      'operation_cost', SUM(c.operation_cost),
+      'total_cost', SUM(c.total_cost)
+    ) AS costs,
+    json_build_object(
+      'calories_consumed', SUM(h.calories_consumed)
+    ) AS health
+  FROM coefficients_segment AS cs
+    JOIN tracks_emission AS e ON (e.segment_id = cs.id)
+    JOIN tracks_cost AS c ON (c.segment_id = cs.id)
+    JOIN tracks_health AS h ON (h.segment_id = cs.id)
+  GROUP BY cs.track_id
+) AS agg
+WHERE t.id = agg.track_id;
@@ -1,16 +1,32 @@
-INSERT INTO tracks_segment (
-  track_id,
-  user_uuid,
-  vehicle_type,
-  geom,
-  start_date,
-  end_date
-) VALUES (
-  %(track_id)s,
-  %(user_uuid)s,
-  %(vehicle_type)s,
-  ST_Force2D(ST_GeomFromWKB(%(geometry)s, 4326)),
-  %(start_date)s,
-  %(end_date)s
+-- insert a segment, recording its exact length if its geometry was simplified
+--
+-- `original_geometry` is NULL when `geometry` has not been simplified
+--
+WITH segment AS (
+  INSERT INTO tracks_segment (
+    track_id,
+    user_uuid,
+    vehicle_type,
+    geom,
+    start_date,
+    end_date
+  ) VALUES (
+    %(track_id)s,
+    %(user_uuid)s,
+    %(vehicle_type)s,
+    ST_Force2D(ST_GeomFromWKB(%(geometry)s, 4326)),
+    %(start_date)s,
+    %(end_date)s
+  )
+  RETURNING id
+), exact_length AS (
+  INSERT INTO smbbackend_segmentlength (segment_id, length)
+  SELECT
+    id,
+    ST_Length(
+      ST_Force2D(ST_GeomFromWKB(%(original_geometry)s, 4326))::geography)
+  FROM segment
+  WHERE %(original_geometry)s IS NOT NULL
 )
-RETURNING id
+SELECT id
+FROM segment
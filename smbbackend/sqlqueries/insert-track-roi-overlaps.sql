@@ -0,0 +1,47 @@
+-- cache the overlap of the track with the regions of interest of every
+-- competition that it takes part in
+--
+-- the overlap is calculated against the subdivided pieces of the regions,
+-- found through their spatial index. Pieces must be up to date, see
+-- `sync-region-pieces.sql`. Each competition's regions are assumed
+-- not to overlap each other
+--
+WITH track_competitions AS (
+    SELECT DISTINCT c.id
+    FROM tracks_track AS t
+        JOIN prizes_competitionparticipant AS cp ON t.owner_id = cp.user_id
+        JOIN prizes_competition AS c ON cp.competition_id = c.id
+        JOIN prizes_competition_regions AS cr ON cr.competition_id = c.id
+    WHERE t.id = %(track_id)s
+      AND t.start_date >= c.start_date
+      AND t.end_date <= c.end_date
+      AND cp.registration_status = 'approved'
+)
+INSERT INTO smbbackend_trackroioverlap AS o (
+  competition_id,
+  track_id,
+  track_length,
+  overlap_length
+)
+SELECT
+    tc.id,
+    t.id,
+    ST_Length(t.geom::GEOGRAPHY),
+    COALESCE(
+        (
+            SELECT SUM(ST_Length(ST_Intersection(t.geom, p.geom)::GEOGRAPHY))
+            FROM prizes_competition_regions AS cr
+                JOIN smbbackend_prizeregionpiece AS p ON (
+                    p.region_id = cr.regionofinterest_id)
+            WHERE cr.competition_id = tc.id
+              AND ST_Intersects(p.geom, t.geom)
+        ),
+        0
+    )
+FROM tracks_track AS t
+    CROSS JOIN track_competitions AS tc
+WHERE t.id = %(track_id)s
+  AND t.is_valid = true
+ON CONFLICT (competition_id, track_id) DO UPDATE SET
+  track_length = EXCLUDED.track_length,
+  overlap_length = EXCLUDED.overlap_length
@@ -0,0 +1,75 @@
+-- replace the indexes of the staged segments and update track aggregates
+--
+-- staging tables are created with `create-index-staging-tables.sql`
+--
+DELETE FROM tracks_emission AS e
+USING staging_emission AS st
+WHERE e.segment_id = st.segment_id;
+
+INSERT INTO tracks_emission (
+  so2,
+  so2_saved,
+  nox,
+  nox_saved,
+  co,
+  co_saved,
+  co2,
+  co2_saved,
+  pm10,
+  pm10_saved,
+  segment_id
+)
+SELECT
+  so2,
+  so2_saved,
+  nox,
+  nox_saved,
+  co,
+  co_saved,
+  co2,
+  co2_saved,
+  pm10,
+  pm10_saved,
+  segment_id
+FROM staging_emission;
+
+DELETE FROM tracks_cost AS c
+USING staging_cost AS st
+WHERE c.segment_id = st.segment_id;
+
+INSERT INTO tracks_cost (
+  fuel_cost,
+  time_cost,
+  depreciation_cost,
+  operation_cost,
+  total_cost,
+  segment_id
+)
+SELECT
+  fuel_cost,
+  time_cost,
+  depreciation_cost,
+  operation_cost,
+  total_cost,
+  segment_id
+FROM staging_cost;
+
+DELETE FROM tracks_health AS h
+USING staging_health AS st
+WHERE h.segment_id = st.segment_id;
+
+INSERT INTO tracks_health (
+  calories_consumed,
+  segment_id
+)
+SELECT
+  calories_consumed,
+  segment_id
+FROM staging_health;
+
+UPDATE tracks_track AS t SET
+  aggregated_emissions = st.aggregated_emissions::json,
+  aggregated_costs = st.aggregated_costs::json,
+  aggregated_health = st.aggregated_health::json
+FROM staging_track_aggregates AS st
+WHERE t.id = st.track_id;
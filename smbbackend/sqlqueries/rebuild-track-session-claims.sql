@@ -0,0 +1,22 @@
+-- claim the sessions of all existing tracks, and the processing stages that
+-- have been completed for them
+--
+INSERT INTO smbbackend_tracksessionclaim (owner_id, session_id, track_id)
+SELECT owner_id, session_id, MIN(id)
+FROM tracks_track
+WHERE session_id IS NOT NULL
+GROUP BY owner_id, session_id
+ON CONFLICT (owner_id, session_id) DO UPDATE SET
+  track_id = COALESCE(
+    smbbackend_tracksessionclaim.track_id, EXCLUDED.track_id);
+
+INSERT INTO smbbackend_trackstage (track_id, stage)
+SELECT id, 'indexes'
+FROM tracks_track
+WHERE aggregated_emissions IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+INSERT INTO smbbackend_trackstage (track_id, stage)
+SELECT track_id, 'badges'
+FROM smbbackend_userstatstrack
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,138 @@
+-- recompute users' statistics from scratch, using every valid track
+--
+-- statistics are recomputed for the user with id `user_id`, or for all
+-- users if it is NULL
+--
+DELETE FROM smbbackend_userstatstrack
+WHERE %(user_id)s IS NULL OR user_id = %(user_id)s;
+
+DELETE FROM smbbackend_usertotals
+WHERE %(user_id)s IS NULL OR user_id = %(user_id)s;
+
+DELETE FROM smbbackend_userdailytotals
+WHERE %(user_id)s IS NULL OR user_id = %(user_id)s;
+
+DELETE FROM smbbackend_userstats
+WHERE %(user_id)s IS NULL OR user_id = %(user_id)s;
+
+INSERT INTO smbbackend_userstatstrack (track_id, user_id)
+SELECT id, owner_id
+FROM tracks_track
+WHERE is_valid = TRUE
+  AND (%(user_id)s IS NULL OR owner_id = %(user_id)s);
+
+INSERT INTO smbbackend_userdailytotals (
+  user_id,
+  day,
+  vehicle_type,
+  distance,
+  rides,
+  calories_consumed,
+  so2_saved,
+  nox_saved,
+  co_saved,
+  co2_saved,
+  pm10_saved
+)
+SELECT
+  t.owner_id,
+  date_trunc('day', s.start_date)::date,
+  s.vehicle_type,
+  SUM(COALESCE(sl.length, ST_Length(s.geom::geography))),
+  COUNT(1),
+  COALESCE(SUM(h.calories_consumed), 0),
+  COALESCE(SUM(e.so2_saved), 0),
+  COALESCE(SUM(e.nox_saved), 0),
+  COALESCE(SUM(e.co_saved), 0),
+  COALESCE(SUM(e.co2_saved), 0),
+  COALESCE(SUM(e.pm10_saved), 0)
+FROM tracks_track AS t
+  JOIN tracks_segment AS s ON (s.track_id = t.id)
+  LEFT JOIN smbbackend_segmentlength AS sl ON (sl.segment_id = s.id)
+  LEFT JOIN tracks_emission AS e ON (e.segment_id = s.id)
+  LEFT JOIN tracks_health AS h ON (h.segment_id = s.id)
+WHERE t.is_valid = TRUE
+  AND (%(user_id)s IS NULL OR t.owner_id = %(user_id)s)
+GROUP BY t.owner_id, date_trunc('day', s.start_date)::date, s.vehicle_type;
+
+INSERT INTO smbbackend_usertotals (
+  user_id,
+  vehicle_type,
+  distance,
+  rides,
+  calories_consumed,
+  so2_saved,
+  nox_saved,
+  co_saved,
+  co2_saved,
+  pm10_saved
+)
+SELECT
+  user_id,
+  vehicle_type,
+  SUM(distance),
+  SUM(rides),
+  SUM(calories_consumed),
+  SUM(so2_saved),
+  SUM(nox_saved),
+  SUM(co_saved),
+  SUM(co2_saved),
+  SUM(pm10_saved)
+FROM smbbackend_userdailytotals
+WHERE %(user_id)s IS NULL OR user_id = %(user_id)s
+GROUP BY user_id, vehicle_type;
+
+-- consecutive days form islands that share the same difference between the
+-- day and its position. The streak is the size of the most recent island
+INSERT INTO smbbackend_userstats (
+  user_id,
+  last_collection_day,
+  collection_streak
+)
+SELECT DISTINCT ON (user_id)
+  user_id,
+  MAX(day),
+  COUNT(1)
+FROM (
+  SELECT
+    user_id,
+    day,
+    day - (row_number() OVER (PARTITION BY user_id ORDER BY day))::integer
+      AS island
+  FROM (
+    SELECT DISTINCT
+      owner_id AS user_id,
+      date_trunc('day', created_at)::date AS day
+    FROM tracks_track
+    WHERE is_valid = TRUE
+      AND (%(user_id)s IS NULL OR owner_id = %(user_id)s)
+  ) AS collection_days
+) AS islands
+GROUP BY user_id, island
+ORDER BY user_id, MAX(day) DESC;
+
+UPDATE smbbackend_userstats AS us
+SET money_saved = ms.money_saved
+FROM (
+  SELECT
+    t.owner_id AS user_id,
+    SUM(
+      GREATEST(
+        COALESCE(sl.length, ST_Length(s.geom::geography)) / 1000 *
+          %(car_cost_per_km)s +
+        EXTRACT(EPOCH FROM s.end_date - s.start_date) / 3600 *
+          %(car_cost_per_hour)s -
+        COALESCE(c.total_cost, 0),
+        0
+      )
+    ) AS money_saved
+  FROM tracks_track AS t
+    JOIN tracks_segment AS s ON (s.track_id = t.id)
+    LEFT JOIN smbbackend_segmentlength AS sl ON (sl.segment_id = s.id)
+    LEFT JOIN tracks_cost AS c ON (c.segment_id = s.id)
+  WHERE t.is_valid = TRUE
+    AND s.vehicle_type <> %(car_vehicle_type)s
+    AND (%(user_id)s IS NULL OR t.owner_id = %(user_id)s)
+  GROUP BY t.owner_id
+) AS ms
+WHERE us.user_id = ms.user_id;
@@ -0,0 +1,25 @@
+-- replace the pieces of all regions of interest with fresh ones
+--
+-- cached track overlaps are cleared as well, since regions may have changed
+--
+TRUNCATE
+  smbbackend_trackregionpiece,
+  smbbackend_prizeregionpiece,
+  smbbackend_trackroioverlap;
+
+INSERT INTO smbbackend_trackregionpiece (region_id, region_version, geom)
+SELECT
+  id,
+  xmin::text,
+  ST_Subdivide(geom, %(max_vertices)s)
+FROM tracks_regionofinterest;
+
+INSERT INTO smbbackend_prizeregionpiece (region_id, region_version, geom)
+SELECT
+  id,
+  xmin::text,
+  ST_Subdivide(geom, %(max_vertices)s)
+FROM prizes_regionofinterest;
+
+ANALYZE smbbackend_trackregionpiece;
+ANALYZE smbbackend_prizeregionpiece;
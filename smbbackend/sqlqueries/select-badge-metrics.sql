@@ -0,0 +1,64 @@
+-- get all metrics needed for evaluating a user's badges in a single query
+--
+-- Each metric is only calculated if its corresponding `include_*` parameter
+-- is true. Otherwise the column is NULL. This works because Postgres only
+-- runs uncorrelated scalar subqueries (InitPlans) when their value is
+-- actually needed.
+--
+-- distances are expressed in m, saved emissions in g and saved money in
+-- EUR. `bike_days` is an array with the days when the user rode a bike
+--
+SELECT
+  CASE WHEN %(include_bike_distance)s THEN (
+    SELECT COALESCE(SUM(distance), 0)
+    FROM smbbackend_usertotals
+    WHERE user_id = %(user_id)s
+      AND vehicle_type = ANY(%(bike_vehicle_types)s)
+  ) END AS bike_distance,
+  CASE WHEN %(include_bus_distance)s THEN (
+    SELECT COALESCE(SUM(distance), 0)
+    FROM smbbackend_usertotals
+    WHERE user_id = %(user_id)s
+      AND vehicle_type = ANY(%(bus_vehicle_types)s)
+  ) END AS bus_distance,
+  CASE WHEN %(include_sustainable_distance)s THEN (
+    SELECT COALESCE(SUM(distance), 0)
+    FROM smbbackend_usertotals
+    WHERE user_id = %(user_id)s
+      AND vehicle_type = ANY(%(sustainable_vehicle_types)s)
+  ) END AS sustainable_distance,
+  CASE WHEN %(include_public_transport_rides)s THEN (
+    SELECT COALESCE(SUM(rides), 0)
+    FROM smbbackend_usertotals
+    WHERE user_id = %(user_id)s
+      AND vehicle_type = ANY(%(public_vehicle_types)s)
+  ) END AS public_transport_rides,
+  CASE WHEN %(include_calories_consumed)s THEN (
+    SELECT COALESCE(SUM(calories_consumed), 0)
+    FROM smbbackend_usertotals
+    WHERE user_id = %(user_id)s
+  ) END AS calories_consumed,
+  CASE WHEN %(include_co2_saved)s THEN (
+    SELECT COALESCE(SUM(co2_saved), 0)
+    FROM smbbackend_usertotals
+    WHERE user_id = %(user_id)s
+  ) END AS co2_saved,
+  CASE WHEN %(include_bike_days)s THEN (
+    SELECT COALESCE(array_agg(day ORDER BY day), '{}')
+    FROM smbbackend_userdailytotals
+    WHERE user_id = %(user_id)s
+      AND vehicle_type = 'bike'
+      AND rides > 0
+      AND day >= %(bike_days_start)s::date
+      AND day <= %(bike_days_end)s::date
+  ) END AS bike_days,
+  CASE WHEN %(include_collection_streak)s THEN (
+    SELECT COALESCE(MAX(collection_streak), 0)
+    FROM smbbackend_userstats
+    WHERE user_id = %(user_id)s
+  ) END AS collection_streak,
+  CASE WHEN %(include_money_saved)s THEN (
+    SELECT COALESCE(MAX(money_saved), 0)
+    FROM smbbackend_userstats
+    WHERE user_id = %(user_id)s
+  ) END AS money_saved
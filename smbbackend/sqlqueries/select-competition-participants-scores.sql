@@ -0,0 +1,29 @@
+-- get the current scores of all approved participants of a competition
+--
+-- participants without any standings are returned once, with a NULL
+-- criterium. Scores of competitions with regions of interest are weighted
+-- in the same way as in `select-competition-standings.sql`
+--
+WITH competition_has_regions AS (
+  SELECT EXISTS (
+    SELECT 1
+    FROM prizes_competition_regions AS cr
+    WHERE cr.competition_id = %(competition_id)s
+  ) AS has_regions
+)
+SELECT
+  cp.user_id,
+  s.criterium,
+  CASE
+    WHEN s.criterium = ANY(%(count_criteria)s) THEN s.value_sum
+    WHEN chr.has_regions
+      THEN s.overlap_length_sum / NULLIF(s.track_length_sum, 0) * s.value_sum
+    ELSE s.value_sum
+  END AS score
+FROM prizes_competitionparticipant AS cp
+  CROSS JOIN competition_has_regions AS chr
+  LEFT JOIN smbbackend_competitionstanding AS s ON (
+    s.competition_id = cp.competition_id AND s.user_id = cp.user_id)
+WHERE cp.competition_id = %(competition_id)s
+  AND cp.registration_status = 'approved'
+ORDER BY cp.user_id
@@ -0,0 +1,33 @@
+-- get the competition's rankings for all criteria
+--
+-- for competitions with regions of interest, each participant's score is
+-- weighted by the fraction of their tracks' length that lies inside the
+-- regions. Criteria that count tracks, listed in `count_criteria`, are not
+-- weighted. The participant with the highest score gets the most points.
+--
+-- If `user_id` is not null, only that participant's scores are returned, and
+-- their points are meaningless
+--
+WITH scores AS (
+  SELECT
+    s.criterium,
+    s.user_id,
+    CASE
+      WHEN s.criterium = ANY(%(count_criteria)s) THEN s.value_sum
+      WHEN EXISTS (
+        SELECT 1
+        FROM prizes_competition_regions AS cr
+        WHERE cr.competition_id = s.competition_id
+      ) THEN s.overlap_length_sum / NULLIF(s.track_length_sum, 0) * s.value_sum
+      ELSE s.value_sum
+    END AS score
+  FROM smbbackend_competitionstanding AS s
+  WHERE s.competition_id = %(competition_id)s
+    AND (%(user_id)s IS NULL OR s.user_id = %(user_id)s)
+)
+SELECT
+  criterium,
+  user_id,
+  score,
+  row_number() OVER (PARTITION BY criterium ORDER BY score) AS points
+FROM scores
@@ -0,0 +1,2 @@
+SELECT DISTINCT competition_id
+FROM prizes_competition_regions
@@ -0,0 +1,17 @@
+-- count the track's points that are disjoint with the region of interest,
+-- combining all regions into a single geometry on the fly
+--
+-- this is the approach used before regions were subdivided. It is only kept
+-- for benchmarking purposes
+--
+WITH dumped AS (
+  SELECT (ST_Dump(geom)).geom AS geom
+  FROM tracks_regionofinterest
+), flattened_roi AS (
+  SELECT ST_Collect(geom) AS geom
+  FROM dumped
+)
+SELECT COUNT(1)
+FROM tracks_collectedpoint AS cp, flattened_roi
+WHERE cp.track_id = %(track_id)s
+  AND NOT ST_Intersects(cp.the_geom, flattened_roi.geom)
@@ -0,0 +1,10 @@
+-- count the track's points that are disjoint with the region of interest,
+-- using the subdivided pieces of the regions
+SELECT COUNT(1)
+FROM tracks_collectedpoint AS cp
+WHERE cp.track_id = %(track_id)s
+  AND NOT EXISTS (
+    SELECT 1
+    FROM smbbackend_trackregionpiece AS p
+    WHERE ST_Intersects(p.geom, cp.the_geom)
+  )
@@ -1,10 +1,14 @@
 -- select all competitions which have already started but have no winner(s)
+--
+-- competitions that have already been closed by a previous run are left out
 WITH competition_without_winner AS (
     SELECT DISTINCT c.id
     FROM prizes_competition AS c
              JOIN prizes_competitionparticipant AS cp on c.id = cp.competition_id
              LEFT OUTER JOIN prizes_winner AS w on w.participant_id = cp.id
+             LEFT OUTER JOIN smbbackend_competitionrun AS r on r.competition_id = c.id
     WHERE w.participant_id IS NULL
+      AND r.competition_id IS NULL
       AND c.start_date <= %(relevant_date)s
 )
 SELECT
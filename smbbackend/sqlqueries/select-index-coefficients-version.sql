@@ -0,0 +1,6 @@
+-- check whether a version of the index coefficients has been stored
+--
+SELECT version
+FROM smbbackend_indexcoefficients
+WHERE version = %(version)s
+LIMIT 1
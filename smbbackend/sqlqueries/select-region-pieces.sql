@@ -0,0 +1,13 @@
+-- get the subdivided pieces of the tracks' region of interest
+--
+-- `is_box` is true for pieces that are equal to their own bounding box,
+-- which is common for pieces in the interior of a region
+--
+SELECT
+  ST_AsBinary(geom) AS geom,
+  ST_XMin(geom),
+  ST_YMin(geom),
+  ST_XMax(geom),
+  ST_YMax(geom),
+  ST_Equals(geom, ST_Envelope(geom)) AS is_box
+FROM smbbackend_trackregionpiece
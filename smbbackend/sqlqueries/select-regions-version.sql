@@ -0,0 +1,13 @@
+-- get a fingerprint of all rows of a table of regions of interest
+--
+-- this query is a template. `{regions_table}` must be replaced with a table
+-- of regions of interest.
+--
+-- The fingerprint changes whenever a region is created, modified or
+-- deleted, since each of these changes the set of row ids and `xmin`s. It is
+-- cheap to compute, since geometries are not read
+--
+SELECT md5(
+  COALESCE(string_agg(id::text || ':' || xmin::text, ',' ORDER BY id), '')
+)
+FROM {regions_table}
@@ -0,0 +1,17 @@
+-- get the segments of all valid tracks, ordered by track
+--
+-- this query is meant to be used with a server-side cursor, in order to
+-- stream results in batches
+--
+SELECT
+  s.track_id,
+  s.id,
+  s.vehicle_type,
+  COALESCE(sl.length, ST_Length(s.geom::geography)) AS length,
+  EXTRACT(EPOCH FROM s.end_date - s.start_date) AS duration
+FROM tracks_segment AS s
+  JOIN tracks_track AS t ON (t.id = s.track_id)
+  LEFT JOIN smbbackend_segmentlength AS sl ON (sl.segment_id = s.id)
+WHERE t.is_valid = TRUE
+  AND s.track_id > %(last_track_id)s
+ORDER BY s.track_id, s.id
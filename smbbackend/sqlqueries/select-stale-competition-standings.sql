@@ -0,0 +1,11 @@
+-- get the number of tracks accounted for in a competition's standings that
+-- are no longer valid
+--
+-- this covers tracks that have been invalidated or deleted after being
+-- accounted for
+--
+SELECT COUNT(1)
+FROM smbbackend_competitionstandingtrack AS st
+  LEFT JOIN tracks_track AS t ON (t.id = st.track_id)
+WHERE st.competition_id = %(competition_id)s
+  AND (t.id IS NULL OR t.is_valid = FALSE)
@@ -0,0 +1,12 @@
+-- get the users whose statistics include tracks that are no longer valid
+--
+-- this covers tracks that have been invalidated or deleted after being
+-- accounted for. Only the user with id `user_id` is checked, or all users
+-- if it is NULL
+--
+SELECT DISTINCT ust.user_id
+FROM smbbackend_userstatstrack AS ust
+  LEFT JOIN tracks_track AS t ON (t.id = ust.track_id)
+WHERE (t.id IS NULL OR t.is_valid = FALSE)
+  AND ust.user_id IS NOT NULL
+  AND (%(user_id)s IS NULL OR ust.user_id = %(user_id)s)
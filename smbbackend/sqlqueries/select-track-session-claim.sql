@@ -0,0 +1,9 @@
+-- return the id of the track that was ingested for a claimed session
+--
+-- this runs separately from `claim-track-session.sql`, so that it sees a
+-- conflicting claim that was committed while the claim was waiting for it
+--
+SELECT track_id
+FROM smbbackend_tracksessionclaim
+WHERE owner_id = %(owner_id)s
+  AND session_id = %(session_id)s
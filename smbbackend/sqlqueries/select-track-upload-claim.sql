@@ -0,0 +1,10 @@
+-- return the id of the track that was ingested from a claimed object
+--
+-- this runs separately from `claim-track-upload.sql`, so that it sees a
+-- conflicting claim that was committed while the claim was waiting for it.
+-- The id is NULL if the object could not be ingested
+--
+SELECT track_id
+FROM smbbackend_trackuploadclaim
+WHERE object_key = %(object_key)s
+  AND etag = %(etag)s
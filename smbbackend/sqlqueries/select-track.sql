@@ -15,11 +15,12 @@ SELECT
     json_build_object(
       'id', s.id,
       'vehicle_type', s.vehicle_type,
-      'length', st_length(s.geom::geography)
+      'length', COALESCE(sl.length, st_length(s.geom::geography))
     )
   ) AS segments
 FROM tracks_track AS t
   LEFT JOIN tracks_segment as s ON (t.id = s.track_id)
+  LEFT JOIN smbbackend_segmentlength AS sl ON (sl.segment_id = s.id)
 WHERE t.id = %(track_id)s
 GROUP BY
   t.id,
@@ -0,0 +1,7 @@
+-- get a page of valid track ids, ordered by id
+SELECT id
+FROM tracks_track
+WHERE is_valid = TRUE
+  AND id > %(last_track_id)s
+ORDER BY id
+LIMIT %(limit)s
@@ -0,0 +1,14 @@
+-- get the keycloak UUID and the names of the prizes won by each winner
+--
+-- the input values are (competition_id, user_id, user_rank) tuples
+--
+SELECT
+  v.user_id,
+  k."UID",
+  array_remove(array_agg(p.name ORDER BY p.name), NULL)
+FROM (VALUES {values}) AS v (competition_id, user_id, user_rank)
+  LEFT JOIN bossoidc_keycloak AS k ON (k.user_id = v.user_id)
+  LEFT JOIN prizes_competitionprize AS cp ON (
+    cp.competition_id = v.competition_id AND cp.user_rank = v.user_rank)
+  LEFT JOIN prizes_prize AS p ON (p.id = cp.prize_id)
+GROUP BY v.user_id, k."UID"
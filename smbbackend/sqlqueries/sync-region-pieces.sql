@@ -0,0 +1,48 @@
+-- bring the pieces of regions of interest up to date with the regions
+--
+-- this query is a template. `{regions_table}` must be replaced with a table
+-- of regions of interest and `{pieces_table}` with the table of its pieces.
+--
+-- Pieces of regions that have been modified or deleted are removed, and
+-- regions that have been modified or created are subdivided. A region is
+-- modified if its `xmin` differs from the version of its pieces. The ids of
+-- all affected regions are returned.
+--
+-- Concurrent updates of the same pieces are serialized with a lock, so that
+-- regions are never subdivided twice
+--
+SELECT pg_advisory_xact_lock(hashtext('{pieces_table}'));
+
+WITH current_regions AS (
+  SELECT
+    id,
+    xmin::text AS region_version,
+    geom
+  FROM {regions_table}
+), stale AS (
+  DELETE FROM {pieces_table} AS p
+  WHERE NOT EXISTS (
+    SELECT 1
+    FROM current_regions AS r
+    WHERE r.id = p.region_id
+      AND r.region_version = p.region_version
+  )
+  RETURNING p.region_id
+), subdivided AS (
+  INSERT INTO {pieces_table} (region_id, region_version, geom)
+  SELECT
+    r.id,
+    r.region_version,
+    ST_Subdivide(r.geom, %(max_vertices)s)
+  FROM current_regions AS r
+  WHERE NOT EXISTS (
+    SELECT 1
+    FROM {pieces_table} AS p
+    WHERE p.region_id = r.id
+      AND p.region_version = r.region_version
+  )
+  RETURNING region_id
+)
+SELECT region_id FROM stale
+UNION
+SELECT region_id FROM subdivided
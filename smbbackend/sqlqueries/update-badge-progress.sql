@@ -0,0 +1,6 @@
+UPDATE django_gamification_progression AS p
+SET progress = v.progress
+FROM django_gamification_badge AS b,
+  (VALUES %s) AS v (badge_id, progress)
+WHERE b.id = v.badge_id
+  AND p.id = b.progression_id
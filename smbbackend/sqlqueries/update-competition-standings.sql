@@ -0,0 +1,128 @@
+-- add the contribution of tracks to the standings of their competitions
+--
+-- this query is a template. `{eligibility_filter}` must be replaced with a
+-- condition that selects either a single track or a single competition.
+--
+-- A track contributes to a competition if its owner is an approved
+-- participant and it was made during the competition. For competitions
+-- with regions of interest, it must also overlap them, as recorded in
+-- `smbbackend_trackroioverlap`, which must therefore be up to date.
+--
+-- Tracks that have already been accounted for are skipped
+--
+-- all criteria are built from the same pass: track aggregates are read from
+-- the track itself and per vehicle type totals are calculated with a single
+-- scan over the segments of the eligible tracks. Usage frequencies count the
+-- tracks that include at least one segment of the relevant vehicle types.
+-- Distances are expressed in m
+--
+WITH eligible AS (
+  SELECT
+    c.id AS competition_id,
+    t.id AS track_id,
+    t.owner_id AS user_id,
+    t.aggregated_emissions,
+    t.aggregated_health,
+    COALESCE(o.track_length, 0) AS track_length,
+    COALESCE(o.overlap_length, 0) AS overlap_length
+  FROM tracks_track AS t
+    JOIN prizes_competitionparticipant AS cp ON t.owner_id = cp.user_id
+    JOIN prizes_competition AS c ON cp.competition_id = c.id
+    LEFT JOIN smbbackend_trackroioverlap AS o ON (
+      o.competition_id = c.id AND o.track_id = t.id)
+    LEFT JOIN smbbackend_competitionstandingtrack AS st ON (
+      st.competition_id = c.id AND st.track_id = t.id)
+  WHERE {eligibility_filter}
+    AND st.track_id IS NULL
+    AND t.start_date >= c.start_date
+    AND t.end_date <= c.end_date
+    AND t.is_valid = true
+    AND cp.registration_status = 'approved'
+    AND (
+      o.overlap_length > 0 OR NOT EXISTS (
+        SELECT 1
+        FROM prizes_competition_regions AS cr
+        WHERE cr.competition_id = c.id
+      )
+    )
+), accounted AS (
+  INSERT INTO smbbackend_competitionstandingtrack (competition_id, track_id)
+  SELECT competition_id, track_id
+  FROM eligible
+  ON CONFLICT DO NOTHING
+  RETURNING competition_id, track_id
+), track_totals AS (
+  SELECT
+    seg.track_id,
+    COALESCE(
+      SUM(COALESCE(sl.length, ST_Length(seg.geom::geography))) FILTER (
+        WHERE seg.vehicle_type = ANY(%(bike_vehicle_types)s)),
+      0
+    ) AS bike_distance,
+    COALESCE(
+      SUM(COALESCE(sl.length, ST_Length(seg.geom::geography))) FILTER (
+        WHERE seg.vehicle_type = ANY(%(sustainable_vehicle_types)s)),
+      0
+    ) AS sustainable_distance,
+    bool_or(
+      seg.vehicle_type = ANY(%(bike_vehicle_types)s))::int AS bike_usage,
+    bool_or(
+      seg.vehicle_type = ANY(%(public_vehicle_types)s)
+    )::int AS public_transport_usage
+  FROM tracks_segment AS seg
+    LEFT JOIN smbbackend_segmentlength AS sl ON (sl.segment_id = seg.id)
+  WHERE seg.track_id IN (SELECT track_id FROM accounted)
+  GROUP BY seg.track_id
+), contribution AS (
+  SELECT
+    e.competition_id,
+    e.user_id,
+    v.criterium,
+    SUM(COALESCE(v.value, 0)) AS value_sum,
+    SUM(e.track_length) AS track_length_sum,
+    SUM(e.overlap_length) AS overlap_length_sum
+  FROM eligible AS e
+    JOIN accounted AS a ON (
+      a.competition_id = e.competition_id AND a.track_id = e.track_id)
+    LEFT JOIN track_totals AS tt ON (tt.track_id = e.track_id)
+    CROSS JOIN LATERAL (
+      VALUES
+        ('saved_so2', CAST(e.aggregated_emissions ->> 'so2_saved' AS FLOAT)),
+        ('saved_nox', CAST(e.aggregated_emissions ->> 'nox_saved' AS FLOAT)),
+        ('saved_co2', CAST(e.aggregated_emissions ->> 'co2_saved' AS FLOAT)),
+        ('saved_co', CAST(e.aggregated_emissions ->> 'co_saved' AS FLOAT)),
+        ('saved_pm10', CAST(e.aggregated_emissions ->> 'pm10_saved' AS FLOAT)),
+        (
+          'consumed_calories',
+          CAST(e.aggregated_health ->> 'calories_consumed' AS FLOAT)
+        ),
+        ('bike_usage_frequency', CAST(tt.bike_usage AS FLOAT)),
+        (
+          'public_transport_usage_frequency',
+          CAST(tt.public_transport_usage AS FLOAT)
+        ),
+        ('bike_distance', tt.bike_distance),
+        ('sustainable_means_distance', tt.sustainable_distance)
+    ) AS v (criterium, value)
+  GROUP BY e.competition_id, e.user_id, v.criterium
+)
+INSERT INTO smbbackend_competitionstanding AS s (
+  competition_id,
+  user_id,
+  criterium,
+  value_sum,
+  track_length_sum,
+  overlap_length_sum
+)
+SELECT
+  competition_id,
+  user_id,
+  criterium,
+  value_sum,
+  track_length_sum,
+  overlap_length_sum
+FROM contribution
+ON CONFLICT (competition_id, criterium, user_id) DO UPDATE SET
+  value_sum = s.value_sum + EXCLUDED.value_sum,
+  track_length_sum = s.track_length_sum + EXCLUDED.track_length_sum,
+  overlap_length_sum = s.overlap_length_sum + EXCLUDED.overlap_length_sum
@@ -0,0 +1,10 @@
+-- set all of the track's aggregated indexes in a single statement
+--
+-- totals are calculated by the caller, which already has the segments'
+-- indexes in memory
+--
+UPDATE tracks_track SET
+  aggregated_emissions = %(emissions)s,
+  aggregated_costs = %(costs)s,
+  aggregated_health = %(health)s
+WHERE id = %(track_id)s
@@ -0,0 +1,11 @@
+-- record the track that was saved for the claimed object and session
+--
+UPDATE smbbackend_trackuploadclaim
+SET track_id = %(track_id)s
+WHERE object_key = %(object_key)s
+  AND etag = %(etag)s;
+
+UPDATE smbbackend_tracksessionclaim
+SET track_id = %(track_id)s
+WHERE owner_id = %(owner_id)s
+  AND session_id = %(session_id)s;
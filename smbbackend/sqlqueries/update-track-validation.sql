@@ -0,0 +1,5 @@
+UPDATE tracks_track
+SET
+  is_valid = %(is_valid)s,
+  validation_error = %(validation_error)s
+WHERE id = %(track_id)s
@@ -0,0 +1,156 @@
+-- add the contribution of a valid track to its owner's statistics
+--
+-- the track is first recorded in `smbbackend_userstatstrack`. If it was
+-- already there, nothing else happens
+--
+-- the user's collection streak is extended if the track was created on the
+-- day after the last collection day, and it is reset if there is a gap.
+-- Tracks created before the last collection day do not change the streak
+--
+-- money saved is the sum, over the track's segments that were not made by
+-- car, of the difference between what the segment would have cost by car
+-- and its actual total cost. It is never negative for any segment
+--
+WITH processed AS (
+  INSERT INTO smbbackend_userstatstrack (track_id, user_id)
+  SELECT id, owner_id
+  FROM tracks_track
+  WHERE id = %(track_id)s
+    AND is_valid = TRUE
+  ON CONFLICT DO NOTHING
+  RETURNING track_id
+), streak AS (
+  INSERT INTO smbbackend_userstats AS us (
+    user_id,
+    last_collection_day,
+    collection_streak,
+    money_saved
+  )
+  SELECT
+    t.owner_id,
+    date_trunc('day', t.created_at)::date,
+    1,
+    COALESCE(
+      (
+        SELECT SUM(
+          GREATEST(
+            COALESCE(sl.length, ST_Length(s.geom::geography)) / 1000 *
+              %(car_cost_per_km)s +
+            EXTRACT(EPOCH FROM s.end_date - s.start_date) / 3600 *
+              %(car_cost_per_hour)s -
+            COALESCE(c.total_cost, 0),
+            0
+          )
+        )
+        FROM tracks_segment AS s
+          LEFT JOIN smbbackend_segmentlength AS sl ON (sl.segment_id = s.id)
+          LEFT JOIN tracks_cost AS c ON (c.segment_id = s.id)
+        WHERE s.track_id = t.id
+          AND s.vehicle_type <> %(car_vehicle_type)s
+      ),
+      0
+    )
+  FROM processed AS p
+    JOIN tracks_track AS t ON (t.id = p.track_id)
+  ON CONFLICT (user_id) DO UPDATE SET
+    collection_streak = CASE
+      WHEN EXCLUDED.last_collection_day = us.last_collection_day + 1
+        THEN us.collection_streak + 1
+      WHEN EXCLUDED.last_collection_day > us.last_collection_day + 1
+        THEN 1
+      ELSE us.collection_streak
+    END,
+    last_collection_day = GREATEST(
+      us.last_collection_day, EXCLUDED.last_collection_day),
+    money_saved = us.money_saved + EXCLUDED.money_saved
+), contribution AS (
+  SELECT
+    t.owner_id AS user_id,
+    date_trunc('day', s.start_date)::date AS day,
+    s.vehicle_type,
+    SUM(COALESCE(sl.length, ST_Length(s.geom::geography))) AS distance,
+    COUNT(1) AS rides,
+    COALESCE(SUM(h.calories_consumed), 0) AS calories_consumed,
+    COALESCE(SUM(e.so2_saved), 0) AS so2_saved,
+    COALESCE(SUM(e.nox_saved), 0) AS nox_saved,
+    COALESCE(SUM(e.co_saved), 0) AS co_saved,
+    COALESCE(SUM(e.co2_saved), 0) AS co2_saved,
+    COALESCE(SUM(e.pm10_saved), 0) AS pm10_saved
+  FROM processed AS p
+    JOIN tracks_track AS t ON (t.id = p.track_id)
+    JOIN tracks_segment AS s ON (s.track_id = t.id)
+    LEFT JOIN smbbackend_segmentlength AS sl ON (sl.segment_id = s.id)
+    LEFT JOIN tracks_emission AS e ON (e.segment_id = s.id)
+    LEFT JOIN tracks_health AS h ON (h.segment_id = s.id)
+  GROUP BY t.owner_id, date_trunc('day', s.start_date)::date, s.vehicle_type
+), daily AS (
+  INSERT INTO smbbackend_userdailytotals AS d (
+    user_id,
+    day,
+    vehicle_type,
+    distance,
+    rides,
+    calories_consumed,
+    so2_saved,
+    nox_saved,
+    co_saved,
+    co2_saved,
+    pm10_saved
+  )
+  SELECT
+    user_id,
+    day,
+    vehicle_type,
+    distance,
+    rides,
+    calories_consumed,
+    so2_saved,
+    nox_saved,
+    co_saved,
+    co2_saved,
+    pm10_saved
+  FROM contribution
+  ON CONFLICT (user_id, day, vehicle_type) DO UPDATE SET
+    distance = d.distance + EXCLUDED.distance,
+    rides = d.rides + EXCLUDED.rides,
+    calories_consumed = d.calories_consumed + EXCLUDED.calories_consumed,
+    so2_saved = d.so2_saved + EXCLUDED.so2_saved,
+    nox_saved = d.nox_saved + EXCLUDED.nox_saved,
+    co_saved = d.co_saved + EXCLUDED.co_saved,
+    co2_saved = d.co2_saved + EXCLUDED.co2_saved,
+    pm10_saved = d.pm10_saved + EXCLUDED.pm10_saved
+)
+INSERT INTO smbbackend_usertotals AS ut (
+  user_id,
+  vehicle_type,
+  distance,
+  rides,
+  calories_consumed,
+  so2_saved,
+  nox_saved,
+  co_saved,
+  co2_saved,
+  pm10_saved
+)
+SELECT
+  user_id,
+  vehicle_type,
+  SUM(distance),
+  SUM(rides),
+  SUM(calories_consumed),
+  SUM(so2_saved),
+  SUM(nox_saved),
+  SUM(co_saved),
+  SUM(co2_saved),
+  SUM(pm10_saved)
+FROM contribution
+GROUP BY user_id, vehicle_type
+ON CONFLICT (user_id, vehicle_type) DO UPDATE SET
+  distance = ut.distance + EXCLUDED.distance,
+  rides = ut.rides + EXCLUDED.rides,
+  calories_consumed = ut.calories_consumed + EXCLUDED.calories_consumed,
+  so2_saved = ut.so2_saved + EXCLUDED.so2_saved,
+  nox_saved = ut.nox_saved + EXCLUDED.nox_saved,
+  co_saved = ut.co_saved + EXCLUDED.co_saved,
+  co2_saved = ut.co2_saved + EXCLUDED.co2_saved,
+  pm10_saved = ut.pm10_saved + EXCLUDED.pm10_saved
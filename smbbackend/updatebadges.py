@@ -13,8 +13,17 @@
 from collections import namedtuple
 import datetime as dt
 import logging
+from typing import Any
+from typing import Dict
+from typing import Iterable
 from typing import List
+from typing import Set
+from typing import Tuple
 
+from psycopg2.extras import execute_values
+
+from .userstats import refresh_stale_user_stats
+from .userstats import update_user_stats
 from .utils import get_query
 from .utils import get_week_bounds
 from .utils import get_track_info
@@ -37,35 +46,226 @@ BadgeInfo = namedtuple("BadgeInfo", [
 
 UNHANDLED_BADGES = [
     BadgeName.new_user,
-    BadgeName.money_saver_level1,  # not implemented yet
-    BadgeName.money_saver_level2,  # not implemented yet
-    BadgeName.money_saver_level3,  # not implemented yet
 ]
 
+# metrics that are needed in order to evaluate each badge. These are the
+# columns of the `select-badge-metrics.sql` query
+BADGE_METRICS = {
+    BadgeName.biker_level1: "bike_days",
+    BadgeName.biker_level2: "bike_days",
+    BadgeName.biker_level3: "bike_days",
+    BadgeName.bike_surfer_level1: "bike_distance",
+    BadgeName.bike_surfer_level2: "bike_distance",
+    BadgeName.bike_surfer_level3: "bike_distance",
+    BadgeName.data_collector_level0: "collection_streak",
+    BadgeName.data_collector_level1: "collection_streak",
+    BadgeName.data_collector_level2: "collection_streak",
+    BadgeName.data_collector_level3: "collection_streak",
+    BadgeName.ecologist_level1: "co2_saved",
+    BadgeName.ecologist_level2: "co2_saved",
+    BadgeName.ecologist_level3: "co2_saved",
+    BadgeName.healthy_level1: "calories_consumed",
+    BadgeName.healthy_level2: "calories_consumed",
+    BadgeName.healthy_level3: "calories_consumed",
+    BadgeName.public_mobility_level1: "public_transport_rides",
+    BadgeName.public_mobility_level2: "public_transport_rides",
+    BadgeName.public_mobility_level3: "public_transport_rides",
+    BadgeName.multi_surfer_level1: "sustainable_distance",
+    BadgeName.multi_surfer_level2: "sustainable_distance",
+    BadgeName.multi_surfer_level3: "sustainable_distance",
+    BadgeName.tpl_surfer_level1: "bus_distance",
+    BadgeName.tpl_surfer_level2: "bus_distance",
+    BadgeName.tpl_surfer_level3: "bus_distance",
+    BadgeName.money_saver_level1: "money_saved",
+    BadgeName.money_saver_level2: "money_saved",
+    BadgeName.money_saver_level3: "money_saved",
+}
+
+BADGE_METRIC_NAMES = (
+    "bike_distance",
+    "bus_distance",
+    "sustainable_distance",
+    "public_transport_rides",
+    "calories_consumed",
+    "co2_saved",
+    "bike_days",
+    "collection_streak",
+    "money_saved",
+)
+
+# badge families, with their levels sorted in ascending order of difficulty.
+# A level is only evaluated once all of the previous ones have been acquired
+BADGE_TIERS = [
+    (
+        BadgeName.data_collector_level0,
+        BadgeName.data_collector_level1,
+        BadgeName.data_collector_level2,
+        BadgeName.data_collector_level3,
+    ),
+    (
+        BadgeName.biker_level1,
+        BadgeName.biker_level2,
+        BadgeName.biker_level3,
+    ),
+    (
+        BadgeName.public_mobility_level1,
+        BadgeName.public_mobility_level2,
+        BadgeName.public_mobility_level3,
+    ),
+    (
+        BadgeName.bike_surfer_level1,
+        BadgeName.bike_surfer_level2,
+        BadgeName.bike_surfer_level3,
+    ),
+    (
+        BadgeName.tpl_surfer_level1,
+        BadgeName.tpl_surfer_level2,
+        BadgeName.tpl_surfer_level3,
+    ),
+    (
+        BadgeName.multi_surfer_level1,
+        BadgeName.multi_surfer_level2,
+        BadgeName.multi_surfer_level3,
+    ),
+    (
+        BadgeName.ecologist_level1,
+        BadgeName.ecologist_level2,
+        BadgeName.ecologist_level3,
+    ),
+    (
+        BadgeName.healthy_level1,
+        BadgeName.healthy_level2,
+        BadgeName.healthy_level3,
+    ),
+    (
+        BadgeName.money_saver_level1,
+        BadgeName.money_saver_level2,
+        BadgeName.money_saver_level3,
+    ),
+]
+
+DATA_COLLECTOR_DAYS = {
+    BadgeName.data_collector_level0: 1,
+    BadgeName.data_collector_level1: 7,
+    BadgeName.data_collector_level2: 14,
+    BadgeName.data_collector_level3: 30,
+}
+
+BIKER_WEEK_OFFSET_DAYS = {
+    BadgeName.biker_level1: 0,
+    BadgeName.biker_level2: 7,  # previous week
+    BadgeName.biker_level3: 3 * 7,  # three weeks ago
+}
+
 
 def update_badges(track_id: int, db_cursor) -> List[BadgeName]:
     """Update badges taking into account for the input track
 
     Note that this function does not check for track validity. The caller is
-    responsible for that (if needed)
+    responsible for that (if needed). Badges are evaluated against the
+    per-user statistics, which are first refreshed if they include tracks
+    that are no longer valid, and then updated with the input track.
+
+    All of the metrics needed by the pending badges are fetched with a
+    single query and then shared by the badge handlers. The levels of each
+    badge family are awarded in order, up to the first one whose target has
+    not been reached yet. The progress of every pending level, capped at its
+    target, is then saved with a single query.
 
     """
 
     track_info = get_track_info(track_id, db_cursor)
+    refresh_stale_user_stats(db_cursor, user_id=track_info.owner_id)
+    update_user_stats(track_id, db_cursor)
     badges_info = get_badges_info(track_info.owner_id, db_cursor)
-    not_acquired = (b for b in badges_info if not b.acquired)
-    to_ignore = (b for b in badges_info if b.name in UNHANDLED_BADGES)
-    to_handle = set(not_acquired).difference(set(to_ignore))
+    pending_tiers = get_pending_tiers(badges_info)
+    metrics = get_badge_metrics(
+        get_required_metrics(
+            badge.name for tier in pending_tiers for badge in tier),
+        track_info,
+        db_cursor
+    )
     awarded_badges = []
-    for badge_info in list(to_handle):
-        logger.debug("handling badge {!r}...".format(badge_info.name))
-        badge_awarded = handle_badge(badge_info, track_info, db_cursor)
-        if badge_awarded:
-            awarded_badges.append(badge_info.name)
+    badges_progress = []
+    for tier in pending_tiers:
+        previous_reached = True
+        for badge_info in tier:
+            logger.debug("handling badge {!r}...".format(badge_info.name))
+            progress = handle_badge(badge_info, track_info, metrics)
+            badges_progress.append(
+                (badge_info.id, int(min(progress, badge_info.target))))
+            previous_reached = (
+                previous_reached and progress >= badge_info.target)
+            if previous_reached:
+                logger.debug("Awarding badge {!r}".format(badge_info.name))
+                award_badge(badge_info.id, db_cursor)
+                awarded_badges.append(badge_info.name)
+    update_badges_progress(badges_progress, db_cursor)
     return awarded_badges
 
 
-def handle_badge(badge: BadgeInfo, track: TrackInfo, db_cursor):
+def get_pending_tiers(
+        badges_info: List[BadgeInfo]) -> List[List[BadgeInfo]]:
+    """Return the badges that still need to be evaluated, grouped by family
+
+    Acquired levels are left out, as are families that cannot be handled.
+
+    """
+
+    badges = {badge.name: badge for badge in badges_info}
+    result = []
+    for tier_names in BADGE_TIERS:
+        tier = [
+            badges[name] for name in tier_names
+            if name in badges and not badges[name].acquired
+        ]
+        if len(tier) > 0 and tier[0].name not in UNHANDLED_BADGES:
+            result.append(tier)
+    return result
+
+
+def get_required_metrics(badge_names: Iterable[BadgeName]) -> Set[str]:
+    return set(
+        BADGE_METRICS[name] for name in badge_names if name in BADGE_METRICS)
+
+
+def get_badge_metrics(required: Set[str], track: TrackInfo,
+                      db_cursor) -> Dict[str, Any]:
+    """Fetch the required badge metrics for the owner of the input track
+
+    Metrics that are not required are not calculated and are returned as
+    ``None``. No query is issued if there are no required metrics at all.
+
+    """
+
+    if len(required) == 0:
+        return {name: None for name in BADGE_METRIC_NAMES}
+    reference_date = track.created_at
+    bike_days_start = get_week_bounds(
+        reference_date - dt.timedelta(
+            days=max(BIKER_WEEK_OFFSET_DAYS.values()))
+    )[0]
+    query_params = {
+        "include_{}".format(name): name in required
+        for name in BADGE_METRIC_NAMES
+    }
+    query_params.update({
+        "user_id": track.owner_id,
+        "bike_vehicle_types": [VehicleType.bike.name],
+        "bus_vehicle_types": [VehicleType.bus.name],
+        "sustainable_vehicle_types": [
+            vt.name for vt in SUSTAINABLE_TRANSPORTS],
+        "public_vehicle_types": [vt.name for vt in PUBLIC_TRANSPORTS],
+        "bike_days_start": bike_days_start.isoformat(),
+        "bike_days_end": get_week_bounds(reference_date)[-1].isoformat(),
+    })
+    db_cursor.execute(get_query("select-badge-metrics.sql"), query_params)
+    return dict(zip(BADGE_METRIC_NAMES, db_cursor.fetchone()))
+
+
+def handle_badge(badge: BadgeInfo, track: TrackInfo,
+                 metrics: Dict[str, Any]):
+    """Return the current progress of the input badge"""
     handler = {
         BadgeName.biker_level1: handle_biker_badge,
         BadgeName.biker_level2: handle_biker_badge,
@@ -86,9 +286,9 @@ def handle_badge(badge: BadgeInfo, track: TrackInfo, db_cursor):
         BadgeName.public_mobility_level1: handle_public_mobility_badge,
         BadgeName.public_mobility_level2: handle_public_mobility_badge,
         BadgeName.public_mobility_level3: handle_public_mobility_badge,
-        BadgeName.money_saver_level1: None,
-        BadgeName.money_saver_level2: None,
-        BadgeName.money_saver_level3: None,
+        BadgeName.money_saver_level1: handle_money_saver_badge,
+        BadgeName.money_saver_level2: handle_money_saver_badge,
+        BadgeName.money_saver_level3: handle_money_saver_badge,
         BadgeName.multi_surfer_level1: handle_distance_based_badge,
         BadgeName.multi_surfer_level2: handle_distance_based_badge,
         BadgeName.multi_surfer_level3: handle_distance_based_badge,
@@ -96,129 +296,60 @@ def handle_badge(badge: BadgeInfo, track: TrackInfo, db_cursor):
         BadgeName.tpl_surfer_level2: handle_distance_based_badge,
         BadgeName.tpl_surfer_level3: handle_distance_based_badge,
     }[badge.name]
-    current_progress = handler(badge, track, db_cursor)
-    badge_awarded = False
-    if current_progress >= badge.target:
-        logger.debug("Awarding badge {!r}".format(badge.name))
-        award_badge(badge.id, db_cursor)
-        badge_awarded = True
-    return badge_awarded
-
-
-def handle_data_collector_badge(badge: BadgeInfo, track: TrackInfo, db_cursor):
-    days_offset = {
-        BadgeName.data_collector_level0: 0,
-        BadgeName.data_collector_level1: 7 - 1,
-        BadgeName.data_collector_level2: 14 - 1,
-        BadgeName.data_collector_level3: 30 - 1,
-    }
-    end_date = track.created_at
-    start_date = end_date - dt.timedelta(days=days_offset.get(badge.name, 0))
-    delta_days = (end_date - start_date).days
-    interval = [start_date + dt.timedelta(days=d) for d in range(delta_days)]
-    interval = interval or [end_date]
-    db_cursor.execute(
-        get_query("select-count-tracks-by-date-interval.sql"),
-        {
-            "owner_id": track.owner_id,
-            "start_date": start_date,
-            "end_date": end_date,
-        }
-    )
-    rows = db_cursor.fetchall()
-    comparison_pattern = "%Y-%m-%d"
-    days_with_data_collected = [
-        r[0].strftime(comparison_pattern) for r in rows]
-    for day in interval:
-        if day.strftime(comparison_pattern) not in days_with_data_collected:
-            result = 0
-            break
+    return handler(badge, track, metrics)
+
+
+def handle_data_collector_badge(badge: BadgeInfo, track: TrackInfo,
+                                metrics: Dict[str, Any]):
+    num_days = DATA_COLLECTOR_DAYS.get(badge.name, 1)
+    if (metrics["collection_streak"] or 0) >= num_days:
+        result = badge.target  # data was collected on all days in interval
     else:
-        result = badge.target  # all days in interval had some data collected
+        result = 0
     return result
 
 
 def handle_biker_badge(badge: BadgeInfo, track: TrackInfo,
-                       db_cursor):
+                       metrics: Dict[str, Any]):
     if uses_vehicle_type(track.segments, VehicleType.bike):
-        week_offset_days = {
-            BadgeName.biker_level1: 0,
-            BadgeName.biker_level2: 7,  # previous week
-            BadgeName.biker_level3: 3 * 7,  # three weeks ago
-        }.get(badge.name)
         reference_date = track.created_at
-        end_bound = get_week_bounds(reference_date)[-1]
         start_bound = get_week_bounds(
-            reference_date - dt.timedelta(days=week_offset_days)
-        )[0]
-        num_bike_usages = get_num_bike_usages(
-            start_bound, end_bound, track.owner_id, db_cursor)
+            reference_date - dt.timedelta(
+                days=BIKER_WEEK_OFFSET_DAYS.get(badge.name))
+        )[0].date()
+        num_bike_usages = len(
+            [d for d in metrics["bike_days"] or [] if d >= start_bound])
     else:
         num_bike_usages = 0
     return num_bike_usages
 
 
-def handle_distance_based_badge(badge: BadgeInfo, track: TrackInfo, db_cursor):
-    vehicle_type_mapping = {
-        "bike_surfer": [VehicleType.bike],
-        "tpl_surfer": [VehicleType.bus],
-        "multi_surfer": SUSTAINABLE_TRANSPORTS,
-    }
-    for badge_name_prefix, vehicle_types in vehicle_type_mapping.items():
-        if badge.name.name.startswith(badge_name_prefix):
-            total_distance = get_total_distance(
-                track.owner_id, vehicle_types, db_cursor)
-            break
-    else:
-        total_distance = 0
+def handle_distance_based_badge(badge: BadgeInfo, track: TrackInfo,
+                                metrics: Dict[str, Any]):
+    total_distance = metrics[BADGE_METRICS[badge.name]]
     distance_km = total_distance / 1000 if total_distance is not None else 0
     return distance_km
 
 
-def handle_ecologist_badge(badge: BadgeInfo, track: TrackInfo, db_cursor):
-    db_cursor.execute(
-        get_query("select-pollutant-sum-by-user.sql"),
-        {
-            "pollutant": "co2_saved",
-            "user_id": track.owner_id
-        }
-    )
-    saved_co2 = db_cursor.fetchone()[0]
-    saved_co2_kg = (saved_co2 or 0) / 1000
+def handle_ecologist_badge(badge: BadgeInfo, track: TrackInfo,
+                           metrics: Dict[str, Any]):
+    saved_co2_kg = (metrics["co2_saved"] or 0) / 1000
     return saved_co2_kg
 
 
 def handle_public_mobility_badge(badge: BadgeInfo, track: TrackInfo,
-                                 db_cursor):
-    db_cursor.execute(
-        get_query("select-count-vehicle-rides.sql"),
-        {
-            "vehicle_types": [t.name for t in PUBLIC_TRANSPORTS],
-            "user_id": track.owner_id,
-        }
-    )
-    num_rides = db_cursor.fetchone()[0]
-    return num_rides
+                                 metrics: Dict[str, Any]):
+    return metrics["public_transport_rides"] or 0
 
 
-def handle_healthy_badge(badge: BadgeInfo, track: TrackInfo, db_cursor):
-    db_cursor.execute(
-        get_query("select-sum-consumed-calories.sql"),
-        {"user_id": track.owner_id}
-    )
-    consumed_calories = db_cursor.fetchone()[0]
-    return consumed_calories
+def handle_healthy_badge(badge: BadgeInfo, track: TrackInfo,
+                         metrics: Dict[str, Any]):
+    return metrics["calories_consumed"] or 0
 
 
-def get_total_distance(user_id, vehicle_types: List[VehicleType], db_cursor):
-    db_cursor.execute(
-        get_query("select-total-distance-on-vehicle-types.sql"),
-        {
-            "user_id": user_id,
-            "vehicle_types": [v.name for v in vehicle_types],
-        }
-    )
-    return db_cursor.fetchone()[0]
+def handle_money_saver_badge(badge: BadgeInfo, track: TrackInfo,
+                             metrics: Dict[str, Any]):
+    return metrics["money_saved"] or 0
 
 
 def award_badge(badge_id, db_cursor):
@@ -228,21 +359,20 @@ def award_badge(badge_id, db_cursor):
     )
 
 
-def get_num_bike_usages(
-        start_dt: dt.datetime,
-        end_dt: dt.datetime,
-        owner_id: int,
-        db_cursor
-):
-    db_cursor.execute(
-        get_query("select-count-bike-rides.sql"),
-        {
-            "owner_id": owner_id,
-            "start": start_dt.isoformat(),
-            "end": end_dt.isoformat(),
-        }
-    )
-    return len(db_cursor.fetchall())
+def update_badges_progress(badges_progress: List[Tuple[int, int]],
+                           db_cursor):
+    """Save the progress of badges
+
+    ``badges_progress`` is a list of (badge id, progress) tuples
+
+    """
+
+    if len(badges_progress) > 0:
+        execute_values(
+            db_cursor,
+            get_query("update-badge-progress.sql"),
+            badges_progress
+        )
 
 
 def get_badges_info(user_id: int, db_cursor) -> List[BadgeInfo]:
@@ -0,0 +1,117 @@
+#########################################################################
+#
+# Copyright 2018, GeoSolutions Sas.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+#
+#########################################################################
+
+"""Incrementally maintained per-user statistics
+
+Statistics are kept per user and vehicle type, both as overall totals and
+split by day, along with each user's current streak of consecutive days with
+collected data and the money saved by not using a car. They are updated
+whenever a valid track is processed, so that badge handlers can read them
+instead of aggregating the user's whole history.
+
+"""
+
+import logging
+import typing
+
+import numpy as np
+
+from . import indexengine
+from ._constants import VehicleType
+from .utils import get_query
+
+logger = logging.getLogger(__name__)
+
+
+def update_user_stats(track_id: int, db_cursor) -> bool:
+    """Add the input track's contribution to its owner's statistics
+
+    Each track is accounted for only once. Invalid tracks are ignored.
+    Returns whether the statistics have been updated.
+
+    Since the contribution includes emissions and calories, the track's
+    indexes must already have been calculated.
+
+    """
+
+    query_params = {
+        "track_id": track_id,
+        "car_vehicle_type": VehicleType.car.name,
+    }
+    query_params.update(get_car_reference_costs())
+    db_cursor.execute(get_query("update-user-stats.sql"), query_params)
+    updated = db_cursor.rowcount > 0
+    if not updated:
+        logger.debug(
+            "Track {} is either invalid or has already been accounted "
+            "for".format(track_id)
+        )
+    return updated
+
+
+def rebuild_user_stats(db_cursor, user_id: int = None):
+    """Recompute users' statistics from scratch
+
+    This should be done for all users after the indexes of existing tracks
+    have been recomputed, or when the statistics tables are first created.
+    Pass ``user_id`` in order to only recompute the statistics of that user.
+
+    """
+
+    query_params = {
+        "user_id": user_id,
+        "car_vehicle_type": VehicleType.car.name,
+    }
+    query_params.update(get_car_reference_costs())
+    db_cursor.execute(get_query("rebuild-user-stats.sql"), query_params)
+
+
+def refresh_stale_user_stats(db_cursor,
+                             user_id: int = None) -> typing.List[int]:
+    """Rebuild statistics that include invalidated or deleted tracks
+
+    Statistics only ever grow as tracks are accounted for, so the statistics
+    of users with tracks that have since become invalid, or that have been
+    deleted, are recomputed from their remaining valid tracks. Only the user
+    with ``user_id`` is checked, or all users if it is None. Returns the ids
+    of the users whose statistics have been rebuilt.
+
+    """
+
+    db_cursor.execute(
+        get_query("select-stale-user-stats.sql"), {"user_id": user_id})
+    stale_user_ids = [row[0] for row in db_cursor.fetchall()]
+    for stale_user_id in stale_user_ids:
+        logger.debug(
+            "Rebuilding statistics of user {}...".format(stale_user_id))
+        rebuild_user_stats(db_cursor, user_id=stale_user_id)
+    return stale_user_ids
+
+
+def get_car_reference_costs(
+        coefficients: indexengine.IndexCoefficients = indexengine.COEFFICIENTS
+) -> typing.Dict[str, float]:
+    """Return the total cost of travelling by car, per km and per hour
+
+    These are used as the reference for calculating the money saved by using
+    other vehicle types. Costs are linear on both length and duration, so a
+    segment's reference cost is just the sum of both contributions.
+
+    """
+
+    car = np.array([VehicleType.car.value])
+    per_km = indexengine.calculate_costs(
+        car, np.ones(1), np.zeros(1), coefficients)["total_cost"]
+    per_hour = indexengine.calculate_costs(
+        car, np.zeros(1), np.ones(1), coefficients)["total_cost"]
+    return {
+        "car_cost_per_km": float(per_km[0]),
+        "car_cost_per_hour": float(per_hour[0]),
+    }
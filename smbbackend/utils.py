@@ -15,8 +15,8 @@ from enum import Enum
 import logging
 import os
 import pathlib
+import typing
 
-from osgeo import ogr
 import psycopg2
 
 logger = logging.getLogger(__name__)
@@ -116,8 +116,27 @@ def get_user_uuid(user_id: int, db_cursor):
     return result[0] if result is not None else None
 
 
-def get_region_of_interest(db_cursor):
-    db_cursor.execute(get_query("select-region-of-interest.sql"))
-    wkb = bytes(db_cursor.fetchone()[0])
-    geometry = ogr.CreateGeometryFromWkb(wkb)
-    return geometry
+def update_region_pieces(db_cursor, regions_table: str, pieces_table: str,
+                         max_vertices: int = 256) -> typing.List[int]:
+    """Subdivide the regions of interest that are new or have been modified
+
+    Pieces of regions that have been deleted are removed too. Returns the
+    ids of the regions whose pieces changed.
+
+    """
+
+    db_cursor.execute(
+        get_query("sync-region-pieces.sql").format(
+            regions_table=regions_table, pieces_table=pieces_table),
+        {"max_vertices": max_vertices}
+    )
+    return [row[0] for row in db_cursor.fetchall()]
+
+
+def get_regions_version(db_cursor, regions_table: str) -> str:
+    """Return a fingerprint that changes whenever any region is modified"""
+    db_cursor.execute(
+        get_query("select-regions-version.sql").format(
+            regions_table=regions_table)
+    )
+    return db_cursor.fetchone()[0]
@@ -0,0 +1,101 @@
+#########################################################################
+#
+# Copyright 2018, GeoSolutions Sas.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+#
+#########################################################################
+
+from unittest import mock
+
+import pytest
+
+from smbbackend.exceptions import DuplicateTrackError
+from smbbackend.utils import MessageType
+
+# the FCM service is created at import time and is never used by these tests
+with mock.patch("pyfcm.FCMNotification"):
+    from smbbackend import awshandlers
+
+pytestmark = pytest.mark.unit
+
+OWNER_UUID = "123e4567-e89b-12d3-a456-426614174000"
+
+
+class FakeStages:
+    """Keep track of the stage claims, as if they were stored in the DB"""
+
+    def __init__(self):
+        self.completed = set()
+        self.pending = set()
+
+    def claim(self, track_id, stage, db_cursor):
+        if (track_id, stage) in self.completed | self.pending:
+            return False
+        self.pending.add((track_id, stage))
+        return True
+
+    def commit(self):
+        self.completed |= self.pending
+        self.pending = set()
+
+    def rollback(self):
+        self.pending = set()
+
+
+def test_modular_track_handler_resumes_after_failure():
+    stages = FakeStages()
+    mock_cursor = mock.MagicMock()
+    mock_cursor.connection.commit.side_effect = stages.commit
+    context = mock.Mock()
+    context.get_remaining_time_in_millis.return_value = 10 ** 6
+    s3_arguments = {
+        "bucket_name": "fake-bucket",
+        "object_key": "tracks/{}.zip".format(OWNER_UUID),
+        "etag": "fake-etag",
+    }
+    with mock.patch.object(awshandlers, "_send_notification") as mock_send, \
+            mock.patch.object(awshandlers, "get_user_active_devices"), \
+            mock.patch.object(awshandlers.processor, "claim_track_upload",
+                              side_effect=[
+                                  None,
+                                  DuplicateTrackError("fake", track_id=5),
+                              ]), \
+            mock.patch.object(awshandlers.processor, "parse_points_from_s3"), \
+            mock.patch.object(awshandlers.processor, "ingest_points",
+                              return_value=([], 5, 123)) as mock_ingest, \
+            mock.patch.object(awshandlers.processor, "is_track_valid",
+                              return_value=True), \
+            mock.patch.object(awshandlers.processor, "claim_track_stage",
+                              side_effect=stages.claim), \
+            mock.patch.object(awshandlers.utils, "get_track_info",
+                              return_value=mock.Mock(is_valid=True)), \
+            mock.patch.object(awshandlers.calculateindexes,
+                              "calculate_indexes",
+                              side_effect=[RuntimeError("fake"), None]), \
+            mock.patch.object(awshandlers.calculateprizes,
+                              "update_track_roi_overlaps"), \
+            mock.patch.object(awshandlers.calculateprizes,
+                              "update_track_standings"), \
+            mock.patch.object(awshandlers.updatebadges, "update_badges",
+                              return_value=[]) as mock_badges:
+        with pytest.raises(RuntimeError):
+            awshandlers.modular_track_handler(
+                MessageType.s3_received_track, dict(s3_arguments),
+                mock_cursor, context=context
+            )
+        stages.rollback()
+        assert stages.completed == set()
+        mock_badges.assert_not_called()
+        # the lambda retries the original message
+        awshandlers.modular_track_handler(
+            MessageType.s3_received_track, dict(s3_arguments),
+            mock_cursor, context=context
+        )
+    assert mock_ingest.call_count == 1
+    assert mock_badges.call_count == 1
+    assert stages.completed == {(5, "indexes"), (5, "badges")}
+    sent_types = [call[0][0] for call in mock_send.call_args_list]
+    assert sent_types.count(MessageType.indexes_have_been_calculated) == 1
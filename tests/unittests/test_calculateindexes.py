@@ -0,0 +1,221 @@
+#########################################################################
+#
+# Copyright 2018, GeoSolutions Sas.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+#
+#########################################################################
+
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from smbbackend import calculateindexes
+from smbbackend import indexengine
+from smbbackend import _constants
+from smbbackend._constants import VehicleType
+
+pytestmark = pytest.mark.unit
+
+
+@pytest.mark.parametrize("vehicle_types, lengths_km, durations_hours", [
+    pytest.param([], [], [], id="no segments"),
+    pytest.param(
+        [VehicleType.bike, VehicleType.car],
+        [2, 10],
+        [0.1, 0.2],
+        id="two segments"
+    ),
+])
+def test_aggregate_indexes(vehicle_types, lengths_km, durations_hours):
+    indexes = indexengine.calculate_segments_indexes(
+        indexengine.get_vehicle_type_values(vehicle_types),
+        lengths_km,
+        durations_hours
+    )
+    emissions, costs, health = calculateindexes.aggregate_indexes(indexes)
+    if len(vehicle_types) == 0:
+        assert (emissions, costs, health) == ({}, {}, {})
+    else:
+        assert set(emissions) == set(indexengine.EMISSION_INDEXES)
+        assert set(costs) == set(indexengine.COST_INDEXES)
+        assert set(health) == set(indexengine.HEALTH_INDEXES)
+        assert costs["total_cost"] == pytest.approx(
+            indexes["total_cost"].sum())
+        assert health["calories_consumed"] == pytest.approx(
+            indexes["calories_consumed"][0])
+
+
+@pytest.mark.parametrize("vehicle_type", list(VehicleType))
+@pytest.mark.parametrize("length_km, duration_hours", [
+    (0.5, 0.25),
+    (3, 0.25),
+    (5.5, 0.25),
+    (6.5, 1),
+    (13, 1),
+    (20, 0.5),
+    (100, 1),
+])
+def test_calculate_segments_indexes_matches_scalar_functions(
+        vehicle_type, length_km, duration_hours):
+    speed_km_h = length_km / duration_hours
+    expected = {}
+    expected.update(
+        _reference_calculate_emissions(vehicle_type, length_km))
+    expected.update(
+        _reference_calculate_costs(
+            vehicle_type, length_km, duration_hours)
+    )
+    expected.update(
+        _reference_calculate_health(
+            vehicle_type, duration_hours * 60, speed_km_h)
+    )
+    result = indexengine.calculate_segments_indexes(
+        np.array([vehicle_type.value]),
+        np.array([length_km]),
+        np.array([duration_hours])
+    )
+    assert set(result) == set(expected)
+    for name, value in expected.items():
+        assert result[name][0] == pytest.approx(value), name
+
+
+# Scalar reference implementation of the indexes, as they were calculated
+# before the vectorized index engine
+def _reference_calculate_emissions(vehicle_type: VehicleType,
+                        segment_length:float) -> dict:
+    result = {}
+    for pollutant, coeffs in _constants.EMISSIONS.items():
+        emitted = (
+                (coeffs.get(vehicle_type, 0) * segment_length) /
+                _constants.AVERAGE_PASSENGER_COUNT.get(vehicle_type, 1)
+        )
+        reference = (
+                (coeffs[VehicleType.car] * segment_length) /
+                _constants.AVERAGE_PASSENGER_COUNT[VehicleType.car]
+        )
+        saved = reference - emitted if vehicle_type != VehicleType.car else 0
+        # We take car as a reference, but it is not always the most pollutant
+        # vehicle type. E.g. riding a motorcycle emmits more CO and PM10 than
+        # a car. For those cases, we set `saved` to zero in order to prevent
+        # showing negative savings.
+        saved = max(saved, 0)
+        result.update({
+            pollutant.name: emitted,
+            "{}_saved".format(pollutant.name): saved
+        })
+    return result
+
+
+def _reference_calculate_costs(vehicle_type: VehicleType, length_km: float,
+                    duration_hours: float):
+    public_transports = [
+        vehicle_type.bus,
+        vehicle_type.train,
+    ]
+    if vehicle_type in public_transports:
+        costs = _calculate_costs_public_transportation(
+            vehicle_type, length_km, duration_hours)
+    else:
+        costs = _calculate_costs_private_vehicle(
+            vehicle_type, length_km, duration_hours)
+    result = {
+        "fuel_cost": costs[0],
+        "time_cost": costs[1],
+        "depreciation_cost": costs[2],
+        "operation_cost": costs[3],
+        "total_cost": costs[4],
+    }
+    return result
+
+
+def _calculate_costs_private_vehicle(vehicle_type: VehicleType,
+                                     length_km: float, duration_hours: float):
+    """Calculate monetary costs associated with using a private vehicle
+
+    - Fuel, depreciation and operation costs do not take into account the
+      passenger count as these costs are usually supported solely by the
+      vehicle's owner, even if there are other passengers aboard
+    - The total cost may be enlarged according to the vehicle type, in order
+      to provide an account of other costs
+
+    """
+
+    fuel_cost = _get_fuel_cost(length_km, vehicle_type)
+    time_cost = duration_hours * _constants.TIME_COST_PER_HOUR_EURO
+    depreciation_cost = (
+            length_km * _constants.DEPRECIATION_COST.get(vehicle_type, 0))
+    operation_cost = length_km * _constants.OPERATION_COST.get(vehicle_type, 0)
+    total_cost = (
+            sum((fuel_cost, time_cost, depreciation_cost, operation_cost)) *
+            (1 + _constants.TOTAL_COST_OVERHEAD.get(vehicle_type, 0))
+    )
+
+    return fuel_cost, time_cost, depreciation_cost, operation_cost, total_cost
+
+
+def _calculate_costs_public_transportation(vehicle_type: VehicleType,
+                                           length_km:float,
+                                           duration_hours: float):
+    fuel_cost = 0
+    time_cost = duration_hours * _constants.TIME_COST_PER_HOUR_EURO
+    depreciation_cost = 0
+    operation_cost = 0
+    total_cost = (
+            sum((fuel_cost, time_cost, depreciation_cost, operation_cost)) *
+            (1 + _constants.TOTAL_COST_OVERHEAD.get(vehicle_type, 0))
+    )
+    return fuel_cost, time_cost, depreciation_cost, operation_cost, total_cost
+
+
+def _get_fuel_cost(length, vehicle_type):
+    try:
+        volume_spent = length * (1 / _constants.FUEL_CONSUMPTION[vehicle_type])
+        monetary_cost = volume_spent * _constants.FUEL_PRICE[vehicle_type]
+    except (KeyError, ZeroDivisionError):
+        monetary_cost = 0
+    return monetary_cost
+
+
+def _reference_calculate_health(vehicle_type, duration_minutes, speed_km_h):
+    return {
+        "calories_consumed": _get_consumed_calories(
+            speed_km_h, duration_minutes, vehicle_type),
+        # "benefit_index": None  # TODO
+    }
+
+
+def _get_consumed_calories(speed_km_h, duration_minutes, vehicle_type):
+    try:
+        steps = _constants.CALORY_CONSUMPTION[vehicle_type]["steps"]
+    except KeyError:
+        result = 0
+    else:
+        for step in steps:
+            if speed_km_h < step["speed"]:
+                consumption_per_minute = step["calories"]
+                break
+        else:
+            consumption_per_minute = steps[-1]["calories"]
+        result = consumption_per_minute * duration_minutes
+    return result
+
+
+@pytest.mark.parametrize("stored, expected_loads", [
+    pytest.param(True, 0, id="already stored"),
+    pytest.param(False, 1, id="missing"),
+])
+def test_get_stored_coefficients_version(stored, expected_loads):
+    mock_cursor = mock.MagicMock()
+    mock_cursor.fetchone.return_value = ("fake",) if stored else None
+    with mock.patch.dict(calculateindexes._COEFFICIENTS_VERSION_CACHE,
+                         {"version": "fake"}), \
+            mock.patch.object(calculateindexes,
+                              "load_coefficients") as mock_load:
+        version = calculateindexes.get_stored_coefficients_version(
+            mock_cursor)
+    assert version == "fake"
+    assert mock_load.call_count == expected_loads
@@ -8,7 +8,10 @@
 #
 #########################################################################
 
+from unittest import mock
+
 import pytest
+from psycopg2 import sql
 
 from smbbackend import calculateprizes
 from smbbackend._constants import PrizeCriterium
@@ -125,3 +128,159 @@ def test_consolidate_leaderboards(summed_participant_scores):
 def test_sum_participant_scores(criteria_boards, expected):
     result = calculateprizes.sum_participant_scores(criteria_boards)
     assert result == expected
+
+
+def test_get_rankings():
+    competition = calculateprizes.CompetitionInfo(
+        id=1,
+        name="fake",
+        criteria=[PrizeCriterium.saved_co2.value],
+        winner_threshold=1,
+        start_date=None,
+        end_date=None,
+        age_groups=None,
+        region_of_interest=None
+    )
+    mock_cursor = mock.MagicMock()
+    mock_cursor.fetchall.return_value = [
+        ("saved_co2", "fake_user1", 30, 2),
+        ("saved_co2", "fake_user2", 10, 1),
+        ("saved_so2", "fake_user1", 1, 1),
+        ("saved_so2", "fake_user2", 2, 2),
+    ]
+    result = calculateprizes.get_rankings(competition, mock_cursor)
+    assert [c.user_id for c in result[PrizeCriterium.saved_co2]] == [
+        "fake_user1", "fake_user2"]
+    assert [c.user_id for c in result[PrizeCriterium.saved_so2]] == [
+        "fake_user2", "fake_user1"]
+    assert result[PrizeCriterium.saved_co2][0] == (
+        calculateprizes.CompetitorInfo(
+            points=2, user_id="fake_user1", absolute_score=30)
+    )
+
+
+def test_get_competition_scores():
+    competition = calculateprizes.CompetitionInfo(
+        id=1,
+        name="fake",
+        criteria=[
+            PrizeCriterium.saved_co2.value,
+            PrizeCriterium.saved_nox.value,
+        ],
+        winner_threshold=1,
+        start_date=None,
+        end_date=None,
+        age_groups=None,
+        region_of_interest=None
+    )
+    mock_cursor = mock.MagicMock()
+    mock_cursor.fetchall.return_value = [
+        (1, "saved_co2", 30),
+        (1, "saved_nox", 5),
+        (1, "saved_so2", 7),
+        (2, None, None),
+        (3, "saved_nox", 2),
+    ]
+    result = calculateprizes.get_competition_scores(competition, mock_cursor)
+    assert result.criteria == (
+        PrizeCriterium.saved_co2, PrizeCriterium.saved_nox)
+    assert result.user_ids.tolist() == [1, 2, 3]
+    assert result.scores.tolist() == [[30, 5], [0, 0], [0, 2]]
+
+
+def test_get_standings_parameters():
+    result = calculateprizes.get_standings_parameters(track_id=3)
+    assert result["track_id"] == 3
+    assert result["bike_vehicle_types"] == ["bike"]
+    assert set(result["public_vehicle_types"]) == {"bus", "train"}
+    assert set(result["sustainable_vehicle_types"]) == {
+        "bike", "bus", "foot", "train"}
+
+
+def test_execute_values_and_fetch():
+    mock_cursor = mock.MagicMock()
+    mock_cursor.fetchall.return_value = [(10,), (11,)]
+    result = calculateprizes._execute_values_and_fetch(
+        mock_cursor,
+        "SELECT '%s' FROM (VALUES {values}) AS v (competition_id, user_id)",
+        [(1, 10), [1, 11]]
+    )
+    mock_cursor.execute.assert_called_once_with(
+        sql.Composed([
+            sql.SQL("SELECT '%s' FROM (VALUES "),
+            sql.Composed([
+                sql.Literal((1, 10)),
+                sql.SQL(","),
+                sql.Literal((1, 11)),
+            ]),
+            sql.SQL(") AS v (competition_id, user_id)"),
+        ])
+    )
+    assert result == [(10,), (11,)]
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM (VALUES %s) AS v (user_id)",
+    "SELECT * FROM (VALUES {values}), (VALUES {values}) AS v (user_id)",
+])
+def test_execute_values_and_fetch_invalid_placeholder(query):
+    with pytest.raises(ValueError):
+        calculateprizes._execute_values_and_fetch(
+            mock.MagicMock(), query, [(1,)])
+
+
+@pytest.mark.parametrize("num_stale_tracks, expected_deleted", [
+    pytest.param(0, False),
+    pytest.param(2, True),
+])
+def test_update_competition_standings(num_stale_tracks, expected_deleted):
+    competition = calculateprizes.CompetitionInfo(
+        id=1,
+        name="fake",
+        criteria=[PrizeCriterium.saved_co2.value],
+        winner_threshold=1,
+        start_date=None,
+        end_date=None,
+        age_groups=None,
+        region_of_interest=None
+    )
+    mock_cursor = mock.MagicMock()
+    mock_cursor.fetchone.return_value = (num_stale_tracks,)
+    calculateprizes.update_competition_standings(competition, mock_cursor)
+    executed = [call[0][0] for call in mock_cursor.execute.call_args_list]
+    delete_query = calculateprizes.get_query(
+        "delete-competition-standings.sql")
+    assert (delete_query in executed) == expected_deleted
+    assert executed[-1].startswith(
+        "-- add the contribution of tracks to the standings")
+
+
+def test_get_user_score_updates_standings_first():
+    competition = calculateprizes.CompetitionInfo(
+        id=1,
+        name="fake",
+        criteria=[
+            PrizeCriterium.saved_co2.value,
+            PrizeCriterium.bike_distance.value,
+        ],
+        winner_threshold=1,
+        start_date=None,
+        end_date=None,
+        age_groups=None,
+        region_of_interest=None
+    )
+    mock_cursor = mock.MagicMock()
+    mock_cursor.fetchone.return_value = (0,)
+    mock_cursor.fetchall.return_value = [
+        (PrizeCriterium.saved_co2.name, 10, 1.5, 1)]
+    result = calculateprizes.get_user_score(competition, 10, mock_cursor)
+    executed = [call[0][0] for call in mock_cursor.execute.call_args_list]
+    assert executed[-1] == calculateprizes.get_query(
+        "select-competition-standings.sql")
+    assert any(query.startswith(
+        "-- add the contribution of tracks to the standings")
+        for query in executed[:-1])
+    assert result == {
+        PrizeCriterium.saved_co2: 1.5,
+        PrizeCriterium.bike_distance: 0,
+    }
@@ -9,16 +9,23 @@
 #########################################################################
 
 import datetime as dt
+import pathlib
+from unittest import mock
+import zipfile
 
+import numpy as np
 import pytest
 import pytz
 
 pytestmark = pytest.mark.unit
 
 from smbbackend import processor
+from smbbackend import regions
 from smbbackend._constants import VehicleType
 from smbbackend import exceptions
 
+DATA_DIR = pathlib.Path(__file__).parents[1] / "data"
+
 
 @pytest.mark.parametrize("raw_data, expected", [
     (
@@ -346,3 +353,307 @@ def test_parse_point_raw_data(raw_data, expected):
 ])
 def test_validate_points(points):
     processor.validate_points(points)
+
+
+def test_claim_track_upload():
+    mock_cursor = mock.MagicMock()
+    mock_cursor.fetchone.return_value = ("fake-key",)
+    processor.claim_track_upload("fake-key", "fake-etag", mock_cursor)
+    assert mock_cursor.execute.call_count == 1
+    mock_cursor.fetchone.side_effect = [None, (12,)]
+    with pytest.raises(exceptions.DuplicateTrackError) as excinfo:
+        processor.claim_track_upload("fake-key", "fake-etag", mock_cursor)
+    assert excinfo.value.track_id == 12
+    assert mock_cursor.execute.call_args[0][0] == processor.get_query(
+        "select-track-upload-claim.sql")
+
+
+@pytest.mark.parametrize("existing", [
+    pytest.param((None,), id="failed ingestion"),
+    pytest.param(None, id="released claim"),
+])
+def test_claim_track_session(existing):
+    mock_cursor = mock.MagicMock()
+    mock_cursor.fetchone.return_value = (1,)
+    processor.claim_track_session(1, 123, mock_cursor)
+    mock_cursor.fetchone.side_effect = [None, existing]
+    with pytest.raises(exceptions.DuplicateTrackError) as excinfo:
+        processor.claim_track_session(1, 123, mock_cursor)
+    assert excinfo.value.track_id is None
+
+
+def test_ingest_points_releases_session_on_failure():
+    mock_cursor = mock.MagicMock()
+    mock_cursor.fetchone.return_value = (1,)
+    points = _get_data_track_points("track_1.csv")[:2]
+    with mock.patch.object(processor, "get_track_owner_internal_id",
+                           return_value=1):
+        with pytest.raises(exceptions.NonRecoverableError):
+            processor.ingest_points(points, "fake-uuid", mock_cursor)
+    assert mock_cursor.execute.call_args == mock.call(
+        processor.get_query("delete-track-session-claim.sql"),
+        {"owner_id": 1, "session_id": points[0].session_id}
+    )
+
+
+def test_ingest_points_without_points():
+    mock_cursor = mock.MagicMock()
+    with pytest.raises(exceptions.NonRecoverableError):
+        processor.ingest_points(iter([]), "fake-uuid", mock_cursor)
+    mock_cursor.execute.assert_not_called()
+
+
+def test_parse_point_lines():
+    lines = iter([
+        "0,0,0,0,0,0,0,0,0,0,0,0,43.84,10.50,0,0,0,1537193729,15,0,"
+        "1536830992079,2,0",
+        "",
+        "0,0,0,0,0,0,0,0,0,0,0,0,43.83,10.51,0,0,0,1537193729,15,0,"
+        "1536830986000,2,0",
+    ])
+    result = processor.parse_point_lines(lines)
+    assert [point.latitude for point in result] == [43.83, 43.84]
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_parse_point_archive(tmpdir, max_workers):
+    archive_path = str(tmpdir.join("track.zip"))
+    with zipfile.ZipFile(archive_path, "w") as zip_handler:
+        zip_handler.writestr(
+            "first.csv",
+            "header\n"
+            "0,0,0,0,0,0,0,0,0,0,0,0,43.81,10.50,0,0,0,1537193729,15,0,"
+            "1536830986000,2,0\n"
+            "0,0,0,0,0,0,0,0,0,0,0,0,43.83,10.50,0,0,0,1537193729,15,0,"
+            "1536830988000,2,0\n"
+        )
+        zip_handler.writestr(
+            "second.csv",
+            "header\n"
+            "0,0,0,0,0,0,0,0,0,0,0,0,43.82,10.50,0,0,0,1537193729,15,0,"
+            "1536830987000,2,0\n"
+        )
+    result = processor.parse_point_archive(
+        archive_path, max_workers=max_workers)
+    assert [point.latitude for point in result] == [43.81, 43.82, 43.83]
+
+
+@pytest.mark.parametrize("first_member, expected", [
+    pytest.param(
+        "header\n"
+        "0,0,0,0,0,0,0,0,0,0,0,0,43.81,10.50,0,0,0,1537193729,15,0,"
+        "1536830986000,2,0\n"
+        "0,0,0,0,0,0,0,0,0,0,0,0,43.83,10.50,0,0,0,1537193729,15,0,"
+        "1536830988000,2,0\n",
+        [43.81, 43.82, 43.83],
+        id="sorted"
+    ),
+    pytest.param(
+        "header\n"
+        "0,0,0,0,0,0,0,0,0,0,0,0,43.83,10.50,0,0,0,1537193729,15,0,"
+        "1536830988000,2,0\n"
+        "invalid\n"
+        "0,0,0,0,0,0,0,0,0,0,0,0,43.81,10.50,0,0,0,1537193729,15,0,"
+        "1536830986000,2,0\n",
+        [43.81, 43.82, 43.83],
+        id="unsorted"
+    ),
+])
+def test_parse_point_archive_lazily(tmpdir, first_member, expected):
+    archive_path = str(tmpdir.join("track.zip"))
+    with zipfile.ZipFile(archive_path, "w") as zip_handler:
+        zip_handler.writestr("first.csv", first_member)
+        zip_handler.writestr(
+            "second.csv",
+            "header\n"
+            "0,0,0,0,0,0,0,0,0,0,0,0,43.82,10.50,0,0,0,1537193729,15,0,"
+            "1536830987000,2,0\n"
+        )
+    result = processor.parse_point_archive(archive_path, max_workers=1)
+    assert not isinstance(result, list)
+    assert [point.latitude for point in result] == expected
+
+
+def test_iter_filtered_points_multiple_sessions():
+    points = processor.parse_point_lines([
+        "0,0,0,0,0,0,0,0,0,0,0,0,43.84,10.50,0,0,0,1,15,0,"
+        "1536830986000,2,0",
+        "0,0,0,0,0,0,0,0,0,0,0,0,43.83,10.51,0,0,0,2,15,0,"
+        "1536830992079,2,0",
+    ])
+    filtered = processor.iter_filtered_points(
+        points, accuracy_threshold=100, position_threshold=0.1)
+    assert next(filtered).session_id == 1
+    with pytest.raises(exceptions.NonRecoverableError):
+        next(filtered)
+
+
+class _FakePoint:
+
+    def __init__(self, seconds, x, speed=1, vehicle_type=VehicleType.bike):
+        self.timestamp = dt.datetime(2018, 1, 1, tzinfo=pytz.utc) + (
+            dt.timedelta(seconds=seconds))
+        self.x = x
+        self.speed = speed
+        self.vehicle_type = vehicle_type
+
+    def get_distance(self, other):
+        return abs(self.x - other.x)
+
+
+def test_iter_downsampled_points():
+    points = [_FakePoint(second, second) for second in range(10)]
+    points[3].speed = 10  # fastest
+    points[4].speed = 0  # slowest
+    points.extend([
+        _FakePoint(10, 10, vehicle_type=VehicleType.foot),  # boundary
+        _FakePoint(11, 11, vehicle_type=VehicleType.foot),
+        _FakePoint(12, 12, vehicle_type=VehicleType.foot),
+        _FakePoint(13, 13, vehicle_type=VehicleType.foot),
+    ])
+    stats = {}
+    result = list(processor.iter_downsampled_points(
+        points,
+        min_interval=5,
+        minute_threshold=5,
+        distance_thresholds={VehicleType.bike: 300, VehicleType.foot: 50},
+        stats=stats
+    ))
+    # the foot segment keeps one of its interior points, rather than only
+    # its first and last ones
+    assert [point.x for point in result] == [0, 3, 4, 5, 9, 10, 11, 13]
+    assert stats == {"points": 14, "kept": 8}
+
+
+@pytest.mark.parametrize("seconds, expected", [
+    ([0, 1], [0, 1]),
+    ([0, 1, 400], [0, 1, 400]),
+    ([0, 1, 2], [0, 1, 2]),
+    ([0, 1, 2, 3, 4, 5], [0, 1, 5]),
+    ([0, 400, 401, 402, 403], [0, 400, 401, 403]),
+])
+def test_iter_downsampled_points_keeps_three_points_per_segment(
+        seconds, expected):
+    points = [_FakePoint(second, second) for second in seconds]
+    result = list(processor.iter_downsampled_points(
+        points,
+        min_interval=100,
+        minute_threshold=5,
+        distance_thresholds={VehicleType.bike: 3000}
+    ))
+    assert [point.x for point in result] == expected
+
+
+def test_iter_downsampled_points_disabled():
+    points = [_FakePoint(second, second) for second in range(5)]
+    result = list(processor.iter_downsampled_points(points))
+    assert result == points
+
+
+@pytest.mark.parametrize("tolerance, expected", [
+    (0.5, [True, False, False, False, True]),
+    (0.4, [True, False, True, False, True]),
+    (0.05, [True, True, True, True, True]),
+])
+def test_get_simplification_mask(tolerance, expected):
+    coordinates = np.array([
+        [0, 0],
+        [1, 0.1],
+        [2, 1],
+        [3, 1.1],
+        [4, 1],
+    ])
+    result = processor.get_simplification_mask(coordinates, tolerance)
+    assert result.tolist() == expected
+
+
+def _summarize_segments(segments_data):
+    return [
+        (
+            segment[0].timestamp,
+            segment[-1].timestamp,
+            len(segment),
+            info.geometry.GetPoints(),
+            info[2:],
+            errors,
+        ) for segment, info, errors in segments_data
+    ]
+
+
+def _process_in_batch(points):
+    return _summarize_segments(processor.process_data(
+        points, mock.MagicMock(), **processor.DATA_PROCESSING_PARAMETERS))
+
+
+def _process_streamed(points):
+    saved = []
+    mock_cursor = mock.MagicMock()
+    with mock.patch.object(processor, "get_track_owner_internal_id"), \
+            mock.patch.object(processor, "insert_track", return_value=1), \
+            mock.patch.object(processor, "insert_segments"), \
+            mock.patch.object(
+                processor, "insert_points",
+                side_effect=lambda track_id, segments, cursor: saved.extend(
+                    segments)
+            ):
+        track_id, result = processor.save_streamed_track(
+            points[0].session_id,
+            processor.iter_processed_segments(
+                iter(points), mock_cursor,
+                **processor.DATA_PROCESSING_PARAMETERS
+            ),
+            "fake-uuid",
+            mock_cursor
+        )
+    assert [(info, errors) for _, info, errors in result] == [
+        (info, errors) for _, info, errors in saved]
+    return _summarize_segments(saved)
+
+
+@pytest.fixture
+def no_region_filter():
+    empty_filter = regions.RegionFilter(np.empty((0, 4)), [], np.array([]))
+    with mock.patch.object(
+            regions, "get_region_filter", return_value=empty_filter):
+        yield
+
+
+def _get_data_tracks():
+    return [
+        pytest.param(path.name, id=path.stem)
+        for path in sorted(DATA_DIR.glob("*.csv"))
+    ]
+
+
+def _get_data_track_points(track_name):
+    return processor.parse_point_raw_data(
+        (DATA_DIR / track_name).read_text())
+
+
+@pytest.mark.parametrize("track_name", _get_data_tracks())
+def test_streamed_processing_matches_batch(no_region_filter, track_name):
+    points = _get_data_track_points(track_name)
+    try:
+        expected = _process_in_batch(points)
+    except Exception as exc:
+        with pytest.raises(type(exc)):
+            _process_streamed(points)
+    else:
+        assert _process_streamed(points) == expected
+
+
+def test_streamed_processing_matches_batch_short_track(no_region_filter):
+    points = _get_data_track_points("track_1.csv")[:2]
+    with pytest.raises(exceptions.NonRecoverableError):
+        _process_in_batch(points)
+    with pytest.raises(exceptions.NonRecoverableError):
+        _process_streamed(points)
+
+
+def test_streamed_processing_matches_batch_invalid_track(no_region_filter):
+    points = _get_data_track_points("track_6.csv")
+    for point in points:
+        point.vehicle_type = VehicleType.foot
+    expected = _process_in_batch(points)
+    assert any(len(errors) > 0 for *_, errors in expected)
+    assert _process_streamed(points) == expected
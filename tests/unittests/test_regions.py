@@ -0,0 +1,73 @@
+#########################################################################
+#
+# Copyright 2018, GeoSolutions Sas.
+# All rights reserved.
+#
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+#
+#########################################################################
+
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from smbbackend import regions
+
+pytestmark = pytest.mark.unit
+
+
+def _square(min_x, min_y, max_x, max_y):
+    return np.array([
+        (min_x, min_y),
+        (max_x, min_y),
+        (max_x, max_y),
+        (min_x, max_y),
+        (min_x, min_y),
+    ], dtype=float)
+
+
+@pytest.fixture
+def region_filter():
+    # a box piece and a triangle piece with a hole
+    triangle = np.array([(2, 0), (6, 0), (2, 4), (2, 0)], dtype=float)
+    return regions.RegionFilter(
+        bounds=np.array([(0, 0, 2, 2), (2, 0, 6, 4)]),
+        rings=[[_square(0, 0, 2, 2)], [triangle, _square(2.5, 0.5, 3, 1)]],
+        is_box=np.array([True, False])
+    )
+
+
+@pytest.mark.parametrize("longitude, latitude, expected", [
+    pytest.param(1, 1, True, id="inside_box"),
+    pytest.param(3, 2, True, id="inside_triangle"),
+    pytest.param(5, 3, False, id="inside_triangle_bbox_only"),
+    pytest.param(2.75, 0.75, False, id="inside_hole"),
+    pytest.param(-1, 1, False, id="outside_extent"),
+])
+def test_region_filter_contains(region_filter, longitude, latitude,
+                                expected):
+    result = region_filter.contains(
+        np.array([longitude]), np.array([latitude]))
+    assert result.tolist() == [expected]
+
+
+def test_region_filter_without_pieces_accepts_all():
+    region_filter = regions.RegionFilter(np.empty((0, 4)), [], np.array([]))
+    result = region_filter.contains(np.array([1.0, 50.0]), np.array([1, 9]))
+    assert result.tolist() == [True, True]
+
+
+def test_get_region_filter_reloads_modified_regions():
+    mock_cursor = mock.MagicMock()
+    with mock.patch.dict(regions._REGION_FILTER_CACHE, clear=True), \
+            mock.patch.object(regions.utils, "get_regions_version",
+                              side_effect=["v1", "v1", "v2"]), \
+            mock.patch.object(regions, "update_track_region_pieces") as \
+            mock_update, \
+            mock.patch.object(regions.RegionFilter, "from_db") as mock_load:
+        for _ in range(3):
+            regions.get_region_filter(mock_cursor, max_age=300)
+    assert mock_update.call_count == 2
+    assert mock_load.call_count == 2
@@ -11,10 +11,11 @@
 import datetime as dt
 from unittest import mock
 
-import psycopg2
 import pytest
 
 from smbbackend import updatebadges
+from smbbackend import userstats
+from smbbackend._constants import BadgeName
 
 pytestmark = pytest.mark.unit
 
@@ -23,178 +24,28 @@ DATE_FMT = "%Y-%m-%d"
 
 
 @pytest.mark.parametrize(
-    "badge_name, badge_target, track_created, existing, expected",
+    "badge_name, badge_target, streak, expected",
     [
         pytest.param(
-            "data_collector_level0",
-            1,
-            "2018-01-01",
-            [
-                "2018-01-01",
-            ],
-            1,
-            id="level0_pass"
-        ),
+            BadgeName.data_collector_level0, 1, 1, 1, id="level0_pass"),
         pytest.param(
-            "data_collector_level1",
-            7,
-            "2018-02-01",
-            [
-                "2018-02-01",
-                "2018-01-31",
-                "2018-01-30",
-                "2018-01-29",
-                "2018-01-28",
-                "2018-01-27",
-                "2018-01-26",
-            ],
-            7,
-            id="level1_pass"
-        ),
+            BadgeName.data_collector_level0, 1, None, 0, id="level0_fail"),
         pytest.param(
-            "data_collector_level1",
-            7,
-            "2018-02-01",
-            [
-                "2018-02-01",
-                "2018-01-31",
-                "2018-01-30",
-                "2018-01-29",
-                "2018-01-27",
-                "2018-01-26",
-                "2018-01-25",
-            ],
-            0,
-            id="level1_fail"
-        ),
+            BadgeName.data_collector_level1, 7, 7, 7, id="level1_pass"),
         pytest.param(
-            "data_collector_level2",
-            14,
-            "2018-02-01",
-            [
-                "2018-02-01",
-                "2018-01-31",
-                "2018-01-30",
-                "2018-01-29",
-                "2018-01-28",
-                "2018-01-27",
-                "2018-01-26",
-                "2018-01-25",
-                "2018-01-24",
-                "2018-01-23",
-                "2018-01-22",
-                "2018-01-21",
-                "2018-01-20",
-                "2018-01-19",
-            ],
-            14,
-            id="level2_pass"
-        ),
+            BadgeName.data_collector_level1, 7, 4, 0, id="level1_fail"),
         pytest.param(
-            "data_collector_level2",
-            14,
-            "2018-02-01",
-            [
-                "2018-02-01",
-                "2018-01-31",
-                "2018-01-30",
-                "2018-01-29",
-                "2018-01-28",
-                "2018-01-27",
-                "2018-01-26",
-                "2018-01-25",
-                "2018-01-24",
-                "2018-01-23",
-                "2018-01-22",
-                "2018-01-21",
-                "2017-01-20",
-                "2018-01-19",
-            ],
-            0,
-            id="level2_fail"
-        ),
+            BadgeName.data_collector_level2, 14, 20, 14, id="level2_pass"),
         pytest.param(
-            "data_collector_level3",
-            30,
-            "2018-02-01",
-            [
-                "2018-02-01",
-                "2018-01-31",
-                "2018-01-30",
-                "2018-01-29",
-                "2018-01-28",
-                "2018-01-27",
-                "2018-01-26",
-                "2018-01-25",
-                "2018-01-24",
-                "2018-01-23",
-                "2018-01-22",
-                "2018-01-21",
-                "2018-01-20",
-                "2018-01-19",
-                "2018-01-18",
-                "2018-01-17",
-                "2018-01-16",
-                "2018-01-15",
-                "2018-01-14",
-                "2018-01-13",
-                "2018-01-12",
-                "2018-01-11",
-                "2018-01-10",
-                "2018-01-09",
-                "2018-01-08",
-                "2018-01-07",
-                "2018-01-06",
-                "2018-01-05",
-                "2018-01-04",
-                "2018-01-03",
-            ],
-            30,
-            id="level3_pass"
-        ),
+            BadgeName.data_collector_level2, 14, 13, 0, id="level2_fail"),
         pytest.param(
-            "data_collector_level3",
-            30,
-            "2018-02-01",
-            [
-                "2018-02-01",
-                "2018-01-31",
-                "2018-01-30",
-                "2018-01-29",
-                "2018-01-28",
-                "2018-01-27",
-                "2018-01-26",
-                "2018-01-25",
-                "2018-01-24",
-                "2018-01-23",
-                "2018-01-22",
-                "2018-01-21",
-                "2018-01-20",
-                "2018-01-19",
-                "2018-01-18",
-                "2018-01-17",
-                "2018-01-16",
-                "2018-01-15",
-                "2018-01-14",
-                "2018-01-13",
-                "2018-01-12",
-                "2018-01-11",
-                "2018-01-10",
-                "2018-01-09",
-                "2018-01-08",
-                "2018-01-07",
-                "2018-01-06",
-                "2018-01-05",
-                "2017-01-04",
-                "2018-01-03",
-            ],
-            0,
-            id="level3_fail"
-        ),
+            BadgeName.data_collector_level3, 30, 30, 30, id="level3_pass"),
+        pytest.param(
+            BadgeName.data_collector_level3, 30, 29, 0, id="level3_fail"),
     ]
 )
-def test_handle_data_collector_badge(badge_name, badge_target, track_created,
-                                     existing, expected):
+def test_handle_data_collector_badge(badge_name, badge_target, streak,
+                                     expected):
     badge = updatebadges.BadgeInfo(
         id=1,
         name=badge_name,
@@ -204,7 +55,7 @@ def test_handle_data_collector_badge(badge_name, badge_target, track_created,
     )
     track = updatebadges.TrackInfo(
         id=1,
-        created_at=dt.datetime.strptime(track_created, DATE_FMT),
+        created_at=dt.datetime(2018, 2, 1),
         owner_id=1,
         aggregated_costs={},
         aggregated_emissions={},
@@ -217,20 +68,16 @@ def test_handle_data_collector_badge(badge_name, badge_target, track_created,
         is_valid=True,
         validation_error=""
     )
-    mock_rows = [(dt.datetime.strptime(i, DATE_FMT),) for i in existing]
-    mock_cursor = mock.create_autospec(
-        psycopg2.extensions.cursor, instance=True)
-    mock_cursor.fetchall.return_value = mock_rows
-    result = updatebadges.handle_data_collector_badge(
-        badge, track, mock_cursor)
+    metrics = {"collection_streak": streak}
+    result = updatebadges.handle_data_collector_badge(badge, track, metrics)
     assert result == expected
 
 
 @pytest.mark.parametrize(
     "badge_name, track_created, existing, expected",
     [
-        ("biker_level1", "2018-02-01", ["2018-02-01"], 1),
-        ("biker_level1", "2018-02-01", ["2018-02-01", "2018-01-31"], 2),
+        (BadgeName.biker_level1, "2018-02-01", ["2018-02-01"], 1),
+        (BadgeName.biker_level1, "2018-02-01", ["2018-02-01", "2018-01-31"], 2),
     ]
 )
 def test_handle_biker_badge(badge_name, track_created, existing, expected):
@@ -262,9 +109,123 @@ def test_handle_biker_badge(badge_name, track_created, existing, expected):
         is_valid=True,
         validation_error=""
     )
-    mock_rows = [(dt.datetime.strptime(i, DATE_FMT),) for i in existing]
-    mock_cursor = mock.create_autospec(
-        psycopg2.extensions.cursor, instance=True)
-    mock_cursor.fetchall.return_value = mock_rows
-    result = updatebadges.handle_biker_badge(badge, track, mock_cursor)
+    metrics = {
+        "bike_days": [
+            dt.datetime.strptime(i, DATE_FMT).date() for i in existing]
+    }
+    result = updatebadges.handle_biker_badge(badge, track, metrics)
     assert result == expected
+
+
+@pytest.mark.parametrize("badge_names, expected", [
+    ([], set()),
+    (
+        [
+            BadgeName.bike_surfer_level1,
+            BadgeName.bike_surfer_level2,
+            BadgeName.bike_surfer_level3,
+        ],
+        {"bike_distance"}
+    ),
+    (
+        [
+            BadgeName.new_user,
+            BadgeName.healthy_level1,
+            BadgeName.data_collector_level2,
+        ],
+        {"calories_consumed", "collection_streak"}
+    ),
+])
+def test_get_required_metrics(badge_names, expected):
+    assert updatebadges.get_required_metrics(badge_names) == expected
+
+
+def test_get_pending_tiers():
+    badges_info = [
+        updatebadges.BadgeInfo(
+            id=index,
+            name=name,
+            acquired=name in (
+                BadgeName.new_user,
+                BadgeName.healthy_level1,
+                BadgeName.healthy_level2,
+                BadgeName.healthy_level3,
+                BadgeName.biker_level1,
+            ),
+            target=1,
+            progress=0
+        ) for index, name in enumerate(BadgeName)
+    ]
+    result = updatebadges.get_pending_tiers(badges_info)
+    families = {tier[0].name: [b.name for b in tier] for tier in result}
+    assert BadgeName.healthy_level1 not in families
+    assert BadgeName.new_user not in families
+    assert families[BadgeName.biker_level2] == [
+        BadgeName.biker_level2,
+        BadgeName.biker_level3,
+    ]
+    assert len(families[BadgeName.data_collector_level0]) == 4
+
+
+@pytest.mark.parametrize("money_saved, expected", [
+    (None, 0),
+    (12.5, 12.5),
+])
+def test_handle_money_saver_badge(money_saved, expected):
+    badge = updatebadges.BadgeInfo(
+        id=1,
+        name=BadgeName.money_saver_level1,
+        acquired=False,
+        target=10,
+        progress=0
+    )
+    result = updatebadges.handle_money_saver_badge(
+        badge, None, {"money_saved": money_saved})
+    assert result == expected
+
+
+def test_refresh_stale_user_stats():
+    mock_cursor = mock.MagicMock()
+    mock_cursor.fetchall.return_value = [(3,), (7,)]
+    with mock.patch.object(userstats, "rebuild_user_stats") as mock_rebuild:
+        result = userstats.refresh_stale_user_stats(mock_cursor, user_id=None)
+    assert result == [3, 7]
+    assert mock_rebuild.call_args_list == [
+        mock.call(mock_cursor, user_id=3),
+        mock.call(mock_cursor, user_id=7),
+    ]
+
+
+def test_update_badges_saves_progress_of_all_pending_levels():
+    badges_info = [
+        updatebadges.BadgeInfo(
+            id=index,
+            name=name,
+            acquired=False,
+            target=target,
+            progress=0
+        ) for index, (name, target) in enumerate([
+            (BadgeName.money_saver_level1, 10),
+            (BadgeName.money_saver_level2, 50),
+            (BadgeName.money_saver_level3, 100),
+        ])
+    ]
+    mock_cursor = mock.MagicMock()
+    with mock.patch.multiple(
+            updatebadges,
+            get_track_info=mock.DEFAULT,
+            refresh_stale_user_stats=mock.DEFAULT,
+            update_user_stats=mock.DEFAULT,
+            award_badge=mock.DEFAULT,
+            update_badges_progress=mock.DEFAULT,
+            get_badges_info=mock.MagicMock(return_value=badges_info),
+            get_badge_metrics=mock.MagicMock(
+                return_value={"money_saved": 60})
+    ) as mocks:
+        result = updatebadges.update_badges(1, mock_cursor)
+    assert result == [
+        BadgeName.money_saver_level1,
+        BadgeName.money_saver_level2,
+    ]
+    mocks["update_badges_progress"].assert_called_once_with(
+        [(0, 10), (1, 50), (2, 60)], mock_cursor)